@@ -20,38 +20,55 @@
 """
 
 import importlib
+import importlib.metadata
+import importlib.util
 import os
 import site
 
 from qgis.PyQt.QtWidgets import QMessageBox
 
 from Coregistration.utils import extralibs
+from Coregistration.utils.instrumentation import startup_timer
 
+# Result of the last dependency check, reused for the rest of the session
+_dependencies_ok = None
 
-def check_dependencies() -> bool:
-    """Return ``True`` if all required extra libraries are importable and meet the
+
+def check_dependencies(refresh: bool = False) -> bool:
+    """Return ``True`` if all required extra libraries are installed and meet the
     minimum version requirement (arosics >= 1.13).
-    """
-    try:
-        import arosics
 
-        # Reload so that newly-added extlibs are picked up when this function
-        # is called a second time after install().
-        importlib.reload(arosics)
+    The version is read from the package metadata, without importing the
+    arosics stack (numpy, scipy, geoarray...), which is only imported when an
+    algorithm runs. The result is cached, pass *refresh* after installing the
+    extra libraries.
+    """
+    global _dependencies_ok
+    if _dependencies_ok is not None and not refresh:
+        return _dependencies_ok
 
-        try:
-            from packaging import version as _v
+    # pick up the extlibs added to sys.path since the last check
+    importlib.invalidate_caches()
+    try:
+        arosics_version = importlib.metadata.version("arosics")
+    except importlib.metadata.PackageNotFoundError:
+        # installed without metadata: assume OK if the package can be found
+        _dependencies_ok = importlib.util.find_spec("arosics") is not None
+        return _dependencies_ok
 
-            return _v.parse(arosics.version.__version__) >= _v.parse("1.13")
-        except ImportError:
-            parts = arosics.version.__version__.split(".")
-            try:
-                return (int(parts[0]), int(parts[1])) >= (1, 13)
-            except (ValueError, IndexError):
-                return True  # cannot parse → assume OK
+    try:
+        from packaging import version as _v
 
+        _dependencies_ok = _v.parse(arosics_version) >= _v.parse("1.13")
     except ImportError:
-        return False
+        parts = arosics_version.split(".")
+        try:
+            _dependencies_ok = (int(parts[0]), int(parts[1])) >= (1, 13)
+        except (ValueError, IndexError):
+            _dependencies_ok = True  # cannot parse → assume OK
+    except Exception:
+        _dependencies_ok = True  # invalid version string → assume OK
+    return _dependencies_ok
 
 
 def pre_init_plugin() -> None:
@@ -76,15 +93,17 @@ def classFactory(iface):  # pylint: disable=invalid-name
     :param iface: A QGIS interface instance.
     :type iface: QgsInterface
     """
-    # Attempt to load bundled extra dependencies first
-    pre_init_plugin()
+    with startup_timer("dependency check"):
+        # Attempt to load bundled extra dependencies first
+        pre_init_plugin()
+        dependencies_ok = check_dependencies()
 
-    if not check_dependencies():
+    if not dependencies_ok:
         # Extra libs missing or outdated - download and install them, then retry
         extralibs.install()
         pre_init_plugin()
 
-        if not check_dependencies():
+        if not check_dependencies(refresh=True):
             msg = (
                 "Error loading libraries for Co-registration Plugin.\n\n"
                 "Read the install instructions here:\n"
@@ -97,8 +116,9 @@ def classFactory(iface):  # pylint: disable=invalid-name
                 QMessageBox.StandardButton.Ok,
             )
 
-    # Register icons under :/plugins/Coregistration/ before the plugin class is imported
-    from . import resources  # noqa: F401
-    from Coregistration.coregistration_plugin import CoregistrationPlugin
+    with startup_timer("plugin load"):
+        # Register icons under :/plugins/Coregistration/ before the plugin class is imported
+        from . import resources  # noqa: F401
+        from Coregistration.coregistration_plugin import CoregistrationPlugin
 
-    return CoregistrationPlugin()
+        return CoregistrationPlugin()
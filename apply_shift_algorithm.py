@@ -0,0 +1,376 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from qgis.core import (
+    Qgis,
+    QgsProcessingAlgorithm,
+    QgsProcessingContext,
+    QgsProcessingOutputMultipleLayers,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingUtils,
+)
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtGui import QIcon
+
+from Coregistration.automated_global_coregistration_algorithm import AutomatedGlobalCoregistrationAlgorithm
+from Coregistration.utils.coregistration_utils import apply_shift_worker
+from Coregistration.utils.instrumentation import StageProfiler
+from Coregistration.utils.raster_utils import get_output_names
+from Coregistration.utils.system_utils import get_default_cpus
+
+
+class ApplyShiftAlgorithm(QgsProcessingAlgorithm):
+    """
+    Applies a shift detected by the automated global co-registration to other
+    raster files of the same product, without matching them again.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+
+    INPUTS = "INPUTS"
+    X_SHIFT_MAP = "X_SHIFT_MAP"
+    Y_SHIFT_MAP = "Y_SHIFT_MAP"
+    IMG_REF = "IMG_REF"
+    ALIGN_GRIDS = "ALIGN_GRIDS"
+    MATCH_GSD = "MATCH_GSD"
+    RESAMPLING = "RESAMPLING"
+    THREADS = "THREADS"
+    OUTPUT_FOLDER = "OUTPUT_FOLDER"
+    STATS = "STATS"
+    OUTPUTS = "OUTPUTS"
+
+    resampling_methods = AutomatedGlobalCoregistrationAlgorithm.resampling_methods
+
+    def __init__(self):
+        super().__init__()
+        self.layers_to_refresh = []
+
+    def tr(self, string, context=""):
+        if context == "":
+            context = self.__class__.__name__
+        return QCoreApplication.translate(context, string)
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it.
+        """
+        html_help = (
+            "<p>Applies a shift already detected by the Automated global co-registration to several raster files, "
+            "for example the other bands, the quality masks or the angle grids of the matched image, so the whole "
+            "product is corrected with one matching. The shift is given in map units, as returned by the "
+            "co-registration outputs <i>X_SHIFT_MAP</i> and <i>Y_SHIFT_MAP</i>, and it is applied to every file "
+            "in its own pixel size.</p>"
+            "<p>The shift is a pure translation: each file gets only its georeferencing updated, without "
+            "resampling the pixel data. Skipping the output folder updates the input files in place; with an "
+            "output folder, every file is saved as <i>&lt;input name&gt;_shifted</i> in the same format as the "
+            "input (inputs with the same name in different folders get their folder name added).</p>"
+            "<p>Set the reference image to align the grids or match the pixel size to it: the files whose "
+            "shifted grid does not already fit the reference are then resampled, still in the format of the "
+            "input (this requires an output folder), the others keep the geotransform update.</p>"
+            "<p>Files are processed concurrently; a file that fails is reported and does not stop the rest of "
+            "the batch.</p>"
+        )
+        return html_help
+
+    def createInstance(self):
+        return ApplyShiftAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "apply_shift"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Apply a detected shift (multiple inputs)")
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return None
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return None
+
+    def icon(self):
+        return QIcon(":/plugins/Coregistration/icons/coregistration.svg")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.INPUTS,
+                self.tr("The input images to shift"),
+                layerType=Qgis.ProcessingSourceType.Raster,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.X_SHIFT_MAP,
+                self.tr("Shift in X (map units)"),
+                type=Qgis.ProcessingNumberParameterType.Double,
+                defaultValue=0,
+                optional=False,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.Y_SHIFT_MAP,
+                self.tr("Shift in Y (map units)"),
+                type=Qgis.ProcessingNumberParameterType.Double,
+                defaultValue=0,
+                optional=False,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.IMG_REF,
+                self.tr("The REFERENCE image, to align the grids or match the pixel size (optional)"),
+                optional=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.ALIGN_GRIDS,
+                self.tr("Align the input coordinate grid to the reference"),
+                defaultValue=False,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.MATCH_GSD,
+                self.tr("Match the input pixel size to the reference pixel size"),
+                defaultValue=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterEnum(
+            self.RESAMPLING,
+            self.tr("The resampling algorithm to be used for shift correction (if necessary)"),
+            options=[i[0] for i in self.resampling_methods],
+            defaultValue=2,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterNumber(
+            self.THREADS,
+            self.tr("Number of files processed at the same time"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=get_default_cpus(),
+            minValue=1,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr("Output folder for the shifted files (skip it to update the inputs in place)"),
+                optional=True,
+                createByDefault=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterFileDestination(
+            self.STATS,
+            self.tr("Processing statistics (JSON)"),
+            fileFilter="JSON files (*.json)",
+            optional=True,
+            createByDefault=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addOutput(QgsProcessingOutputMultipleLayers(self.OUTPUTS, self.tr("Shifted raster files")))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        def get_inputfilepath(layer):
+            return os.path.realpath(layer.source().split("|layername")[0])
+
+        profiler = StageProfiler(self.name())
+        profiler.start("open inputs")
+
+        # several layers can point to the same file, each file is shifted only once
+        layers_by_file = {}
+        for layer in self.parameterAsLayerList(parameters, self.INPUTS, context):
+            layers_by_file.setdefault(get_inputfilepath(layer), []).append(layer)
+        if not layers_by_file:
+            feedback.reportError("\nNo input images to shift.\n", fatalError=True)
+            return {}
+
+        x_shift_map = self.parameterAsDouble(parameters, self.X_SHIFT_MAP, context)
+        y_shift_map = self.parameterAsDouble(parameters, self.Y_SHIFT_MAP, context)
+        align_grids = self.parameterAsBoolean(parameters, self.ALIGN_GRIDS, context)
+        match_gsd = self.parameterAsBoolean(parameters, self.MATCH_GSD, context)
+        resampling_method = self.resampling_methods[self.parameterAsEnum(parameters, self.RESAMPLING, context)][1]
+        layer_ref = self.parameterAsRasterLayer(parameters, self.IMG_REF, context)
+        img_ref = None if layer_ref is None else get_inputfilepath(layer_ref)
+        if (align_grids or match_gsd) and img_ref is None:
+            feedback.reportError(
+                "\nAligning the grids or matching the pixel size requires the reference image.\n", fatalError=True
+            )
+            return {}
+
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        in_place = output_folder == ""
+        if not in_place:
+            os.makedirs(output_folder, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix="coregistration_", dir=QgsProcessingUtils.tempFolder())
+
+        feedback.pushInfo(f"Apply the shift x={x_shift_map:.3f}, y={y_shift_map:.3f} (map units) to multiple inputs:")
+
+        # inputs with the same file name (e.g. B01.jp2 of different granules) get unique output names
+        output_names = get_output_names(list(layers_by_file), "_shifted")
+        tasks = []
+        for file_in, output_name in zip(layers_by_file, output_names, strict=True):
+            # remove .aux.xml file
+            if os.path.isfile(file_in + ".aux.xml"):
+                os.remove(file_in + ".aux.xml")
+
+            output_file = None if in_place else os.path.join(output_folder, output_name)
+            tasks.append(
+                {
+                    "file_in": file_in,
+                    "output_file": output_file,
+                    "x_shift_map": x_shift_map,
+                    "y_shift_map": y_shift_map,
+                    "img_ref": img_ref,
+                    "align_grids": align_grids,
+                    "match_gsd": match_gsd,
+                    "resampling_method": resampling_method,
+                    "tmp_dir": tmp_dir,
+                }
+            )
+
+        # the work is mostly file I/O where GDAL releases the GIL, so threads are enough
+        threads = max(1, min(self.parameterAsInt(parameters, self.THREADS, context), len(tasks)))
+        feedback.pushInfo(f"\nShifting {len(tasks)} files using {threads} thread(s)...\n")
+
+        profiler.start("write")
+        results = []
+        executor = ThreadPoolExecutor(max_workers=threads)
+        try:
+            futures = [executor.submit(apply_shift_worker, task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                if feedback.isCanceled():
+                    break
+                result = future.result()
+                if result["error"]:
+                    feedback.reportError(f"{result['file_in']}: {result['error']}", fatalError=False)
+                else:
+                    feedback.pushInfo(f"{result['file_in']}: {result['method']} in {result['seconds']:.2f} s")
+                results.append(result)
+                feedback.setProgress(100 * done / len(tasks))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        shifted = [result for result in results if not result["error"]]
+
+        if in_place:
+            # the layers are rebuilt in postProcessAlgorithm, once for the whole batch
+            self.layers_to_refresh = [layer for result in shifted for layer in layers_by_file[result["file_in"]]]
+        else:
+            for result in shifted:
+                context.addLayerToLoadOnCompletion(
+                    result["output_file"],
+                    QgsProcessingContext.LayerDetails(
+                        os.path.splitext(os.path.basename(result["output_file"]))[0], context.project(), self.OUTPUTS
+                    ),
+                )
+
+        if feedback.isCanceled():
+            return {}
+
+        resampled = sum(result["method"] == "resampled" for result in shifted)
+        feedback.pushInfo(
+            f"\n{len(shifted)} of {len(tasks)} files shifted ({resampled} resampled), "
+            f"{len(results) - len(shifted)} failed"
+        )
+        profiler.report(feedback, self.parameterAsFileOutput(parameters, self.STATS, context))
+        feedback.pushInfo("DONE\n")
+
+        return {
+            self.OUTPUT_FOLDER: output_folder,
+            self.OUTPUTS: [result["output_file"] for result in shifted],
+        }
+
+    def postProcessAlgorithm(self, context, feedback):
+        """
+        Refreshes the layers updated in place, in the main thread and only once
+        at the end of the batch.
+        """
+        # Re-bind every layer to its source so QGIS fully rebuilds its internal
+        # state (see PanningPixelAdjustmentAlgorithm), the canvas then repaints
+        # once for all the layers.
+        for layer in self.layers_to_refresh:
+            layer.dataProvider().reloadData()
+            layer.setDataSource(layer.source(), layer.name(), layer.providerType(), False)
+        for layer in self.layers_to_refresh:
+            layer.triggerRepaint()
+        self.layers_to_refresh = []
+
+        return {}
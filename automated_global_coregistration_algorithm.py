@@ -19,12 +19,17 @@
 """
 
 import os
+import statistics
+import tempfile
 
+from osgeo import gdal
 from qgis.core import (
     Qgis,
     QgsProcessingAlgorithm,
+    QgsProcessingOutputNumber,
     QgsProcessingParameterBoolean,
     QgsProcessingParameterEnum,
+    QgsProcessingParameterFileDestination,
     QgsProcessingParameterNumber,
     QgsProcessingParameterPoint,
     QgsProcessingParameterRasterDestination,
@@ -34,7 +39,35 @@ from qgis.core import (
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.PyQt.QtGui import QIcon
 
-from Coregistration.utils.system_utils import get_raster_driver_name_by_extension, redirect_output_to_feedback
+from Coregistration.utils.coregistration_utils import (
+    coarse_shift_task,
+    combine_shifts,
+    coregister_global_task,
+    create_preshifted_vrts,
+    get_fine_max_shift,
+    get_pyramid_factor,
+    get_window_centers,
+    match_window_worker,
+    shift_requires_resampling,
+    write_resampled_raster,
+    write_shifted_vrt,
+)
+from Coregistration.utils.instrumentation import StageProfiler
+from Coregistration.utils.raster_utils import (
+    copy_raster_files,
+    get_creation_options,
+    get_overview_resampling,
+    get_performance_settings,
+    set_geotransform,
+    shift_geotransform,
+)
+from Coregistration.utils.system_utils import (
+    configure_multiprocessing,
+    get_default_cpus,
+    get_raster_driver_name_by_extension,
+    run_in_process_pool,
+    run_in_subprocess,
+)
 
 
 class AutomatedGlobalCoregistrationAlgorithm(QgsProcessingAlgorithm):
@@ -53,10 +86,29 @@ class AutomatedGlobalCoregistrationAlgorithm(QgsProcessingAlgorithm):
     MATCH_GSD = "MATCH_GSD"
     MATCHING_WINDOW_CENTER = "MATCHING_WINDOW_CENTER"
     MATCHING_WINDOW_SIZE = "MATCHING_WINDOW_SIZE"
+    NUM_WINDOWS = "NUM_WINDOWS"
     MAX_SHIFT = "MAX_SHIFT"
+    COARSE_TO_FINE = "COARSE_TO_FINE"
     RESAMPLING = "RESAMPLING"
-    MASK = "MASK"
+    MASK_REF = "MASK_REF"
+    MASK_TGT = "MASK_TGT"
+    OUTPUT_MODE = "OUTPUT_MODE"
+    COG = "COG"
+    STATS = "STATS"
     OUTPUT = "OUTPUT"
+    X_SHIFT_MAP = "X_SHIFT_MAP"
+    Y_SHIFT_MAP = "Y_SHIFT_MAP"
+    X_SHIFT_PX = "X_SHIFT_PX"
+    Y_SHIFT_PX = "Y_SHIFT_PX"
+    RELIABILITY = "RELIABILITY"
+    SSIM_BEFORE = "SSIM_BEFORE"
+    SSIM_AFTER = "SSIM_AFTER"
+
+    output_modes = (
+        "Resample the pixel data (full correction)",
+        "Update only the geotransform, in a copy of the target image (if no resampling is required)",
+        "Update only the geotransform, in place in the target image (if no resampling is required)",
+    )
 
     resampling_methods = (
         ("Nearest Neighbour", "nearest"),
@@ -75,6 +127,7 @@ class AutomatedGlobalCoregistrationAlgorithm(QgsProcessingAlgorithm):
 
     def __init__(self):
         super().__init__()
+        self.layer_to_refresh = None
 
     def tr(self, string, context=""):
         if context == "":
@@ -98,6 +151,29 @@ class AutomatedGlobalCoregistrationAlgorithm(QgsProcessingAlgorithm):
             "<p>It is designed to robustly handle the typical difficulties of multi-sensor/multi-temporal "
             "images.</p>"
             "<p>Key parameters: matching window center and size, maximum shift distance.</p>"
+            "<p>With the COG option, the output is written as a Cloud Optimized GeoTIFF: tiled, compressed and "
+            "with internal overviews built in the same pass, so it renders quickly without building pyramids.</p>"
+            "<p>With more than one matching window, the shift is detected in that many windows spread over the "
+            "image overlap (plus the custom window center, if given), matched in parallel worker processes, and "
+            "the accepted shifts are combined with a robust estimator (median with outlier rejection). A window "
+            "falling on water or clouds does not make the whole run fail.</p>"
+            "<p>For large maximum shifts, the coarse-to-fine matching first estimates the shift on decimated "
+            "copies of the images (read from the GDAL overviews when present), then refines it at full "
+            "resolution searching only a few pixels around that estimate.</p>"
+            "<p>Optionally, bad data masks (e.g. clouds) of the reference and/or target image can be given, "
+            "with the same extent and projection as their image and value 1 on the pixels to skip. A matching "
+            "window that falls on masked pixels is rejected before matching.</p>"
+            "<p>When the correction is a pure translation that does not require resampling (no grid alignment "
+            "or pixel size change), the output mode can apply it by only updating the geotransform, either in "
+            "a copy of the target image or in place, without rewriting the pixel data. In place, the output file "
+            "can be skipped; when given, it is only written if the correction turns out to require resampling. "
+            "With a <i>.vrt</i> output file, the result is a virtual raster carrying the shifted geotransform "
+            "(warped onto the reference grid if resampling is required) that is read lazily by the next "
+            "processing step.</p>"
+            "<p>The detected shift is also returned as outputs: X/Y in map units and in target pixels (with the "
+            "sign of the map shift, as the Panning pixel adjustment), its reliability and the SSIM before and "
+            "after the correction. In a model, they can feed <i>Apply a detected shift</i> to correct the other "
+            "files of the same product (bands, masks, angle grids) without matching them again.</p>"
             "<p>[1] This algorithm uses AROSICS software developed by Daniel Scheffler — "
             "<a href='https://danschef.git-pages.gfz-potsdam.de/arosics/doc/'>documentation</a> and "
             "<a href='https://doi.org/10.3390/rs9070676'>"
@@ -202,6 +278,17 @@ class AutomatedGlobalCoregistrationAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        parameter = QgsProcessingParameterNumber(
+            self.NUM_WINDOWS,
+            self.tr("Number of matching windows spread over the overlap, combined robustly (1 = single window)"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=1,
+            minValue=1,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
         parameter = QgsProcessingParameterNumber(
             self.MAX_SHIFT,
             self.tr("Maximum shift distance in reference image pixel units"),
@@ -212,6 +299,14 @@ class AutomatedGlobalCoregistrationAlgorithm(QgsProcessingAlgorithm):
         parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
         self.addParameter(parameter)
 
+        parameter = QgsProcessingParameterBoolean(
+            self.COARSE_TO_FINE,
+            self.tr("Coarse-to-fine matching, faster for large maximum shifts"),
+            defaultValue=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
         parameter = QgsProcessingParameterEnum(
             self.RESAMPLING,
             self.tr("The resampling algorithm to be used for shift correction (if necessary)"),
@@ -222,16 +317,83 @@ class AutomatedGlobalCoregistrationAlgorithm(QgsProcessingAlgorithm):
         parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
         self.addParameter(parameter)
 
+        parameter = QgsProcessingParameterRasterLayer(
+            self.MASK_REF,
+            self.tr("Bad data mask of the REFERENCE image (e.g. clouds), pixels to skip with value 1"),
+            optional=True,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterRasterLayer(
+            self.MASK_TGT,
+            self.tr("Bad data mask of the TARGET image (e.g. clouds), pixels to skip with value 1"),
+            optional=True,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.OUTPUT_MODE,
+                self.tr("How to apply the detected shift"),
+                options=[self.tr(mode) for mode in self.output_modes],
+                defaultValue=0,
+                optional=False,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.COG,
+                self.tr("Write the output as Cloud Optimized GeoTIFF (COG) with overviews (.tif output only)"),
+                defaultValue=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterFileDestination(
+            self.STATS,
+            self.tr("Processing statistics (JSON)"),
+            fileFilter="JSON files (*.json)",
+            optional=True,
+            createByDefault=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
         self.addParameter(
-            QgsProcessingParameterRasterDestination(self.OUTPUT, self.tr("Output co-registered raster file"))
+            QgsProcessingParameterRasterDestination(
+                self.OUTPUT,
+                self.tr("Output co-registered raster file (can be skipped to update the target in place)"),
+                optional=True,
+            )
         )
 
+        # the detected shift, to apply it to other rasters of the same product (Apply a detected shift)
+        self.addOutput(QgsProcessingOutputNumber(self.X_SHIFT_MAP, self.tr("Detected shift in X (map units)")))
+        self.addOutput(QgsProcessingOutputNumber(self.Y_SHIFT_MAP, self.tr("Detected shift in Y (map units)")))
+        self.addOutput(QgsProcessingOutputNumber(self.X_SHIFT_PX, self.tr("Detected shift in X (target pixels)")))
+        self.addOutput(QgsProcessingOutputNumber(self.Y_SHIFT_PX, self.tr("Detected shift in Y (target pixels)")))
+        self.addOutput(QgsProcessingOutputNumber(self.RELIABILITY, self.tr("Reliability of the shift (%)")))
+        self.addOutput(QgsProcessingOutputNumber(self.SSIM_BEFORE, self.tr("SSIM before the correction")))
+        self.addOutput(QgsProcessingOutputNumber(self.SSIM_AFTER, self.tr("SSIM after the correction")))
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
+        # the temporary files (decimated and pre-shifted VRTs, resampling VRTs) are removed at the end, whatever happens
+        with tempfile.TemporaryDirectory(
+            prefix="coregistration_", dir=QgsProcessingUtils.tempFolder(), ignore_cleanup_errors=True
+        ) as tmp_dir:
+            return self.process(parameters, context, feedback, tmp_dir)
+
+    def process(self, parameters, context, feedback, tmp_dir):
+        """
+        Runs the algorithm with its temporary files in *tmp_dir*.
+        """
         try:
-            from arosics import COREG
+            import arosics  # noqa: F401
         except Exception:
             msg = (
                 "\nError loading AROSICS, this plugin requires additional Python packages to work. "
@@ -244,6 +406,9 @@ class AutomatedGlobalCoregistrationAlgorithm(QgsProcessingAlgorithm):
         def get_inputfilepath(layer):
             return os.path.realpath(layer.source().split("|layername")[0])
 
+        profiler = StageProfiler(self.name())
+        profiler.start("open inputs")
+
         img_ref = get_inputfilepath(self.parameterAsRasterLayer(parameters, self.IMG_REF, context))
         img_tgt = get_inputfilepath(self.parameterAsRasterLayer(parameters, self.INPUT, context))
 
@@ -254,6 +419,11 @@ class AutomatedGlobalCoregistrationAlgorithm(QgsProcessingAlgorithm):
             )
             return {}
 
+        mask_ref = self.parameterAsRasterLayer(parameters, self.MASK_REF, context)
+        mask_ref = get_inputfilepath(mask_ref) if mask_ref else None
+        mask_tgt = self.parameterAsRasterLayer(parameters, self.MASK_TGT, context)
+        mask_tgt = get_inputfilepath(mask_tgt) if mask_tgt else None
+
         align_grids = self.parameterAsBoolean(parameters, self.ALIGN_GRIDS, context)
         match_gsd = self.parameterAsBoolean(parameters, self.MATCH_GSD, context)
 
@@ -270,12 +440,31 @@ class AutomatedGlobalCoregistrationAlgorithm(QgsProcessingAlgorithm):
             wp_y = matching_window_center.y()
 
         ws_x = ws_y = self.parameterAsInt(parameters, self.MATCHING_WINDOW_SIZE, context)
+        num_windows = self.parameterAsInt(parameters, self.NUM_WINDOWS, context)
 
         max_shift = self.parameterAsInt(parameters, self.MAX_SHIFT, context)
+        coarse_to_fine = self.parameterAsBoolean(parameters, self.COARSE_TO_FINE, context)
         resampling_method = self.resampling_methods[self.parameterAsEnum(parameters, self.RESAMPLING, context)][1]
+        output_mode = self.parameterAsEnum(parameters, self.OUTPUT_MODE, context)
 
         output_file = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
-        output_driver_name = get_raster_driver_name_by_extension(output_file)
+        if not output_file and output_mode != 2:
+            feedback.reportError(
+                "\nThe output file is required, it can only be skipped when the target is updated in place.\n",
+                fatalError=True,
+            )
+            return {}
+        cog = self.parameterAsBoolean(parameters, self.COG, context)
+        output_driver_name = get_raster_driver_name_by_extension(output_file, cog=cog)
+        if cog and output_driver_name != "COG":
+            feedback.pushWarning("\nThe COG option requires a .tif output file, it is ignored.\n")
+        creation_options = None
+        if output_driver_name == "COG":
+            performance = get_performance_settings(0)
+            performance["overview_resampling"] = get_overview_resampling(resampling_method)
+            tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+            creation_options = get_creation_options("COG", performance, tgt_ds.GetRasterBand(1).DataType)
+            tgt_ds = None
 
         # fix save and load ENVI files
         if output_driver_name == "ENVI":
@@ -293,25 +482,267 @@ class AutomatedGlobalCoregistrationAlgorithm(QgsProcessingAlgorithm):
         feedback.pushInfo("Image to image Co-Registration:")
         feedback.pushInfo("\nProcessing file: " + img_tgt)
 
-        feedback.pushInfo("\nPerform automatic subpixel co-registration with AROSICS...\n")
-        with redirect_output_to_feedback(feedback):
-            CR = COREG(
-                img_ref,
-                img_tgt,
-                path_out=output_file,
-                align_grids=align_grids,
-                match_gsd=match_gsd,
-                wp=(wp_x, wp_y),
-                ws=(ws_x, ws_y),
-                resamp_alg_deshift=resampling_method,
-                max_shift=max_shift,
-                max_iter=15,
-                fmt_out=output_driver_name,
-                out_crea_options=["WRITE_METADATA=NO"],
-                CPUs=1,
+        # the image that is matched and corrected, the target itself or its coarse pre-shifted VRT
+        coreg_tgt, coreg_mask_tgt = img_tgt, mask_tgt
+        factor = get_pyramid_factor(max_shift) if coarse_to_fine else 1
+        if factor > 1:
+            feedback.pushInfo(f"\nEstimating the shift on the images decimated by a factor of {factor}...\n")
+            profiler.start("coarse matching")
+            # AROSICS runs in a worker process that is terminated when the user cancels
+            coarse_shift = run_in_subprocess(
+                coarse_shift_task,
+                {
+                    "img_ref": img_ref,
+                    "img_tgt": img_tgt,
+                    "max_shift": max_shift,
+                    "factor": factor,
+                    "tmp_dir": tmp_dir,
+                    "mask_ref": mask_ref,
+                    "mask_tgt": mask_tgt,
+                    "options": {"wp": (wp_x, wp_y), "ws": (ws_x, ws_y), "max_iter": 15, "CPUs": 1},
+                },
+                feedback,
+            )
+            if coarse_shift is None:
+                return {}
+            feedback.pushInfo(f"Coarse shift (map units): x={coarse_shift[0]:.3f}, y={coarse_shift[1]:.3f}")
+            coreg_tgt, coreg_mask_tgt = create_preshifted_vrts(img_tgt, mask_tgt, *coarse_shift, tmp_dir)
+            max_shift = get_fine_max_shift(max_shift, factor)
+        elif coarse_to_fine:
+            feedback.pushInfo("The maximum shift is small, the coarse-to-fine matching is not needed")
+
+        # AROSICS cannot write a virtual raster, it is built from the detected shift
+        write_vrt = output_driver_name == "VRT" and output_mode != 2
+        # a COG is written by GDAL from the shifted VRT, building its overviews in the same pass
+        arosics_writes = output_mode == 0 and not write_vrt and output_driver_name != "COG"
+
+        if num_windows > 1:
+            corrected = False
+            options = {
+                "ws": (ws_x, ws_y),
+                "max_shift": max_shift,
+                "max_iter": 15,
+                "mask_baddata_ref": mask_ref,
+                "mask_baddata_tgt": coreg_mask_tgt,
+            }
+            window_center = None if wp_x is None else (wp_x, wp_y)
+            shift = self.match_windows(img_ref, coreg_tgt, num_windows, window_center, options, feedback, profiler)
+            if shift is None:
+                return {}
+            x_shift_map, y_shift_map = shift["x_shift_map"], shift["y_shift_map"]
+        else:
+            feedback.pushInfo("\nPerform automatic subpixel co-registration with AROSICS...\n")
+            options = {
+                "align_grids": align_grids,
+                "match_gsd": match_gsd,
+                "wp": (wp_x, wp_y),
+                "ws": (ws_x, ws_y),
+                "resamp_alg_deshift": resampling_method,
+                "max_shift": max_shift,
+                "max_iter": 15,
+                "mask_baddata_ref": mask_ref,
+                "mask_baddata_tgt": coreg_mask_tgt,
+                "out_crea_options": ["WRITE_METADATA=NO"],
+                "CPUs": 1,
+            }
+            # without output file (in place), AROSICS writes nothing and keeps its default format
+            if output_driver_name:
+                options["fmt_out"] = output_driver_name
+            # AROSICS runs in a worker process that is terminated when the user cancels
+            shift = run_in_subprocess(
+                coregister_global_task,
+                {
+                    "img_ref": img_ref,
+                    "img_tgt": coreg_tgt,
+                    "options": options,
+                    "output_file": output_file if arosics_writes else None,
+                },
+                feedback,
+                on_stage=profiler.start,
+                output_files=[output_file] if arosics_writes else [],
+                output_driver_name=output_driver_name,
             )
-            CR.correct_shifts()
+            if shift is None:
+                return {}
+            x_shift_map, y_shift_map = shift["x_shift_map"], shift["y_shift_map"]
+            corrected = arosics_writes
+
+        if not corrected:
+            profiler.start("write")
+            # the geotransform of the pre-shifted VRT already includes the coarse shift
+            tgt_ds = gdal.Open(coreg_tgt, gdal.GA_ReadOnly)
+            shifted_gt = shift_geotransform(tgt_ds.GetGeoTransform(), x_shift_map, y_shift_map)
+            tgt_ds = None
+            tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+            tgt_driver_name = tgt_ds.GetDriver().ShortName
+            tgt_ds = None
+
+            if write_vrt:
+                feedback.pushInfo("\nWriting the shift correction as a virtual raster (VRT)...")
+                write_shifted_vrt(img_ref, img_tgt, output_file, shifted_gt, align_grids, match_gsd, resampling_method)
+            elif output_mode == 0 or shift_requires_resampling(img_ref, img_tgt, shifted_gt, align_grids, match_gsd):
+                if output_mode == 2 and not output_file:
+                    feedback.reportError(
+                        "\nThe correction requires resampling (grid alignment, pixel size or projection change), "
+                        "it cannot be applied in place. Set an output file for the resampled image.\n",
+                        fatalError=True,
+                    )
+                    return {}
+                if output_mode != 0:
+                    feedback.pushWarning(
+                        "\nThe correction requires resampling (grid alignment, pixel size or projection change), "
+                        "the pixel data is resampled into the output file instead.\n"
+                    )
+                write_resampled_raster(
+                    img_ref,
+                    img_tgt,
+                    output_file,
+                    shifted_gt,
+                    align_grids,
+                    match_gsd,
+                    resampling_method,
+                    output_driver_name,
+                    tmp_dir,
+                    creation_options=creation_options,
+                )
+            elif output_mode == 1:
+                feedback.pushInfo("\nApplying the shift by updating the geotransform of a copy of the target...")
+                if output_driver_name == tgt_driver_name:
+                    copy_raster_files(img_tgt, output_file)
+                    set_geotransform(output_file, shifted_gt)
+                else:
+                    # different output format: rewrite the pixels as they are, without resampling
+                    min_x, max_y = shifted_gt[0], shifted_gt[3]
+                    tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+                    max_x = min_x + tgt_ds.RasterXSize * shifted_gt[1]
+                    min_y = max_y + tgt_ds.RasterYSize * shifted_gt[5]
+                    tgt_ds = None
+                    gdal.Translate(
+                        output_file,
+                        img_tgt,
+                        format=output_driver_name,
+                        outputBounds=[min_x, max_y, max_x, min_y],
+                        creationOptions=creation_options,
+                    )
+            else:
+                feedback.pushInfo("\nApplying the shift by updating the geotransform of the target in place...")
+                set_geotransform(img_tgt, shifted_gt)
+                if output_file:
+                    feedback.pushInfo(
+                        "The output file is not written, it is only used when the correction requires resampling."
+                    )
+
+                # the result is the input layer itself, reload it instead of adding it again
+                layers_to_load = context.layersToLoadOnCompletion()
+                layers_to_load.pop(output_file, None)
+                context.setLayersToLoadOnCompletion(layers_to_load)
+                output_file = img_tgt
+
+                # the layer is rebuilt in postProcessAlgorithm, in the main thread
+                self.layer_to_refresh = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+
+        # the total shift of the target, the geotransform of a pre-shifted target includes the coarse shift
+        if factor > 1:
+            x_shift_map, y_shift_map = x_shift_map + coarse_shift[0], y_shift_map + coarse_shift[1]
+        tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+        tgt_gt = tgt_ds.GetGeoTransform()
+        tgt_ds = None
+        feedback.pushInfo(
+            f"\nDetected shift: x={x_shift_map:.3f}, y={y_shift_map:.3f} (map units), "
+            f"x={x_shift_map / abs(tgt_gt[1]):.3f}, y={y_shift_map / abs(tgt_gt[5]):.3f} (target pixels)"
+        )
 
+        profiler.report(feedback, self.parameterAsFileOutput(parameters, self.STATS, context))
         feedback.pushInfo("DONE\n")
 
-        return {self.OUTPUT: output_file}
+        return {
+            self.OUTPUT: output_file,
+            self.X_SHIFT_MAP: x_shift_map,
+            self.Y_SHIFT_MAP: y_shift_map,
+            self.X_SHIFT_PX: x_shift_map / abs(tgt_gt[1]),
+            self.Y_SHIFT_PX: y_shift_map / abs(tgt_gt[5]),
+            self.RELIABILITY: shift["reliability"],
+            self.SSIM_BEFORE: shift["ssim_before"],
+            self.SSIM_AFTER: shift["ssim_after"],
+        }
+
+    def postProcessAlgorithm(self, context, feedback):
+        """
+        Refreshes the target layer updated in place, in the main thread.
+        """
+        # Re-bind the layer to its source so QGIS fully rebuilds its internal
+        # state (see PanningPixelAdjustmentAlgorithm).
+        if self.layer_to_refresh is not None:
+            layer = self.layer_to_refresh
+            layer.dataProvider().reloadData()
+            layer.setDataSource(layer.source(), layer.name(), layer.providerType(), False)
+            layer.triggerRepaint()
+            self.layer_to_refresh = None
+
+        return {}
+
+    @staticmethod
+    def match_windows(img_ref, img_tgt, num_windows, window_center, options, feedback, profiler):
+        """Detect the shift in *num_windows* windows spread over the overlap and combine them.
+
+        The windows are matched concurrently in a process pool, terminated when
+        the user cancels, and the accepted
+        shifts are combined with a robust estimator (median, MAD outlier
+        rejection). If *window_center* is given it is the first window.
+
+        :return: a dict with the combined ``x_shift_map`` and ``y_shift_map``
+            and the median ``reliability``, ``ssim_before`` and ``ssim_after``
+            of the accepted windows, or ``None`` if canceled or no window could
+            be matched.
+        """
+        centers = get_window_centers(img_ref, img_tgt, num_windows, options["ws"][0])
+        if window_center is not None:
+            centers = [window_center, *centers[: num_windows - 1]]
+        tasks = [{"img_ref": img_ref, "img_tgt": img_tgt, "wp": wp, "options": options} for wp in centers]
+
+        profiler.start("window read and FFT matching")
+
+        cpus = min(len(tasks), get_default_cpus())
+        if cpus > 1 and not configure_multiprocessing():
+            feedback.pushWarning("Python interpreter not found to start worker processes, running in serial mode")
+            cpus = 1
+        feedback.pushInfo(f"\nMatching {len(tasks)} windows with AROSICS using {cpus} CPU(s)...\n")
+        results = []
+        for done, (_task, result) in enumerate(run_in_process_pool(match_window_worker, tasks, cpus, feedback), 1):
+            x, y = result["wp"]
+            if result["success"]:
+                feedback.pushInfo(
+                    f"Window ({x:.2f}, {y:.2f}): shift x={result['x_shift_map']:.3f}, "
+                    f"y={result['y_shift_map']:.3f} (reliability {result['reliability'] or 0:.1f}%)"
+                )
+                results.append(result)
+            else:
+                feedback.pushInfo(f"Window ({x:.2f}, {y:.2f}): rejected ({result['error'] or 'not reliable'})")
+            feedback.setProgress(80 * done / len(tasks))
+        if feedback.isCanceled():
+            return None
+
+        if not results:
+            feedback.reportError("\nNo matching window could be matched successfully.\n", fatalError=True)
+            return None
+
+        profiler.start("outlier filtering")
+        tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+        half_pixel = 0.5 * abs(tgt_ds.GetGeoTransform()[1])
+        tgt_ds = None
+        shifts = [(result["x_shift_map"], result["y_shift_map"]) for result in results]
+        x_shift_map, y_shift_map, inliers = combine_shifts(shifts, min_tolerance=half_pixel)
+        feedback.pushInfo(
+            f"\nCombined shift of {sum(inliers)} of {len(tasks)} windows (map units): "
+            f"x={x_shift_map:.3f}, y={y_shift_map:.3f}\n"
+        )
+        shift = {"x_shift_map": x_shift_map, "y_shift_map": y_shift_map}
+        # the quality of the combined shift is the median of the accepted windows
+        for key in ("reliability", "ssim_before", "ssim_after"):
+            values = [
+                result[key]
+                for result, inlier in zip(results, inliers, strict=True)
+                if inlier and result[key] is not None
+            ]
+            shift[key] = statistics.median(values) if values else None
+        return shift
@@ -0,0 +1,410 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import csv
+import os
+
+from osgeo import gdal
+from qgis.core import (
+    Qgis,
+    QgsProcessingAlgorithm,
+    QgsProcessingContext,
+    QgsProcessingOutputMultipleLayers,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer,
+)
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtGui import QIcon
+
+from Coregistration.utils.coregistration_utils import (
+    SHIFT_ATTRIBUTES,
+    coregister_global_worker,
+    init_reference_worker,
+    load_reference_window,
+)
+from Coregistration.utils.instrumentation import StageProfiler
+from Coregistration.utils.raster_utils import get_output_names
+from Coregistration.utils.system_utils import (
+    configure_multiprocessing,
+    get_default_cpus,
+    get_start_method,
+    limit_workers_by_memory,
+    run_in_process_pool,
+)
+
+
+class AutomatedGlobalCoregistrationBatchAlgorithm(QgsProcessingAlgorithm):
+    """
+    Detects and corrects a global X/Y shift of several target images against
+    one shared reference image, processing the targets in a process pool.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+
+    IMG_REF = "IMG_REF"
+    INPUTS = "INPUTS"
+    ALIGN_GRIDS = "ALIGN_GRIDS"
+    MATCH_GSD = "MATCH_GSD"
+    MATCHING_WINDOW_SIZE = "MATCHING_WINDOW_SIZE"
+    MAX_SHIFT = "MAX_SHIFT"
+    RESAMPLING = "RESAMPLING"
+    CPUS = "CPUS"
+    OUTPUT_FOLDER = "OUTPUT_FOLDER"
+    OUTPUT_TABLE = "OUTPUT_TABLE"
+    STATS = "STATS"
+    OUTPUTS = "OUTPUTS"
+
+    resampling_methods = (
+        ("Nearest Neighbour", "nearest"),
+        ("Bilinear", "bilinear"),
+        ("Cubic", "cubic"),
+        ("Cubic Spline", "cubic_spline"),
+        ("Lanczos Windowed Sinc", "lanczos"),
+        ("Average", "average"),
+        ("Mode", "mode"),
+        ("Maximum", "max"),
+        ("Minimum", "min"),
+        ("Median", "med"),
+        ("First Quartile", "q1"),
+        ("Third Quartile", "q3"),
+    )
+
+    def __init__(self):
+        super().__init__()
+
+    def tr(self, string, context=""):
+        if context == "":
+            context = self.__class__.__name__
+        return QCoreApplication.translate(context, string)
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it.
+        """
+        html_help = (
+            "<p>Runs the Automated global Co-Registration for several target images against the same "
+            "reference image. The part of the reference image overlapping the targets is read only once "
+            "and shared by all the targets, which are matched and corrected in parallel worker processes.</p>"
+            "<p>Each co-registered target is saved in the output folder as <i>&lt;target name&gt;_coreg.tif</i>, "
+            "and the detected shifts of all targets are written to a summary table (CSV). Targets that fail "
+            "are reported in the table and do not stop the rest of the batch.</p>"
+            "<p>This algorithm uses AROSICS software developed by Daniel Scheffler — "
+            "<a href='https://danschef.git-pages.gfz-potsdam.de/arosics/doc/'>documentation</a> and "
+            "<a href='https://doi.org/10.3390/rs9070676'>"
+            "paper (Scheffler et al. 2017, Remote Sensing 9(7):676)</a>.</p>"
+        )
+        return html_help
+
+    def createInstance(self):
+        return AutomatedGlobalCoregistrationBatchAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "automated_global_coregistration_batch"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Automated global Co-Registration (multiple targets)")
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return None
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return None
+
+    def icon(self):
+        return QIcon(":/plugins/Coregistration/icons/coregistration.svg")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.IMG_REF, self.tr("The REFERENCE image to use as a base for co-registering the target images")
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.INPUTS,
+                self.tr("The TARGET images to co-register"),
+                layerType=Qgis.ProcessingSourceType.Raster,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.ALIGN_GRIDS,
+                self.tr("Align the input coordinate grid to the reference"),
+                defaultValue=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.MATCH_GSD,
+                self.tr("Match the input pixel size to the reference pixel size"),
+                defaultValue=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MATCHING_WINDOW_SIZE,
+                self.tr("Custom matching window size in pixel units"),
+                type=Qgis.ProcessingNumberParameterType.Integer,
+                defaultValue=256,
+                optional=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterNumber(
+            self.MAX_SHIFT,
+            self.tr("Maximum shift distance in reference image pixel units"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=5,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterEnum(
+            self.RESAMPLING,
+            self.tr("The resampling algorithm to be used for shift correction (if necessary)"),
+            options=[i[0] for i in self.resampling_methods],
+            defaultValue=2,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterNumber(
+            self.CPUS,
+            self.tr("Number of worker processes (reduced automatically if memory is low)"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=get_default_cpus(),
+            minValue=1,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER, self.tr("Output folder for the co-registered raster files")
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.OUTPUT_TABLE, self.tr("Summary table of the detected shifts"), fileFilter="CSV files (*.csv)"
+            )
+        )
+
+        parameter = QgsProcessingParameterFileDestination(
+            self.STATS,
+            self.tr("Processing statistics (JSON)"),
+            fileFilter="JSON files (*.json)",
+            optional=True,
+            createByDefault=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addOutput(QgsProcessingOutputMultipleLayers(self.OUTPUTS, self.tr("Co-registered raster files")))
+
+    @staticmethod
+    def estimate_cpus(cpus, reference, img_tgts):
+        """Limit the number of worker processes to what fits into the available memory.
+
+        Every worker holds one target image in memory while it is corrected
+        (input and resampled output), plus its own copy of the reference
+        window unless the workers are forked and share it.
+        """
+        target_nbytes = 0
+        for img_tgt in img_tgts:
+            ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+            band_nbytes = gdal.GetDataTypeSize(ds.GetRasterBand(1).DataType) // 8
+            target_nbytes = max(target_nbytes, ds.RasterXSize * ds.RasterYSize * ds.RasterCount * band_nbytes)
+            ds = None
+
+        reference_nbytes = reference["arr"].nbytes
+        if get_start_method() == "fork":
+            return limit_workers_by_memory(cpus, 2 * target_nbytes, shared_memory=reference_nbytes)
+        return limit_workers_by_memory(cpus, 2 * target_nbytes + reference_nbytes, shared_memory=reference_nbytes)
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        try:
+            from geoarray import GeoArray
+        except Exception:
+            msg = (
+                "\nError loading AROSICS, this plugin requires additional Python packages to work. "
+                "Read the install instructions here:\n\n"
+                "https://github.com/SMByC/Coregistration-Qgis-processing#installation\n\n"
+            )
+            feedback.reportError(msg, fatalError=True)
+            return {}
+
+        def get_inputfilepath(layer):
+            return os.path.realpath(layer.source().split("|layername")[0])
+
+        profiler = StageProfiler(self.name())
+        profiler.start("open inputs")
+
+        img_ref = get_inputfilepath(self.parameterAsRasterLayer(parameters, self.IMG_REF, context))
+        img_tgts = [get_inputfilepath(layer) for layer in self.parameterAsLayerList(parameters, self.INPUTS, context)]
+        # keep the order of the targets but process every file only once
+        img_tgts = list(dict.fromkeys(img_tgts))
+
+        if img_ref in img_tgts:
+            feedback.pushWarning("\nThe reference image is also in the target images, it is skipped.\n")
+            img_tgts.remove(img_ref)
+        if not img_tgts:
+            feedback.reportError("\nNo target images to co-register.\n", fatalError=True)
+            return {}
+
+        ws = self.parameterAsInt(parameters, self.MATCHING_WINDOW_SIZE, context)
+        max_shift = self.parameterAsInt(parameters, self.MAX_SHIFT, context)
+        resampling_method = self.resampling_methods[self.parameterAsEnum(parameters, self.RESAMPLING, context)][1]
+        options = {
+            "align_grids": self.parameterAsBoolean(parameters, self.ALIGN_GRIDS, context),
+            "match_gsd": self.parameterAsBoolean(parameters, self.MATCH_GSD, context),
+            "ws": (ws, ws),
+            "max_shift": max_shift,
+            "max_iter": 15,
+            "resamp_alg_deshift": resampling_method,
+            "fmt_out": "GTiff",
+            "out_crea_options": ["WRITE_METADATA=NO"],
+        }
+
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        os.makedirs(output_folder, exist_ok=True)
+        output_table = self.parameterAsFileOutput(parameters, self.OUTPUT_TABLE, context)
+
+        feedback.pushInfo("Image to image Co-Registration for multiple targets:")
+        feedback.pushInfo("\nReference file: " + img_ref)
+        feedback.pushInfo("\nReading the reference image window overlapping the targets...")
+        profiler.start("reference window read")
+        reference = load_reference_window(img_ref, img_tgts, margin=max_shift + ws // 2)
+        # compute the reference footprint once instead of once per target
+        reference["footprint_poly"] = GeoArray(
+            reference["arr"], geotransform=reference["gt"], projection=reference["prj"], nodata=reference["nodata"]
+        ).footprint_poly.wkt
+
+        cpus = self.parameterAsInt(parameters, self.CPUS, context)
+        if cpus > 1 and not configure_multiprocessing():
+            feedback.pushWarning("Python interpreter not found to start worker processes, running in serial mode")
+            cpus = 1
+        cpus = min(self.estimate_cpus(cpus, reference, img_tgts), len(img_tgts))
+
+        tasks = []
+        # the targets are written concurrently, same-named targets from different folders get unique names
+        for img_tgt, output_name in zip(img_tgts, get_output_names(img_tgts, "_coreg", ".tif"), strict=True):
+            tasks.append(
+                {"img_tgt": img_tgt, "output_file": os.path.join(output_folder, output_name), "options": options}
+            )
+
+        feedback.pushInfo(
+            f"\nPerform automatic subpixel co-registration with AROSICS for {len(tasks)} targets "
+            f"using {cpus} worker process(es)...\n"
+        )
+
+        profiler.start("co-registration of the targets (worker processes)")
+        results = []
+        for _task, result in run_in_process_pool(
+            coregister_global_worker,
+            tasks,
+            cpus,
+            feedback,
+            initializer=init_reference_worker,
+            initargs=(reference,),
+        ):
+            results.append(result)
+            if result["error"]:
+                feedback.reportError(f"{result['img_tgt']}: {result['error']}", fatalError=False)
+            else:
+                feedback.pushInfo(
+                    f"{result['img_tgt']}: shift X={result['x_shift_px']:.3f} px, Y={result['y_shift_px']:.3f} px"
+                )
+            feedback.setProgress(100 * len(results) / len(tasks))
+
+        if feedback.isCanceled():
+            return {}
+
+        profiler.start("write summary table")
+        # write the summary table in the order of the input targets
+        results.sort(key=lambda r: img_tgts.index(r["img_tgt"]))
+        fieldnames = ["target", "output", "success"] + [key for key, _ in SHIFT_ATTRIBUTES] + ["error"]
+        with open(output_table, "w", newline="", encoding="utf-8") as fh:
+            writer = csv.DictWriter(fh, fieldnames=fieldnames, extrasaction="ignore")
+            writer.writeheader()
+            for result in results:
+                output = "" if result["error"] else result["output_file"]
+                writer.writerow({**result, "target": result["img_tgt"], "output": output})
+
+        output_files = [result["output_file"] for result in results if not result["error"]]
+        for output_file in output_files:
+            context.addLayerToLoadOnCompletion(
+                output_file,
+                QgsProcessingContext.LayerDetails(
+                    os.path.splitext(os.path.basename(output_file))[0], context.project(), self.OUTPUTS
+                ),
+            )
+
+        feedback.pushInfo(f"\n{len(output_files)} of {len(tasks)} targets co-registered")
+        profiler.report(feedback, self.parameterAsFileOutput(parameters, self.STATS, context))
+        feedback.pushInfo("DONE\n")
+
+        return {self.OUTPUT_FOLDER: output_folder, self.OUTPUT_TABLE: output_table, self.OUTPUTS: output_files}
@@ -19,12 +19,15 @@
 """
 
 import os
+import tempfile
 
+from osgeo import gdal
 from qgis.core import (
     Qgis,
     QgsProcessingAlgorithm,
     QgsProcessingParameterBoolean,
     QgsProcessingParameterEnum,
+    QgsProcessingParameterFileDestination,
     QgsProcessingParameterNumber,
     QgsProcessingParameterRasterDestination,
     QgsProcessingParameterRasterLayer,
@@ -33,7 +36,39 @@ from qgis.core import (
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.PyQt.QtGui import QIcon
 
-from Coregistration.utils.system_utils import get_raster_driver_name_by_extension, redirect_output_to_feedback
+from Coregistration.utils.coregistration_utils import (
+    coarse_shift_task,
+    create_preshifted_vrts,
+    get_fine_max_shift,
+    get_pyramid_factor,
+)
+from Coregistration.utils.instrumentation import StageProfiler
+from Coregistration.utils.raster_utils import (
+    get_creation_options,
+    get_overview_resampling,
+    get_performance_settings,
+)
+from Coregistration.utils.system_utils import (
+    configure_multiprocessing,
+    get_default_cpus,
+    get_raster_driver_name_by_extension,
+    get_start_method,
+    limit_workers_by_memory,
+    run_in_process_pool,
+    run_in_subprocess,
+)
+from Coregistration.utils.tiepoints import (
+    coregister_local_task,
+    deshift_local_task,
+    get_cache_key,
+    get_cache_path,
+    get_overlap_window,
+    load_tiepoints,
+    make_tiles,
+    match_tile_worker,
+    save_tiepoints,
+    warp_tiepoints_task,
+)
 
 
 class AutomatedLocalCoregistrationAlgorithm(QgsProcessingAlgorithm):
@@ -53,8 +88,15 @@ class AutomatedLocalCoregistrationAlgorithm(QgsProcessingAlgorithm):
     GRID_RES = "GRID_RES"
     WINDOW_SIZE = "WINDOW_SIZE"
     MAX_SHIFT = "MAX_SHIFT"
+    COARSE_TO_FINE = "COARSE_TO_FINE"
     RESAMPLING = "RESAMPLING"
-    MASK = "MASK"
+    CPUS = "CPUS"
+    TILE_SIZE = "TILE_SIZE"
+    CACHE_TIEPOINTS = "CACHE_TIEPOINTS"
+    COG = "COG"
+    MASK_REF = "MASK_REF"
+    MASK_TGT = "MASK_TGT"
+    STATS = "STATS"
     OUTPUT = "OUTPUT"
 
     resampling_methods = (
@@ -99,6 +141,24 @@ class AutomatedLocalCoregistrationAlgorithm(QgsProcessingAlgorithm):
             "<p>It is designed to robustly handle the typical difficulties of multi-sensor/multi-temporal "
             "images. This algorithm is significantly more comprehensive and slower than the global algorithm.</p>"
             "<p>Key parameters: tie point grid resolution, matching window size, maximum shift distance.</p>"
+            "<p>For large maximum shifts, the coarse-to-fine matching first estimates the global shift on "
+            "decimated copies of the images (read from the GDAL overviews when present), then computes the "
+            "tie points at full resolution searching only a few pixels around that estimate.</p>"
+            "<p>Optionally, bad data masks (e.g. clouds) of the reference and/or target image can be given, "
+            "with the same extent and projection as their image and value 1 on the pixels to skip. Tie points "
+            "that fall on masked pixels are skipped before matching, which saves time and removes most of the "
+            "outliers on cloudy images.</p>"
+            "<p>For very large images, set a tile size: the image overlap is split into overlapping tiles whose "
+            "tie points are computed in parallel processes, the tie points of all tiles are merged and filtered "
+            "for outliers together, and the output is warped block by block, so the memory used depends on the "
+            "tile size instead of the image size.</p>"
+            "<p>With the COG option, the output is written as a Cloud Optimized GeoTIFF: tiled, compressed and "
+            "with internal overviews, so it renders quickly without building pyramids.</p>"
+            "<p>If the tie points cache is enabled, the validated tie points are saved next to the target image "
+            "(<i>&lt;target&gt;.tiepoints.gpkg</i>) and, in later runs with the same input images and matching "
+            "parameters (grid resolution, window size, maximum shift and tile size), the matching is skipped and "
+            "only the warp is done. This allows to change the output format, resampling or grid options quickly. "
+            "The cache is invalidated when any input image is modified.</p>"
             "<p>[1] This algorithm uses AROSICS software developed by Daniel Scheffler — "
             "<a href='https://danschef.git-pages.gfz-potsdam.de/arosics/doc/'>documentation</a> and "
             "<a href='https://doi.org/10.3390/rs9070676'>"
@@ -209,6 +269,14 @@ class AutomatedLocalCoregistrationAlgorithm(QgsProcessingAlgorithm):
         parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
         self.addParameter(parameter)
 
+        parameter = QgsProcessingParameterBoolean(
+            self.COARSE_TO_FINE,
+            self.tr("Coarse-to-fine matching, faster for large maximum shifts"),
+            defaultValue=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
         parameter = QgsProcessingParameterEnum(
             self.RESAMPLING,
             self.tr("The resampling algorithm to be used for shift correction (if necessary)"),
@@ -219,16 +287,118 @@ class AutomatedLocalCoregistrationAlgorithm(QgsProcessingAlgorithm):
         parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
         self.addParameter(parameter)
 
+        parameter = QgsProcessingParameterRasterLayer(
+            self.MASK_REF,
+            self.tr("Bad data mask of the REFERENCE image (e.g. clouds), pixels to skip with value 1"),
+            optional=True,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterRasterLayer(
+            self.MASK_TGT,
+            self.tr("Bad data mask of the TARGET image (e.g. clouds), pixels to skip with value 1"),
+            optional=True,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterNumber(
+            self.CPUS,
+            self.tr("Number of worker processes for tie point matching (reduced automatically if memory is low)"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=get_default_cpus(),
+            minValue=1,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterNumber(
+            self.TILE_SIZE,
+            self.tr("Tile size for very large images, in target pixel units (0 = process the whole overlap at once)"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=0,
+            minValue=0,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterBoolean(
+            self.CACHE_TIEPOINTS,
+            self.tr("Cache the tie points next to the target image and reuse them when possible"),
+            defaultValue=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.COG,
+                self.tr("Write the output as Cloud Optimized GeoTIFF (COG) with overviews (.tif output only)"),
+                defaultValue=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterFileDestination(
+            self.STATS,
+            self.tr("Processing statistics (JSON)"),
+            fileFilter="JSON files (*.json)",
+            optional=True,
+            createByDefault=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
         self.addParameter(
             QgsProcessingParameterRasterDestination(self.OUTPUT, self.tr("Output co-registered raster file"))
         )
 
+    @staticmethod
+    def estimate_cpus(cpus, img_ref, img_tgt, window_size, max_shift, tile_pixels=0):
+        """Limit the number of worker processes to what fits into the available memory.
+
+        AROSICS keeps the matching band of both images in memory while the tie
+        points are computed. With the *fork* start method the workers share it,
+        otherwise every worker receives its own copy. In tiled mode every worker
+        only holds the *tile_pixels* of its own tile.
+        """
+        images_nbytes = 0
+        pixel_nbytes = 0
+        for img in (img_ref, img_tgt):
+            ds = gdal.Open(img, gdal.GA_ReadOnly)
+            band_nbytes = gdal.GetDataTypeSize(ds.GetRasterBand(1).DataType) // 8
+            images_nbytes += ds.RasterXSize * ds.RasterYSize * band_nbytes
+            pixel_nbytes += band_nbytes
+            ds = None
+
+        # matching window plus the FFT buffers (complex128) computed from it
+        window_nbytes = (window_size + 2 * max_shift) ** 2 * 16 * 8
+
+        if tile_pixels:
+            # tile subsets of both images, read and converted for matching
+            return limit_workers_by_memory(cpus, window_nbytes + 2 * tile_pixels * pixel_nbytes)
+        if get_start_method() == "fork":
+            return limit_workers_by_memory(cpus, window_nbytes, shared_memory=images_nbytes)
+        return limit_workers_by_memory(cpus, window_nbytes + images_nbytes, shared_memory=images_nbytes)
+
     def processAlgorithm(self, parameters, context, feedback):
         """
         Here is where the processing itself takes place.
         """
+        # the temporary files (decimated and pre-shifted VRTs) are removed at the end, whatever happens
+        with tempfile.TemporaryDirectory(
+            prefix="coregistration_", dir=QgsProcessingUtils.tempFolder(), ignore_cleanup_errors=True
+        ) as tmp_dir:
+            return self.process(parameters, context, feedback, tmp_dir)
+
+    def process(self, parameters, context, feedback, tmp_dir):
+        """
+        Runs the algorithm with its temporary files in *tmp_dir*.
+        """
         try:
-            from arosics import COREG_LOCAL
+            import arosics  # noqa: F401
         except Exception:
             msg = (
                 "\nError loading AROSICS, this plugin requires additional Python packages to work. "
@@ -241,6 +411,9 @@ class AutomatedLocalCoregistrationAlgorithm(QgsProcessingAlgorithm):
         def get_inputfilepath(layer):
             return os.path.realpath(layer.source().split("|layername")[0])
 
+        profiler = StageProfiler(self.name())
+        profiler.start("open inputs")
+
         img_ref = get_inputfilepath(self.parameterAsRasterLayer(parameters, self.IMG_REF, context))
         img_tgt = get_inputfilepath(self.parameterAsRasterLayer(parameters, self.INPUT, context))
 
@@ -251,6 +424,11 @@ class AutomatedLocalCoregistrationAlgorithm(QgsProcessingAlgorithm):
             )
             return {}
 
+        mask_ref = self.parameterAsRasterLayer(parameters, self.MASK_REF, context)
+        mask_ref = get_inputfilepath(mask_ref) if mask_ref else None
+        mask_tgt = self.parameterAsRasterLayer(parameters, self.MASK_TGT, context)
+        mask_tgt = get_inputfilepath(mask_tgt) if mask_tgt else None
+
         align_grids = self.parameterAsBoolean(parameters, self.ALIGN_GRIDS, context)
         match_gsd = self.parameterAsBoolean(parameters, self.MATCH_GSD, context)
 
@@ -259,10 +437,101 @@ class AutomatedLocalCoregistrationAlgorithm(QgsProcessingAlgorithm):
         window_size = self.parameterAsInt(parameters, self.WINDOW_SIZE, context)
 
         max_shift = self.parameterAsInt(parameters, self.MAX_SHIFT, context)
+        coarse_to_fine = self.parameterAsBoolean(parameters, self.COARSE_TO_FINE, context)
         resampling_method = self.resampling_methods[self.parameterAsEnum(parameters, self.RESAMPLING, context)][1]
 
+        tile_size = self.parameterAsInt(parameters, self.TILE_SIZE, context)
+
+        cache = None
+        cached = None
+        if self.parameterAsBoolean(parameters, self.CACHE_TIEPOINTS, context):
+            cache_path = get_cache_path(img_tgt)
+            cache_key = get_cache_key(
+                {"reference": img_ref, "target": img_tgt, "mask_ref": mask_ref, "mask_tgt": mask_tgt},
+                grid_res=grid_res,
+                window_size=window_size,
+                max_shift=max_shift,
+                tile_size=tile_size,
+                coarse_to_fine=coarse_to_fine,
+            )
+            cache = (cache_path, cache_key)
+            try:
+                cached = load_tiepoints(cache_path, cache_key)
+            except Exception as err:
+                feedback.pushWarning(f"The tie points cache could not be read, ignoring it: {err}")
+            if cached is not None:
+                feedback.pushInfo(f"Reusing the cached tie points: {cache_path}")
+
+        # the image that is matched and corrected, the target itself or its coarse pre-shifted VRT
+        coreg_tgt, coreg_mask_tgt = img_tgt, mask_tgt
+        coarse_shift = None
+        factor = get_pyramid_factor(max_shift) if coarse_to_fine else 1
+        if factor > 1 and cached is not None:
+            # the cached tie points were computed on the target pre-shifted by this coarse shift
+            coarse_shift = (cached[1] or {}).get("coarse_shift_map")
+        elif factor > 1:
+            feedback.pushInfo(f"\nEstimating the global shift on the images decimated by a factor of {factor}...\n")
+            profiler.start("coarse matching")
+            # AROSICS runs in a worker process that is terminated when the user cancels
+            coarse_shift = run_in_subprocess(
+                coarse_shift_task,
+                {
+                    "img_ref": img_ref,
+                    "img_tgt": img_tgt,
+                    "max_shift": max_shift,
+                    "factor": factor,
+                    "tmp_dir": tmp_dir,
+                    "mask_ref": mask_ref,
+                    "mask_tgt": mask_tgt,
+                    "options": {"ws": (window_size, window_size), "max_iter": 15, "CPUs": 1},
+                },
+                feedback,
+            )
+            if coarse_shift is None:
+                return {}
+            feedback.pushInfo(f"Coarse shift (map units): x={coarse_shift[0]:.3f}, y={coarse_shift[1]:.3f}")
+        elif coarse_to_fine:
+            feedback.pushInfo("The maximum shift is small, the coarse-to-fine matching is not needed")
+        if coarse_shift is not None:
+            coreg_tgt, coreg_mask_tgt = create_preshifted_vrts(img_tgt, mask_tgt, *coarse_shift, tmp_dir)
+        if factor > 1:
+            max_shift = get_fine_max_shift(max_shift, factor)
+        cache_info = {"coarse_shift_map": coarse_shift} if coarse_shift is not None else {}
+
+        # tiles overlap by the half matching window plus the maximum shift
+        tile_margin = window_size // 2 + max_shift
+
+        cpus = self.parameterAsInt(parameters, self.CPUS, context)
+        if cpus > 1 and not configure_multiprocessing():
+            feedback.pushWarning("Python interpreter not found to start worker processes, running in serial mode")
+            cpus = 1
+        if cpus > 1:
+            requested_cpus = cpus
+            tile_pixels = (tile_size + 2 * tile_margin) ** 2 if tile_size else 0
+            cpus = self.estimate_cpus(cpus, img_ref, img_tgt, window_size, max_shift, tile_pixels)
+            if cpus < requested_cpus:
+                feedback.pushInfo(f"Worker processes reduced from {requested_cpus} to {cpus} due to available memory")
+
         output_file = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
-        output_driver_name = get_raster_driver_name_by_extension(output_file)
+        cog = self.parameterAsBoolean(parameters, self.COG, context)
+        output_driver_name = get_raster_driver_name_by_extension(output_file, cog=cog)
+        if cog and output_driver_name != "COG":
+            feedback.pushWarning("\nThe COG option requires a .tif output file, it is ignored.\n")
+        creation_options = None
+        if output_driver_name == "COG":
+            performance = get_performance_settings(0)
+            performance["overview_resampling"] = get_overview_resampling(resampling_method)
+            tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+            creation_options = get_creation_options("COG", performance, tgt_ds.GetRasterBand(1).DataType)
+            tgt_ds = None
+
+        if output_driver_name == "VRT":
+            feedback.reportError(
+                "\nVirtual raster (VRT) output is not supported by the local co-registration, "
+                "please choose another output format.\n",
+                fatalError=True,
+            )
+            return {}
 
         # fix save and load ENVI files
         if output_driver_name == "ENVI":
@@ -279,26 +548,215 @@ class AutomatedLocalCoregistrationAlgorithm(QgsProcessingAlgorithm):
 
         feedback.pushInfo("Image to image Co-Registration:")
         feedback.pushInfo("\nProcessing file: " + img_tgt)
-        feedback.pushInfo("\nPerform automatic subpixel co-registration with AROSICS...\n")
-
-        with redirect_output_to_feedback(feedback):
-            CRL = COREG_LOCAL(
+        feedback.pushInfo(f"\nPerform automatic subpixel co-registration with AROSICS using {cpus} CPU(s)...\n")
+
+        if tile_size:
+            options = {
+                "grid_res": grid_res,
+                "window_size": (window_size, window_size),
+                "max_shift": max_shift,
+                "max_iter": 15,
+                "align_grids": align_grids,
+                "match_gsd": match_gsd,
+            }
+            self.process_tiled(
                 img_ref,
-                img_tgt,
-                path_out=output_file,
-                align_grids=align_grids,
-                match_gsd=match_gsd,
-                grid_res=grid_res,
-                window_size=(window_size, window_size),
-                resamp_alg_deshift=resampling_method,
-                max_shift=max_shift,
-                max_iter=15,
-                fmt_out=output_driver_name,
-                out_crea_options=["WRITE_METADATA=NO"],
-                CPUs=1,
+                coreg_tgt,
+                mask_ref,
+                coreg_mask_tgt,
+                output_file,
+                output_driver_name,
+                options,
+                tile_size,
+                tile_margin,
+                resampling_method,
+                cpus,
+                feedback,
+                profiler,
+                cache=cache,
+                cached=cached,
+                cache_info=cache_info or None,
+                creation_options=creation_options,
+            )
+            if feedback.isCanceled():
+                return {}
+        elif cached is not None and cached[1] is not None:
+            table, coreg_info = cached
+            feedback.pushInfo("Matching skipped, correcting the target image with the cached tie points...")
+            # AROSICS runs in a worker process that is terminated when the user cancels
+            run_in_subprocess(
+                deshift_local_task,
+                {
+                    "img_tgt": coreg_tgt,
+                    "table": table,
+                    "coreg_info": coreg_info,
+                    "output_file": output_file,
+                    "output_driver_name": output_driver_name,
+                    "options": {"align_grids": align_grids, "match_gsd": match_gsd, "resamp_alg": resampling_method},
+                    "creation_options": creation_options,
+                },
+                feedback,
+                on_stage=profiler.start,
+                output_files=[output_file],
+                output_driver_name=output_driver_name,
             )
-            CRL.correct_shifts()
+            if feedback.isCanceled():
+                return {}
+        else:
+            options = {
+                "align_grids": align_grids,
+                "match_gsd": match_gsd,
+                "grid_res": grid_res,
+                "window_size": (window_size, window_size),
+                "resamp_alg_deshift": resampling_method,
+                "max_shift": max_shift,
+                "max_iter": 15,
+                "mask_baddata_ref": mask_ref,
+                "mask_baddata_tgt": coreg_mask_tgt,
+                "CPUs": cpus,
+            }
+            # the tie points progress bar of AROSICS drives the progress up to the correction
+            result = run_in_subprocess(
+                coregister_local_task,
+                {
+                    "img_ref": img_ref,
+                    "img_tgt": coreg_tgt,
+                    "output_file": output_file,
+                    "output_driver_name": output_driver_name,
+                    "options": options,
+                    "creation_options": creation_options,
+                },
+                feedback,
+                progress_range=(0, 90),
+                on_stage=profiler.start,
+                output_files=[output_file],
+                output_driver_name=output_driver_name,
+            )
+            if result is None:
+                return {}
+            if cache is not None:
+                coreg_info = dict(result["coreg_info"], **cache_info)
+                self.save_cache(cache, result["table"], img_tgt, feedback, coreg_info=coreg_info)
 
+        profiler.report(feedback, self.parameterAsFileOutput(parameters, self.STATS, context))
         feedback.pushInfo("DONE\n")
 
         return {self.OUTPUT: output_file}
+
+    @staticmethod
+    def process_tiled(
+        img_ref,
+        img_tgt,
+        mask_ref,
+        mask_tgt,
+        output_file,
+        output_driver_name,
+        options,
+        tile_size,
+        tile_margin,
+        resampling_method,
+        cpus,
+        feedback,
+        profiler,
+        cache=None,
+        cached=None,
+        cache_info=None,
+        creation_options=None,
+    ):
+        """Tiled local co-registration for images too large to be matched at once.
+
+        The tie points of every tile are computed in a process pool, merged and
+        filtered for outliers over the whole image, then the target is warped
+        with them block by block in a worker process. With *cached* tie points, the matching is
+        skipped; otherwise the filtered tie points are saved to *cache*
+        (``(path, key)``) if given, with the *cache_info* dict. The stages are
+        recorded in the *profiler*.
+        """
+        import pandas as pd
+
+        def warp(table, tmp_dir, filter_outliers=False):
+            # the warp runs in a worker process that is terminated when the user cancels
+            return run_in_subprocess(
+                warp_tiepoints_task,
+                {
+                    "img_ref": img_ref,
+                    "img_tgt": img_tgt,
+                    "output_file": output_file,
+                    "table": table,
+                    "tmp_dir": tmp_dir,
+                    "output_driver_name": output_driver_name,
+                    "align_grids": options["align_grids"],
+                    "match_gsd": options["match_gsd"],
+                    "resampling_method": resampling_method,
+                    "filter_outliers": filter_outliers,
+                    "creation_options": creation_options,
+                },
+                feedback,
+                progress_range=(80, 100),
+                on_stage=profiler.start,
+                output_files=[output_file],
+                output_driver_name=output_driver_name,
+            )
+
+        if cached is not None:
+            with tempfile.TemporaryDirectory(prefix="coregistration_tiles_") as tmp_dir:
+                feedback.pushInfo("Matching skipped, warping the target image with the cached tie points...")
+                warp(cached[0], tmp_dir)
+            return
+
+        tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+        tgt_size = (tgt_ds.RasterXSize, tgt_ds.RasterYSize)
+        tgt_ds = None
+
+        overlap_window = get_overlap_window(img_ref, img_tgt)
+        tiles = make_tiles(overlap_window, tgt_size, tile_size, options["grid_res"], tile_margin)
+
+        with tempfile.TemporaryDirectory(prefix="coregistration_tiles_") as tmp_dir:
+            tasks = [
+                {
+                    "tile_id": tile_id,
+                    "img_ref": img_ref,
+                    "img_tgt": img_tgt,
+                    "mask_ref": mask_ref,
+                    "mask_tgt": mask_tgt,
+                    "core": tile["core"],
+                    "read": tile["read"],
+                    "tmp_dir": tmp_dir,
+                    "options": options,
+                }
+                for tile_id, tile in enumerate(tiles)
+            ]
+            feedback.pushInfo(f"Computing the tie points of {len(tasks)} tiles...")
+            profiler.start("window read and FFT matching")
+
+            tables = []
+            for done, (_task, result) in enumerate(run_in_process_pool(match_tile_worker, tasks, cpus, feedback), 1):
+                if result["error"]:
+                    feedback.pushWarning(f"Tile {result['tile']}: no tie points ({result['error']})")
+                elif not result["table"].empty:
+                    tables.append(result["table"])
+                feedback.setProgress(70 * done / len(tasks))
+            if feedback.isCanceled():
+                return
+
+            if not tables:
+                raise RuntimeError("No tie points could be computed in any tile")
+
+            feedback.pushInfo("Filtering the outliers of the merged tie points and warping the target image...")
+            feedback.setProgress(80)
+            table = warp(pd.concat(tables, ignore_index=True), tmp_dir, filter_outliers=True)
+            if table is not None and cache is not None:
+                AutomatedLocalCoregistrationAlgorithm.save_cache(cache, table, img_tgt, feedback, coreg_info=cache_info)
+
+    @staticmethod
+    def save_cache(cache, table, img_tgt, feedback, coreg_info=None):
+        """Save the validated tie points to the cache, a failure only raises a warning."""
+        cache_path, cache_key = cache
+        tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+        tgt_prj = tgt_ds.GetProjection()
+        tgt_ds = None
+        try:
+            save_tiepoints(cache_path, cache_key, table, tgt_prj, coreg_info=coreg_info)
+            feedback.pushInfo(f"Tie points saved to the cache: {cache_path}")
+        except Exception as err:
+            feedback.pushWarning(f"The tie points could not be saved to the cache: {err}")
@@ -0,0 +1,577 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import csv
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from osgeo import gdal
+from qgis.core import (
+    Qgis,
+    QgsProcessingAlgorithm,
+    QgsProcessingContext,
+    QgsProcessingOutputMultipleLayers,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer,
+    QgsProcessingUtils,
+)
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtGui import QIcon
+
+from Coregistration.utils.coregistration_utils import match_pair_worker, write_resampled_raster
+from Coregistration.utils.instrumentation import StageProfiler
+from Coregistration.utils.raster_utils import get_output_names, shift_geotransform
+from Coregistration.utils.system_utils import (
+    configure_multiprocessing,
+    get_default_cpus,
+    run_in_process_pool,
+)
+
+
+class AutomatedStackCoregistrationAlgorithm(QgsProcessingAlgorithm):
+    """
+    Detects and corrects the global X/Y shift of every date of a time-series
+    stack against one reference image, falling back to the temporally
+    adjacent dates as intermediate references when the direct match fails.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+
+    IMG_REF = "IMG_REF"
+    INPUTS = "INPUTS"
+    CHAIN = "CHAIN"
+    MIN_RELIABILITY = "MIN_RELIABILITY"
+    MAX_NEIGHBOR_DISTANCE = "MAX_NEIGHBOR_DISTANCE"
+    ALIGN_GRIDS = "ALIGN_GRIDS"
+    MATCH_GSD = "MATCH_GSD"
+    MATCHING_WINDOW_SIZE = "MATCHING_WINDOW_SIZE"
+    MAX_SHIFT = "MAX_SHIFT"
+    RESAMPLING = "RESAMPLING"
+    CPUS = "CPUS"
+    OUTPUT_FOLDER = "OUTPUT_FOLDER"
+    OUTPUT_TABLE = "OUTPUT_TABLE"
+    OUTPUT_STACK = "OUTPUT_STACK"
+    STATS = "STATS"
+    OUTPUTS = "OUTPUTS"
+
+    resampling_methods = (
+        ("Nearest Neighbour", "nearest"),
+        ("Bilinear", "bilinear"),
+        ("Cubic", "cubic"),
+        ("Cubic Spline", "cubic_spline"),
+        ("Lanczos Windowed Sinc", "lanczos"),
+        ("Average", "average"),
+        ("Mode", "mode"),
+        ("Maximum", "max"),
+        ("Minimum", "min"),
+        ("Median", "med"),
+        ("First Quartile", "q1"),
+        ("Third Quartile", "q3"),
+    )
+
+    def __init__(self):
+        super().__init__()
+
+    def tr(self, string, context=""):
+        if context == "":
+            context = self.__class__.__name__
+        return QCoreApplication.translate(context, string)
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it.
+        """
+        html_help = (
+            "<p>Co-registers a time-series stack: a list of target images <b>in temporal order</b> "
+            "(e.g. multi-year Landsat/Sentinel scenes of the same tile) against one reference image, "
+            "correcting a global X/Y shift per date. The dates are matched in parallel worker processes.</p>"
+            "<p>Every date is first matched against the reference image. With <i>Use the adjacent dates as "
+            "intermediate references</i>, a date whose match fails or is less reliable than the minimum "
+            "reliability (e.g. snow, phenology or land cover change since the reference date) is matched "
+            "against the nearest already co-registered date instead, within the maximum distance in dates, "
+            "and its shift is chained to the shift of that date. As a last resort, a low reliability match "
+            "against the reference is used.</p>"
+            "<p>Each date is saved in the output folder as <i>&lt;target name&gt;_coreg.tif</i>. With the grid "
+            "alignment and pixel size matching options (default) all the dates are resampled onto the "
+            "reference grid, and the optional stack output is a virtual raster (VRT) with the first band of "
+            "every date as one band, in temporal order. The shift table (CSV) gives for every date the "
+            "method used, the intermediate reference date if any, the total shift and its reliability.</p>"
+            "<p>This algorithm uses AROSICS software developed by Daniel Scheffler — "
+            "<a href='https://danschef.git-pages.gfz-potsdam.de/arosics/doc/'>documentation</a> and "
+            "<a href='https://doi.org/10.3390/rs9070676'>"
+            "paper (Scheffler et al. 2017, Remote Sensing 9(7):676)</a>.</p>"
+        )
+        return html_help
+
+    def createInstance(self):
+        return AutomatedStackCoregistrationAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "automated_stack_coregistration"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Automated global Co-Registration (time-series stack)")
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return None
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return None
+
+    def icon(self):
+        return QIcon(":/plugins/Coregistration/icons/coregistration.svg")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.IMG_REF, self.tr("The REFERENCE image to use as a base for co-registering the stack")
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.INPUTS,
+                self.tr("The TARGET images of the stack, in temporal order"),
+                layerType=Qgis.ProcessingSourceType.Raster,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.CHAIN,
+                self.tr("Use the adjacent dates as intermediate references when the match against the reference fails"),
+                defaultValue=True,
+            )
+        )
+
+        parameter = QgsProcessingParameterNumber(
+            self.MIN_RELIABILITY,
+            self.tr("Minimum reliability (%) of a match against the reference"),
+            type=Qgis.ProcessingNumberParameterType.Double,
+            defaultValue=50,
+            minValue=0,
+            maxValue=100,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterNumber(
+            self.MAX_NEIGHBOR_DISTANCE,
+            self.tr("Maximum distance, in dates, of an intermediate reference"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=2,
+            minValue=1,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.ALIGN_GRIDS,
+                self.tr("Align the input coordinate grid to the reference"),
+                defaultValue=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.MATCH_GSD,
+                self.tr("Match the input pixel size to the reference pixel size"),
+                defaultValue=True,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MATCHING_WINDOW_SIZE,
+                self.tr("Custom matching window size in pixel units"),
+                type=Qgis.ProcessingNumberParameterType.Integer,
+                defaultValue=256,
+                optional=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterNumber(
+            self.MAX_SHIFT,
+            self.tr("Maximum shift distance in reference image pixel units"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=5,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterEnum(
+            self.RESAMPLING,
+            self.tr("The resampling algorithm to be used for shift correction (if necessary)"),
+            options=[i[0] for i in self.resampling_methods],
+            defaultValue=2,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterNumber(
+            self.CPUS,
+            self.tr("Number of worker processes"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=get_default_cpus(),
+            minValue=1,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER, self.tr("Output folder for the co-registered raster files")
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.OUTPUT_TABLE, self.tr("Table of the shift per date"), fileFilter="CSV files (*.csv)"
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.OUTPUT_STACK,
+                self.tr("Co-registered stack (VRT)"),
+                fileFilter="Virtual raster (*.vrt)",
+                optional=True,
+                createByDefault=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterFileDestination(
+            self.STATS,
+            self.tr("Processing statistics (JSON)"),
+            fileFilter="JSON files (*.json)",
+            optional=True,
+            createByDefault=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addOutput(QgsProcessingOutputMultipleLayers(self.OUTPUTS, self.tr("Co-registered raster files")))
+
+    @staticmethod
+    def get_neighbors(index, resolved, tried, num_dates, max_distance):
+        """Return the resolved dates nearest to *index*, the previous date first, not tried yet."""
+        neighbors = []
+        for distance in range(1, max_distance + 1):
+            for neighbor in (index - distance, index + distance):
+                if 0 <= neighbor < num_dates and neighbor in resolved and (index, neighbor) not in tried:
+                    neighbors.append(neighbor)
+        return neighbors
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        try:
+            import arosics  # noqa: F401
+        except Exception:
+            msg = (
+                "\nError loading AROSICS, this plugin requires additional Python packages to work. "
+                "Read the install instructions here:\n\n"
+                "https://github.com/SMByC/Coregistration-Qgis-processing#installation\n\n"
+            )
+            feedback.reportError(msg, fatalError=True)
+            return {}
+
+        def get_inputfilepath(layer):
+            return os.path.realpath(layer.source().split("|layername")[0])
+
+        profiler = StageProfiler(self.name())
+        profiler.start("open inputs")
+
+        img_ref = get_inputfilepath(self.parameterAsRasterLayer(parameters, self.IMG_REF, context))
+        img_tgts = [get_inputfilepath(layer) for layer in self.parameterAsLayerList(parameters, self.INPUTS, context)]
+        # keep the temporal order of the targets but process every file only once
+        img_tgts = list(dict.fromkeys(img_tgts))
+
+        if img_ref in img_tgts:
+            feedback.pushWarning("\nThe reference image is also in the target images, it is skipped.\n")
+            img_tgts.remove(img_ref)
+        if not img_tgts:
+            feedback.reportError("\nNo target images to co-register.\n", fatalError=True)
+            return {}
+
+        chain = self.parameterAsBoolean(parameters, self.CHAIN, context)
+        min_reliability = self.parameterAsDouble(parameters, self.MIN_RELIABILITY, context)
+        max_distance = self.parameterAsInt(parameters, self.MAX_NEIGHBOR_DISTANCE, context)
+        align_grids = self.parameterAsBoolean(parameters, self.ALIGN_GRIDS, context)
+        match_gsd = self.parameterAsBoolean(parameters, self.MATCH_GSD, context)
+        ws = self.parameterAsInt(parameters, self.MATCHING_WINDOW_SIZE, context)
+        max_shift = self.parameterAsInt(parameters, self.MAX_SHIFT, context)
+        resampling_method = self.resampling_methods[self.parameterAsEnum(parameters, self.RESAMPLING, context)][1]
+        options = {"ws": (ws, ws), "max_shift": max_shift, "max_iter": 15}
+
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        os.makedirs(output_folder, exist_ok=True)
+        output_table = self.parameterAsFileOutput(parameters, self.OUTPUT_TABLE, context)
+        output_stack = self.parameterAsFileOutput(parameters, self.OUTPUT_STACK, context)
+
+        cpus = self.parameterAsInt(parameters, self.CPUS, context)
+        if cpus > 1 and not configure_multiprocessing():
+            feedback.pushWarning("Python interpreter not found to start worker processes, running in serial mode")
+            cpus = 1
+
+        feedback.pushInfo("Image to image Co-Registration of a time-series stack:")
+        feedback.pushInfo("\nReference file: " + img_ref)
+
+        def is_reliable(result):
+            return result["success"] and (result["reliability"] or 0) >= min_reliability
+
+        # 1. every date against the reference
+        feedback.pushInfo(
+            f"\nMatching {len(img_tgts)} dates against the reference with AROSICS "
+            f"using {min(cpus, len(img_tgts))} worker process(es)...\n"
+        )
+        profiler.start("matching against the reference (worker processes)")
+        tasks = [
+            {"index": index, "ref_index": None, "img_ref": img_ref, "img_tgt": img_tgt, "options": options}
+            for index, img_tgt in enumerate(img_tgts)
+        ]
+        direct = {}
+        for _task, result in run_in_process_pool(match_pair_worker, tasks, cpus, feedback):
+            direct[result["index"]] = result
+            feedback.setProgress(60 * len(direct) / len(tasks))
+        if feedback.isCanceled():
+            return {}
+
+        # the shift of each resolved date: {index: result with the total shift}
+        resolved = {index: dict(result, method="reference") for index, result in direct.items() if is_reliable(result)}
+        for index in sorted(direct):
+            result = direct[index]
+            name = os.path.basename(img_tgts[index])
+            if index in resolved:
+                feedback.pushInfo(
+                    f"{name}: shift x={result['x_shift_map']:.3f}, y={result['y_shift_map']:.3f} "
+                    f"(reliability {result['reliability'] or 0:.1f}%)"
+                )
+            else:
+                reason = result["error"] or f"reliability {result['reliability'] or 0:.1f}%"
+                feedback.pushInfo(f"{name}: not matched against the reference ({reason})")
+
+        # 2. the unresolved dates against their nearest resolved dates, chaining the shifts
+        if chain and len(resolved) < len(img_tgts):
+            profiler.start("chained matching (worker processes)")
+            tried = set()
+            while not feedback.isCanceled():
+                tasks = []
+                for index in range(len(img_tgts)):
+                    if index in resolved:
+                        continue
+                    neighbors = self.get_neighbors(index, resolved, tried, len(img_tgts), max_distance)
+                    if neighbors:
+                        tried.add((index, neighbors[0]))
+                        tasks.append(
+                            {
+                                "index": index,
+                                "ref_index": neighbors[0],
+                                "img_ref": img_tgts[neighbors[0]],
+                                "img_tgt": img_tgts[index],
+                                "options": options,
+                            }
+                        )
+                if not tasks:
+                    break
+                feedback.pushInfo(f"\nMatching {len(tasks)} dates against adjacent dates...\n")
+                for _task, result in run_in_process_pool(match_pair_worker, tasks, cpus, feedback):
+                    index, ref_index = result["index"], result["ref_index"]
+                    name, ref_name = os.path.basename(img_tgts[index]), os.path.basename(img_tgts[ref_index])
+                    if not is_reliable(result):
+                        reason = result["error"] or f"reliability {result['reliability'] or 0:.1f}%"
+                        feedback.pushInfo(f"{name}: not matched against {ref_name} ({reason})")
+                        continue
+                    # the shift to the intermediate reference plus the shift of that date to the reference
+                    resolved[index] = dict(
+                        result,
+                        method="chained",
+                        x_shift_map=result["x_shift_map"] + resolved[ref_index]["x_shift_map"],
+                        y_shift_map=result["y_shift_map"] + resolved[ref_index]["y_shift_map"],
+                    )
+                    feedback.pushInfo(
+                        f"{name}: shift x={resolved[index]['x_shift_map']:.3f}, "
+                        f"y={resolved[index]['y_shift_map']:.3f} chained through {ref_name} "
+                        f"(reliability {result['reliability'] or 0:.1f}%)"
+                    )
+            feedback.setProgress(70)
+            if feedback.isCanceled():
+                return {}
+
+        # 3. as a last resort, the unreliable matches against the reference
+        for index, result in direct.items():
+            if index not in resolved and result["success"]:
+                resolved[index] = dict(result, method="reference (low reliability)")
+                feedback.pushWarning(
+                    f"{os.path.basename(img_tgts[index])}: using the low reliability match against the reference"
+                )
+
+        # 4. write the corrected dates, GDAL warps in parallel threads
+        profiler.start("write")
+        tmp_dir = tempfile.mkdtemp(prefix="coregistration_", dir=QgsProcessingUtils.tempFolder())
+        output_files = {}
+        errors = {}
+        # same-named dates from different folders (e.g. one folder per scene) get unique output names
+        output_names = get_output_names(img_tgts, "_coreg", ".tif")
+        started = set()
+
+        def write_date(index):
+            started.add(index)
+            img_tgt = img_tgts[index]
+            tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+            shifted_gt = shift_geotransform(
+                tgt_ds.GetGeoTransform(), resolved[index]["x_shift_map"], resolved[index]["y_shift_map"]
+            )
+            tgt_ds = None
+            output_file = os.path.join(output_folder, output_names[index])
+            write_resampled_raster(
+                img_ref, img_tgt, output_file, shifted_gt, align_grids, match_gsd, resampling_method, "GTiff", tmp_dir
+            )
+            return output_file
+
+        feedback.pushInfo(f"\nWriting {len(resolved)} co-registered dates...")
+        executor = ThreadPoolExecutor(max_workers=max(1, min(len(resolved), get_default_cpus())))
+        try:
+            futures = {executor.submit(write_date, index): index for index in resolved}
+            for done, future in enumerate(as_completed(futures), 1):
+                if feedback.isCanceled():
+                    break
+                index = futures[future]
+                try:
+                    output_files[index] = future.result()
+                except Exception as err:
+                    errors[index] = str(err) or err.__class__.__name__
+                    feedback.reportError(f"{img_tgts[index]}: {errors[index]}", fatalError=False)
+                feedback.setProgress(70 + 28 * done / len(futures))
+        finally:
+            # the dates being written are finished before anything is returned or removed
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        if feedback.isCanceled():
+            for index in started:
+                output_file = os.path.join(output_folder, output_names[index])
+                for file_path in (output_file, output_file + ".aux.xml"):
+                    if os.path.isfile(file_path):
+                        os.remove(file_path)
+            feedback.pushInfo("\nCanceled, the co-registered dates written were removed")
+            return {}
+
+        profiler.start("write stack and table")
+        ordered_outputs = [output_files[index] for index in sorted(output_files)]
+        if output_stack and ordered_outputs:
+            gdal.BuildVRT(output_stack, ordered_outputs, separate=True)
+            stack_ds = gdal.Open(output_stack, gdal.GA_Update)
+            for band_idx, output_file in enumerate(ordered_outputs, 1):
+                stack_ds.GetRasterBand(band_idx).SetDescription(os.path.splitext(os.path.basename(output_file))[0])
+            stack_ds = None
+
+        fieldnames = [
+            "date_index",
+            "target",
+            "output",
+            "method",
+            "intermediate_reference",
+            "x_shift_map",
+            "y_shift_map",
+            "reliability",
+            "error",
+        ]
+        with open(output_table, "w", newline="", encoding="utf-8") as fh:
+            writer = csv.DictWriter(fh, fieldnames=fieldnames)
+            writer.writeheader()
+            for index, img_tgt in enumerate(img_tgts):
+                result = resolved.get(index, direct.get(index, {}))
+                ref_index = result.get("ref_index") if index in resolved else None
+                writer.writerow(
+                    {
+                        "date_index": index,
+                        "target": img_tgt,
+                        "output": output_files.get(index, ""),
+                        "method": result.get("method", "failed") if index not in errors else "failed",
+                        "intermediate_reference": "" if ref_index is None else img_tgts[ref_index],
+                        "x_shift_map": result.get("x_shift_map") if index in resolved else "",
+                        "y_shift_map": result.get("y_shift_map") if index in resolved else "",
+                        "reliability": result.get("reliability"),
+                        "error": errors.get(index) or ("" if index in resolved else result.get("error") or ""),
+                    }
+                )
+
+        for output_file in ordered_outputs:
+            context.addLayerToLoadOnCompletion(
+                output_file,
+                QgsProcessingContext.LayerDetails(
+                    os.path.splitext(os.path.basename(output_file))[0], context.project(), self.OUTPUTS
+                ),
+            )
+
+        feedback.pushInfo(f"\n{len(ordered_outputs)} of {len(img_tgts)} dates co-registered")
+        profiler.report(feedback, self.parameterAsFileOutput(parameters, self.STATS, context))
+        feedback.pushInfo("DONE\n")
+
+        return {
+            self.OUTPUT_FOLDER: output_folder,
+            self.OUTPUT_TABLE: output_table,
+            self.OUTPUT_STACK: output_stack,
+            self.OUTPUTS: ordered_outputs,
+        }
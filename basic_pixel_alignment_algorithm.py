@@ -18,22 +18,34 @@
  ***************************************************************************/
 """
 
+import importlib.util
 import os
-import tempfile
 
 from osgeo import gdal
 from qgis.core import (
     Qgis,
     QgsProcessingAlgorithm,
+    QgsProcessingParameterBoolean,
     QgsProcessingParameterEnum,
+    QgsProcessingParameterFileDestination,
     QgsProcessingParameterNumber,
     QgsProcessingParameterRasterDestination,
     QgsProcessingParameterRasterLayer,
+    QgsProcessingParameterString,
     QgsProcessingUtils,
 )
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.PyQt.QtGui import QIcon
 
+from Coregistration.utils.instrumentation import StageProfiler
+from Coregistration.utils.raster_utils import (
+    PERFORMANCE_PROFILES,
+    get_overview_resampling,
+    get_performance_settings,
+    get_reference_grid,
+    warp_to_grid,
+    warp_to_grid_blockwise,
+)
 from Coregistration.utils.system_utils import get_raster_driver_name_by_extension
 
 
@@ -51,6 +63,13 @@ class CoregistrationAlgorithm(QgsProcessingAlgorithm):
     INPUT = "INPUT"
     NODATA = "NODATA"
     RESAMPLING = "RESAMPLING"
+    PROFILE = "PROFILE"
+    THREADS = "THREADS"
+    WARP_MEMORY = "WARP_MEMORY"
+    CREATION_OPTIONS = "CREATION_OPTIONS"
+    COG = "COG"
+    ENGINE = "ENGINE"
+    STATS = "STATS"
     OUTPUT = "OUTPUT"
 
     resampling_methods = (
@@ -68,6 +87,11 @@ class CoregistrationAlgorithm(QgsProcessingAlgorithm):
         ("Third Quartile", gdal.GRA_Q3),
     )
 
+    engines = (
+        "GDAL warp",
+        "Block-wise streaming (rasterio)",
+    )
+
     def __init__(self):
         super().__init__()
 
@@ -92,6 +116,19 @@ class CoregistrationAlgorithm(QgsProcessingAlgorithm):
             "<li>Resampling (only if pixel sizes are different)</li>"
             "<li>Extent/bounds adjustment</li>"
             "</ul>"
+            "<p>With a <i>.vrt</i> output file, the result is a warped virtual raster on the reference grid: "
+            "no pixel data is written, the target is read and resampled lazily when the output is used.</p>"
+            "<p>With the COG option, the output is written as a Cloud Optimized GeoTIFF: tiled, compressed and "
+            "with internal overviews built in the same pass, so it renders quickly without building pyramids.</p>"
+            "<p>The performance profile sets the warp threads, memory buffer, GDAL cache, output block size and "
+            "compression together: <i>Balanced</i> (tiled, LZW), <i>Fast</i> (tiled, uncompressed, larger "
+            "buffers) or <i>Small output</i> (tiled, ZSTD or DEFLATE with predictor). The number of threads, "
+            "the warp memory and the creation options (e.g. <i>COMPRESS=JPEG|JPEG_QUALITY=90</i>) can be "
+            "overridden in the advanced parameters.</p>"
+            "<p>The block-wise streaming engine (requires rasterio) warps the output block by block directly "
+            "from the target in a bounded pool of threads, reading ahead the next blocks while the previous ones "
+            "are written. Only a few blocks are held in memory, so very large scenes can be aligned in a single "
+            "pass with bounded memory. It does not support COG or VRT outputs, which use GDAL warp.</p>"
             "<p>For content-based image-to-image co-registration use the Automated Global or Local "
             "Co-Registration algorithms instead.</p>"
         )
@@ -176,6 +213,75 @@ class CoregistrationAlgorithm(QgsProcessingAlgorithm):
         parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
         self.addParameter(parameter)
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.COG,
+                self.tr("Write the output as Cloud Optimized GeoTIFF (COG) with overviews (.tif output only)"),
+                defaultValue=False,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.PROFILE,
+                self.tr("Performance profile"),
+                options=[self.tr(i[0]) for i in PERFORMANCE_PROFILES],
+                defaultValue=0,
+                optional=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterNumber(
+            self.THREADS,
+            self.tr("Number of threads (0 = as set in the profile: all CPUs)"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=0,
+            minValue=0,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterNumber(
+            self.WARP_MEMORY,
+            self.tr("Warp memory buffer in MB (0 = as set in the profile)"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=0,
+            minValue=0,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterString(
+            self.CREATION_OPTIONS,
+            self.tr("Additional creation options, separated by | (e.g. COMPRESS=DEFLATE|ZLEVEL=9)"),
+            defaultValue="",
+            optional=True,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterEnum(
+            self.ENGINE,
+            self.tr("Processing engine"),
+            options=[self.tr(engine) for engine in self.engines],
+            defaultValue=0,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterFileDestination(
+            self.STATS,
+            self.tr("Processing statistics (JSON)"),
+            fileFilter="JSON files (*.json)",
+            optional=True,
+            createByDefault=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
         self.addParameter(
             QgsProcessingParameterRasterDestination(self.OUTPUT, self.tr("Output co-registered raster file"))
         )
@@ -188,6 +294,9 @@ class CoregistrationAlgorithm(QgsProcessingAlgorithm):
         def get_inputfilepath(layer):
             return os.path.realpath(layer.source().split("|layername")[0])
 
+        profiler = StageProfiler(self.name())
+        profiler.start("open inputs")
+
         img_ref = get_inputfilepath(self.parameterAsRasterLayer(parameters, self.IMG_REF, context))
         file_in = get_inputfilepath(self.parameterAsRasterLayer(parameters, self.INPUT, context))
         if self.NODATA in parameters and parameters[self.NODATA] is not None:
@@ -196,8 +305,21 @@ class CoregistrationAlgorithm(QgsProcessingAlgorithm):
             dst_nodata = None
         resampling_method = self.resampling_methods[self.parameterAsEnum(parameters, self.RESAMPLING, context)][1]
 
+        creation_options = self.parameterAsString(parameters, self.CREATION_OPTIONS, context)
+        performance = get_performance_settings(
+            self.parameterAsEnum(parameters, self.PROFILE, context),
+            threads=self.parameterAsInt(parameters, self.THREADS, context),
+            warp_memory_mb=self.parameterAsInt(parameters, self.WARP_MEMORY, context),
+            creation_options=[option for option in creation_options.split("|") if option.strip()],
+        )
+        performance["overview_resampling"] = get_overview_resampling(resampling_method)
+        cog = self.parameterAsBoolean(parameters, self.COG, context)
+        engine = self.parameterAsEnum(parameters, self.ENGINE, context)
+
         output_file = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
-        output_driver_name = get_raster_driver_name_by_extension(output_file)
+        output_driver_name = get_raster_driver_name_by_extension(output_file, cog=cog)
+        if cog and output_driver_name != "COG":
+            feedback.pushWarning("\nThe COG option requires a .tif output file, it is ignored.\n")
 
         # fix save and load ENVI files
         if output_driver_name == "ENVI":
@@ -215,97 +337,45 @@ class CoregistrationAlgorithm(QgsProcessingAlgorithm):
         feedback.pushInfo("Image to image Co-Registration:")
         feedback.pushInfo("\nProcessing file: " + file_in)
 
-        # extract some info from IMG_REF
-        gdal_img_ref = gdal.Open(img_ref, gdal.GA_ReadOnly)
-        min_x, x_res, _x_skew, max_y, _y_skew, y_res = gdal_img_ref.GetGeoTransform()
-        max_x = min_x + (gdal_img_ref.RasterXSize * x_res)
-        min_y = max_y + (gdal_img_ref.RasterYSize * y_res)
-        x_res = abs(float(x_res))
-        y_res = abs(float(y_res))
-        # projection
-        dst_crs = gdal_img_ref.GetProjection()
-
-        # extract some info from INPUT
-        gdal_input = gdal.Open(file_in, gdal.GA_ReadOnly)
-        src_crs = gdal_input.GetProjection()
-
-        gdal.Warp(
-            output_file,
-            file_in,
-            srcSRS=src_crs,
-            dstSRS=dst_crs,
-            xRes=x_res,
-            yRes=y_res,
-            resampleAlg=resampling_method,
-            srcNodata=dst_nodata,
-            dstNodata=dst_nodata,
-            outputBounds=(min_x, min_y, max_x, max_y),
-            targetAlignedPixels=False,
-            format=output_driver_name,
-        )
-
-        feedback.pushInfo("--> done\n")
-
-        del gdal_img_ref, gdal_input
-
-        return {self.OUTPUT: output_file}
-
-    def processAlgorithmRasterio(self, parameters, context, feedback):
-        """
-        Here is where the processing itself takes place.
-        """
-        import rasterio
-        from osgeo import gdal
-        from rasterio import shutil as rio_shutil
-        from rasterio.vrt import WarpedVRT
-
-        def get_inputfilepath(layer):
-            return os.path.realpath(layer.source().split("|layername")[0])
-
-        img_ref = get_inputfilepath(self.parameterAsRasterLayer(parameters, self.IMG_REF, context))
-        file_in = get_inputfilepath(self.parameterAsRasterLayer(parameters, self.INPUT, context))
-        output_file = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
-
-        feedback.pushInfo("Co-registration:")
-        feedback.pushInfo("\nProcessing file: " + file_in)
-
-        # extract some info
-        with rasterio.open(img_ref) as target:
-            dst_crs = target.crs
-            x_res, y_res = target.res
-            vrt_options = {
-                "crs": target.crs,
-                "transform": target.transform,
-                "height": target.height,
-                "width": target.width,
-                "nodata": target.nodata,
-            }
-        with rasterio.open(file_in) as src:
-            src_crs = src.crs
-
-        # ----- reprojection
-        if src_crs != dst_crs:
-            feedback.pushInfo(f"--> reprojection is required, to CRS: {dst_crs}")
-            # reproject
-            reprj_file_tmp = tempfile.NamedTemporaryFile(suffix=".tif", delete=True)
-            reprj_file = reprj_file_tmp.name
-            resample = gdal.GRA_NearestNeighbour
-            gdal.Warp(reprj_file, file_in, srcSRS=src_crs, dstSRS=dst_crs, xRes=x_res, yRes=y_res, resampleAlg=resample)
+        if engine == 1 and output_driver_name in ("COG", "VRT"):
+            feedback.pushWarning(
+                f"\nThe block-wise engine does not write {output_driver_name} files, using GDAL warp.\n"
+            )
+            engine = 0
+        if engine == 1 and importlib.util.find_spec("rasterio") is None:
+            feedback.pushWarning("\nThe block-wise engine requires rasterio (not installed), using GDAL warp.\n")
+            engine = 0
+
+        grid = get_reference_grid(img_ref)
+
+        profiler.start("warp and write")
+        if engine == 1:
+            feedback.pushInfo("--> warping block by block")
+            completed = warp_to_grid_blockwise(
+                file_in,
+                output_file,
+                grid,
+                resampling_method,
+                output_driver_name,
+                performance,
+                nodata=dst_nodata,
+                feedback=feedback,
+            )
+            if not completed:
+                feedback.pushInfo("\nCanceled, the partial output file was removed")
+                return {}
         else:
-            reprj_file_tmp = False
-            reprj_file = file_in
-
-        # ----- set extent and align pixels based on PU
-        feedback.pushInfo("--> set extent and align pixels")
-        if target.nodata is not None:
-            feedback.pushInfo(f"--> nodata as: {target.nodata}")
-
-        with rasterio.open(reprj_file) as src, WarpedVRT(src, **vrt_options) as vrt:
-            rio_shutil.copy(vrt, output_file, driver="GTiff")
+            warp_to_grid(
+                file_in,
+                output_file,
+                grid,
+                resampling_method,
+                output_driver_name,
+                performance,
+                nodata=dst_nodata,
+            )
 
+        profiler.report(feedback, self.parameterAsFileOutput(parameters, self.STATS, context))
         feedback.pushInfo("--> done\n")
 
-        if reprj_file_tmp:
-            reprj_file_tmp.close()
-
         return {self.OUTPUT: output_file}
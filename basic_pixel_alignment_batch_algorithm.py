@@ -0,0 +1,405 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import csv
+import os
+
+from osgeo import gdal
+from qgis.core import (
+    Qgis,
+    QgsProcessingAlgorithm,
+    QgsProcessingContext,
+    QgsProcessingOutputMultipleLayers,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterLayer,
+)
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtGui import QIcon
+
+from Coregistration.utils.instrumentation import StageProfiler
+from Coregistration.utils.raster_utils import (
+    PERFORMANCE_PROFILES,
+    align_raster_worker,
+    get_output_names,
+    get_overview_resampling,
+    get_partial_file,
+    get_performance_settings,
+    get_reference_grid,
+)
+from Coregistration.utils.system_utils import (
+    configure_multiprocessing,
+    get_default_cpus,
+    limit_workers_by_memory,
+    run_in_process_pool,
+)
+
+
+class BasicPixelAlignmentBatchAlgorithm(QgsProcessingAlgorithm):
+    """
+    Aligns several raster files to the spatial grid of one reference image
+    using GDAL warp, processing the files in a process pool.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+
+    IMG_REF = "IMG_REF"
+    INPUTS = "INPUTS"
+    NODATA = "NODATA"
+    RESAMPLING = "RESAMPLING"
+    COG = "COG"
+    PROFILE = "PROFILE"
+    CPUS = "CPUS"
+    SKIP_EXISTING = "SKIP_EXISTING"
+    MAX_RETRIES = "MAX_RETRIES"
+    OUTPUT_FOLDER = "OUTPUT_FOLDER"
+    OUTPUT_TABLE = "OUTPUT_TABLE"
+    STATS = "STATS"
+    OUTPUTS = "OUTPUTS"
+
+    resampling_methods = (
+        ("Nearest Neighbour", gdal.GRA_NearestNeighbour),
+        ("Bilinear", gdal.GRA_Bilinear),
+        ("Cubic", gdal.GRA_Cubic),
+        ("Cubic Spline", gdal.GRA_CubicSpline),
+        ("Lanczos Windowed Sinc", gdal.GRA_Lanczos),
+        ("Average", gdal.GRA_Average),
+        ("Mode", gdal.GRA_Mode),
+        ("Maximum", gdal.GRA_Max),
+        ("Minimum", gdal.GRA_Min),
+        ("Median", gdal.GRA_Med),
+        ("First Quartile", gdal.GRA_Q1),
+        ("Third Quartile", gdal.GRA_Q3),
+    )
+
+    def __init__(self):
+        super().__init__()
+
+    def tr(self, string, context=""):
+        if context == "":
+            context = self.__class__.__name__
+        return QCoreApplication.translate(context, string)
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it.
+        """
+        html_help = (
+            "<p>Runs the Basic pixel alignment for several raster files (e.g. DEM, slope, land cover, indices) "
+            "onto the grid of the same reference image. The reference grid is read only once and the files "
+            "are warped in parallel worker processes.</p>"
+            "<p>Each aligned file is saved in the output folder as <i>&lt;input name&gt;_aligned.tif</i> "
+            "(inputs with the same name in different folders get their folder name added). An output is "
+            "written to a temporary <i>.partial.tif</i> file and renamed once complete. A report table (CSV) "
+            "lists the status, processing time and attempts of every file. Files that fail are retried "
+            "up to the maximum number of retries and do not stop the rest of the batch; "
+            "running the batch again with <i>Skip existing outputs</i> enabled processes only the files "
+            "that failed or are missing.</p>"
+            "<p>For content-based image-to-image co-registration use the Automated Global or Local "
+            "Co-Registration algorithms instead.</p>"
+        )
+        return html_help
+
+    def createInstance(self):
+        return BasicPixelAlignmentBatchAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "basic_pixel_alignment_batch"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Basic pixel alignment (multiple inputs)")
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return None
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return None
+
+    def icon(self):
+        return QIcon(":/plugins/Coregistration/icons/coregistration.svg")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.IMG_REF, self.tr("The REFERENCE image to use as a base for aligning the input images")
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.INPUTS,
+                self.tr("The input images to align"),
+                layerType=Qgis.ProcessingSourceType.Raster,
+            )
+        )
+
+        parameter = QgsProcessingParameterNumber(
+            self.NODATA,
+            self.tr("Nodata value for output bands"),
+            type=Qgis.ProcessingNumberParameterType.Double,
+            defaultValue=None,
+            optional=True,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterEnum(
+            self.RESAMPLING,
+            self.tr("Resampling method to use"),
+            options=[i[0] for i in self.resampling_methods],
+            defaultValue=0,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.COG,
+                self.tr("Write the outputs as Cloud Optimized GeoTIFF (COG) with overviews"),
+                defaultValue=False,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.PROFILE,
+                self.tr("Performance profile"),
+                options=[self.tr(i[0]) for i in PERFORMANCE_PROFILES],
+                defaultValue=0,
+                optional=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterNumber(
+            self.CPUS,
+            self.tr("Number of worker processes (reduced automatically if memory is low)"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=get_default_cpus(),
+            minValue=1,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.SKIP_EXISTING,
+                self.tr("Skip existing outputs (process only the missing or failed files)"),
+                defaultValue=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterNumber(
+            self.MAX_RETRIES,
+            self.tr("Maximum number of retries of a failed file"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=1,
+            minValue=0,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(self.OUTPUT_FOLDER, self.tr("Output folder for the aligned files"))
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.OUTPUT_TABLE, self.tr("Report table of the processed files"), fileFilter="CSV files (*.csv)"
+            )
+        )
+
+        parameter = QgsProcessingParameterFileDestination(
+            self.STATS,
+            self.tr("Processing statistics (JSON)"),
+            fileFilter="JSON files (*.json)",
+            optional=True,
+            createByDefault=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addOutput(QgsProcessingOutputMultipleLayers(self.OUTPUTS, self.tr("Aligned raster files")))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        def get_inputfilepath(layer):
+            return os.path.realpath(layer.source().split("|layername")[0])
+
+        profiler = StageProfiler(self.name())
+        profiler.start("open inputs")
+
+        img_ref = get_inputfilepath(self.parameterAsRasterLayer(parameters, self.IMG_REF, context))
+        files_in = [get_inputfilepath(layer) for layer in self.parameterAsLayerList(parameters, self.INPUTS, context)]
+        # keep the order of the inputs but process every file only once
+        files_in = list(dict.fromkeys(files_in))
+        if not files_in:
+            feedback.reportError("\nNo input images to align.\n", fatalError=True)
+            return {}
+
+        if self.NODATA in parameters and parameters[self.NODATA] is not None:
+            dst_nodata = self.parameterAsDouble(parameters, self.NODATA, context)
+        else:
+            dst_nodata = None
+        resampling_method = self.resampling_methods[self.parameterAsEnum(parameters, self.RESAMPLING, context)][1]
+        output_driver_name = "COG" if self.parameterAsBoolean(parameters, self.COG, context) else "GTiff"
+        skip_existing = self.parameterAsBoolean(parameters, self.SKIP_EXISTING, context)
+        max_retries = self.parameterAsInt(parameters, self.MAX_RETRIES, context)
+
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        os.makedirs(output_folder, exist_ok=True)
+        output_table = self.parameterAsFileOutput(parameters, self.OUTPUT_TABLE, context)
+
+        feedback.pushInfo("Pixel alignment for multiple inputs:")
+        feedback.pushInfo("\nReference file: " + img_ref)
+        # the reference grid is read once and sent to every worker
+        grid = get_reference_grid(img_ref)
+
+        tasks = []
+        skipped = []
+        # same-named inputs from different folders (e.g. one folder per tile) get unique output names
+        for file_in, output_name in zip(files_in, get_output_names(files_in, "_aligned", ".tif"), strict=True):
+            output_file = os.path.join(output_folder, output_name)
+            if skip_existing and os.path.isfile(output_file):
+                skipped.append({"file_in": file_in, "output_file": output_file, "status": "skipped"})
+                continue
+            tasks.append({"file_in": file_in, "output_file": output_file})
+
+        cpus = self.parameterAsInt(parameters, self.CPUS, context)
+        if cpus > 1 and not configure_multiprocessing():
+            feedback.pushWarning("Python interpreter not found to start worker processes, running in serial mode")
+            cpus = 1
+
+        settings = get_performance_settings(self.parameterAsEnum(parameters, self.PROFILE, context))
+        settings["overview_resampling"] = get_overview_resampling(resampling_method)
+        # every worker holds its warp buffer and GDAL cache
+        worker_nbytes = (settings["warp_memory_mb"] + settings["cache_mb"]) * 1024 * 1024
+        cpus = max(1, min(limit_workers_by_memory(cpus, worker_nbytes), len(tasks)))
+        # share the threads of the profile between the worker processes
+        settings["threads"] = str(max(1, (os.cpu_count() or 1) // cpus))
+
+        for task in tasks:
+            task.update(
+                {
+                    "grid": grid,
+                    "resampling_method": resampling_method,
+                    "output_driver_name": output_driver_name,
+                    "settings": settings,
+                    "nodata": dst_nodata,
+                    "max_retries": max_retries,
+                }
+            )
+
+        if skipped:
+            feedback.pushInfo(f"\n{len(skipped)} files skipped, their output already exists")
+        feedback.pushInfo(f"\nAligning {len(tasks)} files using {cpus} worker process(es)...\n")
+
+        profiler.start("warp and write (worker processes)")
+        results = []
+        for _task, result in run_in_process_pool(align_raster_worker, tasks, cpus, feedback):
+            if result["error"]:
+                result["status"] = "failed"
+                feedback.reportError(
+                    f"{result['file_in']}: {result['error']} ({result['attempts']} attempt(s))", fatalError=False
+                )
+            else:
+                result["status"] = "done"
+                feedback.pushInfo(f"{result['file_in']}: done in {result['seconds']:.1f} s")
+            results.append(result)
+            feedback.setProgress(100 * len(results) / len(tasks))
+
+        if feedback.isCanceled():
+            # the outputs are renamed once complete, remove the partial files of the stopped workers
+            for task in tasks:
+                partial_file = get_partial_file(task["output_file"])
+                for file_path in (partial_file, partial_file + ".aux.xml"):
+                    if os.path.isfile(file_path):
+                        os.remove(file_path)
+            return {}
+
+        profiler.start("write report table")
+        # write the report table in the order of the input files
+        results = sorted(results + skipped, key=lambda r: files_in.index(r["file_in"]))
+        fieldnames = ["input", "output", "status", "seconds", "attempts", "error"]
+        with open(output_table, "w", newline="", encoding="utf-8") as fh:
+            writer = csv.DictWriter(fh, fieldnames=fieldnames, extrasaction="ignore")
+            writer.writeheader()
+            for result in results:
+                output = "" if result.get("error") else result["output_file"]
+                seconds = f"{result['seconds']:.3f}" if "seconds" in result else ""
+                writer.writerow({**result, "input": result["file_in"], "output": output, "seconds": seconds})
+
+        output_files = [result["output_file"] for result in results if not result.get("error")]
+        for output_file in output_files:
+            context.addLayerToLoadOnCompletion(
+                output_file,
+                QgsProcessingContext.LayerDetails(
+                    os.path.splitext(os.path.basename(output_file))[0], context.project(), self.OUTPUTS
+                ),
+            )
+
+        failed = sum(1 for result in results if result.get("error"))
+        feedback.pushInfo(f"\n{len(output_files)} of {len(files_in)} files aligned, {failed} failed")
+        if failed:
+            feedback.pushInfo("Run again with 'Skip existing outputs' enabled to retry only the failed files")
+        profiler.report(feedback, self.parameterAsFileOutput(parameters, self.STATS, context))
+        feedback.pushInfo("DONE\n")
+
+        return {self.OUTPUT_FOLDER: output_folder, self.OUTPUT_TABLE: output_table, self.OUTPUTS: output_files}
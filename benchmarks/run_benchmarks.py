@@ -0,0 +1,368 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Headless benchmark and accuracy suite of the four Coregistration algorithms.
+
+Synthetic reference/target pairs are generated with a known shift: a constant
+sub-pixel shift (global pair) and a shift varying linearly across the image
+(local pair). Every algorithm runs on every size in its own Python process,
+through a stub processing feedback and context, and the wall time, peak RSS and
+shift error are written as JSON, to compare the results between versions::
+
+    python3 benchmarks/run_benchmarks.py --sizes 1000,10000 --output results.json
+
+The plugin folder must be named ``Coregistration`` (as when it is installed).
+The synthetic images are kept in the data folder and reused by later runs.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from osgeo import gdal, ogr, osr
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ALGORITHMS = ("basic_pixel_alignment", "panning_pixel_adjustment", "global_coregistration", "local_coregistration")
+DEFAULT_SIZES = (1000, 10000, 40000)
+
+PIXEL_SIZE = 10.0
+ORIGIN = (500000.0, 5000000.0)
+EPSG = 32618
+SEED = 20260517
+# rows generated at once, bounding the memory used to write the synthetic images
+BLOCK_ROWS = 256
+
+# shift of the target content in pixels: (x, y) at the center and its variation across the image
+SHIFTS = {
+    "global": {"center": (0.37, -1.62), "variation": (0.0, 0.0)},
+    "local": {"center": (0.8, 0.45), "variation": (1.2, -0.9)},
+}
+
+
+def get_shift(pair, col, row, size):
+    """Return the shift in pixels of the target content at the target pixel (*col*, *row*)."""
+    shift = SHIFTS[pair]
+    shift_x = shift["center"][0] + shift["variation"][0] * (col / size - 0.5)
+    shift_y = shift["center"][1] + shift["variation"][1] * (row / size - 0.5)
+    return shift_x, shift_y
+
+
+def get_correction(shift_x, shift_y):
+    """Return the correction in map units that moves the target onto the reference for a shift in pixels."""
+    return shift_x * PIXEL_SIZE, -shift_y * PIXEL_SIZE
+
+
+def texture(cols, rows):
+    """Return a smooth, non periodic uint16 texture evaluated at fractional pixel coordinates."""
+    rng = np.random.default_rng(SEED)
+    value = np.zeros(np.broadcast_shapes(cols.shape, rows.shape))
+    for _ in range(16):
+        period = rng.uniform(6, 160)
+        angle = rng.uniform(0, math.pi)
+        phase = rng.uniform(0, 2 * math.pi)
+        u, v = math.cos(angle) / period, math.sin(angle) / period
+        value += rng.uniform(0.5, 1.0) * np.sin(2 * math.pi * (u * cols + v * rows) + phase)
+    return np.clip(32768 + 3000 * value, 0, 65535).astype(np.uint16)
+
+
+def write_image(file_path, size, pair=None):
+    """Write the reference (*pair* ``None``) or the target of *pair*, block of rows by block of rows."""
+    driver = gdal.GetDriverByName("GTiff")
+    options = ["TILED=YES", "BLOCKXSIZE=512", "BLOCKYSIZE=512", "BIGTIFF=IF_SAFER"]
+    ds = driver.Create(file_path + ".part", size, size, 1, gdal.GDT_UInt16, options=options)
+    ds.SetGeoTransform((ORIGIN[0], PIXEL_SIZE, 0, ORIGIN[1], 0, -PIXEL_SIZE))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    ds.SetProjection(srs.ExportToWkt())
+    band = ds.GetRasterBand(1)
+
+    cols = np.arange(size, dtype=np.float64)[np.newaxis, :]
+    for row_start in range(0, size, BLOCK_ROWS):
+        rows = np.arange(row_start, min(row_start + BLOCK_ROWS, size), dtype=np.float64)[:, np.newaxis]
+        if pair is None:
+            block = texture(cols, rows)
+        else:
+            # the target pixel (col, row) shows the ground of the reference pixel (col + dx, row + dy)
+            shift_x, shift_y = get_shift(pair, cols, rows, size)
+            block = texture(cols + shift_x, rows + shift_y)
+        band.WriteArray(block, 0, row_start)
+    band = None
+    ds = None
+    os.replace(file_path + ".part", file_path)
+
+
+def prepare_data(data_dir, size):
+    """Generate (once) the synthetic images of *size* and return their paths."""
+    os.makedirs(data_dir, exist_ok=True)
+    files = {"reference": os.path.join(data_dir, f"reference_{size}.tif")}
+    for pair in SHIFTS:
+        files[pair] = os.path.join(data_dir, f"target_{pair}_{size}.tif")
+    for name, file_path in files.items():
+        if not os.path.isfile(file_path):
+            print(f"Generating {os.path.basename(file_path)}...", flush=True)
+            write_image(file_path, size, pair=None if name == "reference" else name)
+    return files
+
+
+def get_peak_rss_mb(who):
+    """Return the peak resident set size in MB of this process or of its finished children."""
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def origin_error_px(output_file, expected_origin):
+    """Return the distance in pixels between the origin of *output_file* and *expected_origin*."""
+    ds = gdal.Open(output_file, gdal.GA_ReadOnly)
+    gt = ds.GetGeoTransform()
+    ds = None
+    return math.hypot(gt[0] - expected_origin[0], gt[3] - expected_origin[1]) / PIXEL_SIZE
+
+
+def tiepoints_error_px(cache_path, size):
+    """Return the mean error in pixels of the valid tie points of the local co-registration."""
+    ds = ogr.Open(cache_path)
+    layer = ds.GetLayer(0)
+    errors = []
+    for feature in layer:
+        if feature.GetField("OUTLIER") or feature.GetField("X_SHIFT_M") == -9999:
+            continue
+        col = (feature.GetField("X_MAP") - ORIGIN[0]) / PIXEL_SIZE
+        row = (ORIGIN[1] - feature.GetField("Y_MAP")) / PIXEL_SIZE
+        expected_x, expected_y = get_correction(*get_shift("local", col, row, size))
+        errors.append(
+            math.hypot(feature.GetField("X_SHIFT_M") - expected_x, feature.GetField("Y_SHIFT_M") - expected_y)
+        )
+    ds = None
+    return (sum(errors) / len(errors) / PIXEL_SIZE) if errors else None
+
+
+def run_case(algorithm, size, data_dir, work_dir):
+    """Run one *algorithm* on the images of *size* in this process and return its measures."""
+    sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+    from qgis.core import QgsApplication, QgsProcessingContext, QgsProcessingFeedback, QgsProject
+
+    qgs = QgsApplication([], False)
+    qgs.initQgis()
+
+    import Coregistration
+
+    Coregistration.pre_init_plugin()
+    from Coregistration.automated_global_coregistration_algorithm import AutomatedGlobalCoregistrationAlgorithm
+    from Coregistration.automated_local_coregistration_algorithm import AutomatedLocalCoregistrationAlgorithm
+    from Coregistration.basic_pixel_alignment_algorithm import CoregistrationAlgorithm
+    from Coregistration.panning_pixel_adjustment_algorithm import PanningPixelAdjustmentAlgorithm
+    from Coregistration.utils.tiepoints import get_cache_path
+
+    class StubFeedback(QgsProcessingFeedback):
+        """Processing feedback keeping the messages instead of printing them."""
+
+        def __init__(self):
+            super().__init__()
+            self.messages = []
+
+        def pushInfo(self, info):
+            self.messages.append(info)
+
+        def pushWarning(self, warning):
+            self.messages.append(warning)
+
+        def pushConsoleInfo(self, info):
+            self.messages.append(info)
+
+        def pushDebugInfo(self, info):
+            self.messages.append(info)
+
+        def reportError(self, error, fatalError=False):
+            self.messages.append(error)
+
+    files = prepare_data(data_dir, size)
+    output_file = os.path.join(work_dir, f"{algorithm}_{size}.tif")
+    global_shift = get_shift("global", 0, 0, size)
+    true_origin = tuple(o + c for o, c in zip(ORIGIN, get_correction(*global_shift), strict=True))
+
+    if algorithm == "basic_pixel_alignment":
+        alg = CoregistrationAlgorithm()
+        parameters = {"IMG_REF": files["reference"], "INPUT": files["global"], "OUTPUT": output_file}
+    elif algorithm == "panning_pixel_adjustment":
+        alg = PanningPixelAdjustmentAlgorithm()
+        parameters = {
+            "INPUT": files["global"],
+            "SHIFT_IN_X": global_shift[0],
+            "SHIFT_IN_Y": -global_shift[1],
+            "OUTPUT": output_file,
+        }
+    elif algorithm == "global_coregistration":
+        alg = AutomatedGlobalCoregistrationAlgorithm()
+        parameters = {
+            "IMG_REF": files["reference"],
+            "INPUT": files["global"],
+            "ALIGN_GRIDS": False,
+            "MATCH_GSD": False,
+            "OUTPUT_MODE": 1,
+            "OUTPUT": output_file,
+        }
+    else:
+        alg = AutomatedLocalCoregistrationAlgorithm()
+        parameters = {
+            "IMG_REF": files["reference"],
+            "INPUT": files["local"],
+            "CACHE_TIEPOINTS": True,
+            "OUTPUT": output_file,
+        }
+        # a cached tie points set would skip the matching
+        if os.path.isfile(get_cache_path(files["local"])):
+            os.remove(get_cache_path(files["local"]))
+
+    alg = alg.create()
+    context = QgsProcessingContext()
+    context.setProject(QgsProject.instance())
+    feedback = StubFeedback()
+
+    start = time.perf_counter()
+    results, ok = alg.run(parameters, context, feedback)
+    wall_time = time.perf_counter() - start
+
+    case = {
+        "algorithm": algorithm,
+        "size": size,
+        "status": "done" if ok else "failed",
+        "wall_time_s": round(wall_time, 3),
+        "peak_rss_mb": round(get_peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "peak_rss_children_mb": round(get_peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        "shift_error_px": None,
+    }
+    if not ok:
+        case["error"] = "\n".join(feedback.messages[-5:])
+    elif algorithm in ("panning_pixel_adjustment", "global_coregistration"):
+        case["shift_error_px"] = round(origin_error_px(results["OUTPUT"], true_origin), 4)
+    elif algorithm == "local_coregistration":
+        error = tiepoints_error_px(get_cache_path(files["local"]), size)
+        case["shift_error_px"] = None if error is None else round(error, 4)
+
+    qgs.exitQgis()
+    return case
+
+
+def get_environment():
+    """Return the versions of the plugin, its dependencies and the machine running the benchmark."""
+    environment = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "gdal": gdal.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+    with open(os.path.join(PLUGIN_DIR, "metadata.txt"), encoding="utf-8") as fh:
+        for line in fh:
+            if line.startswith("version="):
+                environment["plugin"] = line.split("=", 1)[1].strip()
+    return environment
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Coregistration algorithms on synthetic shifted rasters."
+    )
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="comma separated image sizes in pixels per side (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--algorithms",
+        default=",".join(ALGORITHMS),
+        help="comma separated algorithms to run (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=os.path.join(tempfile.gettempdir(), "coregistration_benchmarks"),
+        help="folder of the synthetic images, reused between runs (default: %(default)s)",
+    )
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file (default: %(default)s)")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # child process: run a single case and print its measures as JSON
+        algorithm, size, work_dir = json.loads(args.case)
+        print(json.dumps(run_case(algorithm, size, args.data_dir, work_dir)))
+        return
+
+    if os.path.basename(PLUGIN_DIR) != "Coregistration":
+        parser.error(f"the plugin folder must be named 'Coregistration', not '{os.path.basename(PLUGIN_DIR)}'")
+    algorithms = [algorithm.strip() for algorithm in args.algorithms.split(",") if algorithm.strip()]
+    unknown = set(algorithms) - set(ALGORITHMS)
+    if unknown:
+        parser.error(f"unknown algorithms: {', '.join(sorted(unknown))}")
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+
+    report = {"environment": get_environment(), "results": []}
+    with tempfile.TemporaryDirectory(prefix="coregistration_benchmark_") as work_dir:
+        for size in sizes:
+            prepare_data(args.data_dir, size)
+            for algorithm in algorithms:
+                print(f"{algorithm} ({size}x{size})...", end=" ", flush=True)
+                # every case runs in a new process, so its peak memory is not mixed with the others
+                process = subprocess.run(
+                    [
+                        sys.executable,
+                        os.path.abspath(__file__),
+                        "--data-dir",
+                        args.data_dir,
+                        "--case",
+                        json.dumps([algorithm, size, work_dir]),
+                    ],
+                    capture_output=True,
+                    text=True,
+                )
+                try:
+                    case = json.loads(process.stdout.strip().splitlines()[-1])
+                except (IndexError, ValueError):
+                    case = {
+                        "algorithm": algorithm,
+                        "size": size,
+                        "status": "crashed",
+                        "error": process.stderr.strip()[-2000:],
+                    }
+                report["results"].append(case)
+                print(
+                    f"{case['status']}, {case.get('wall_time_s', '-')} s, {case.get('peak_rss_mb', '-')} MB, "
+                    f"shift error {case.get('shift_error_px', '-')} px",
+                    flush=True,
+                )
+                for file_name in os.listdir(work_dir):
+                    os.remove(os.path.join(work_dir, file_name))
+
+    with open(args.output, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
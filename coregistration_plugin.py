@@ -22,9 +22,10 @@ import inspect
 import os
 import sys
 
-from qgis.core import QgsApplication
+from qgis.core import Qgis, QgsApplication, QgsMessageLog
 
 from Coregistration.coregistration_provider import CoregistrationProvider
+from Coregistration.utils.instrumentation import format_startup_times, startup_timer
 
 cmd_folder = os.path.split(inspect.getfile(inspect.currentframe()))[0]
 
@@ -38,7 +39,9 @@ class CoregistrationPlugin:
 
     def initProcessing(self):
         """Init Processing provider for QGIS >= 3.8."""
-        QgsApplication.processingRegistry().addProvider(self.provider)
+        with startup_timer("provider registration"):
+            QgsApplication.processingRegistry().addProvider(self.provider)
+        QgsMessageLog.logMessage(format_startup_times(), tag="Coregistration", level=Qgis.MessageLevel.Info)
 
     def initGui(self):
         self.initProcessing()
@@ -21,10 +21,17 @@
 from qgis.core import QgsProcessingProvider
 from qgis.PyQt.QtGui import QIcon
 
+from Coregistration.apply_shift_algorithm import ApplyShiftAlgorithm
 from Coregistration.automated_global_coregistration_algorithm import AutomatedGlobalCoregistrationAlgorithm
+from Coregistration.automated_global_coregistration_batch_algorithm import (
+    AutomatedGlobalCoregistrationBatchAlgorithm,
+)
 from Coregistration.automated_local_coregistration_algorithm import AutomatedLocalCoregistrationAlgorithm
+from Coregistration.automated_stack_coregistration_algorithm import AutomatedStackCoregistrationAlgorithm
 from Coregistration.basic_pixel_alignment_algorithm import CoregistrationAlgorithm
+from Coregistration.basic_pixel_alignment_batch_algorithm import BasicPixelAlignmentBatchAlgorithm
 from Coregistration.panning_pixel_adjustment_algorithm import PanningPixelAdjustmentAlgorithm
+from Coregistration.panning_pixel_adjustment_batch_algorithm import PanningPixelAdjustmentBatchAlgorithm
 
 
 class CoregistrationProvider(QgsProcessingProvider):
@@ -46,8 +53,13 @@ class CoregistrationProvider(QgsProcessingProvider):
         Loads all algorithms belonging to this provider.
         """
         self.addAlgorithm(CoregistrationAlgorithm())
+        self.addAlgorithm(BasicPixelAlignmentBatchAlgorithm())
         self.addAlgorithm(PanningPixelAdjustmentAlgorithm())
+        self.addAlgorithm(PanningPixelAdjustmentBatchAlgorithm())
         self.addAlgorithm(AutomatedGlobalCoregistrationAlgorithm())
+        self.addAlgorithm(AutomatedGlobalCoregistrationBatchAlgorithm())
+        self.addAlgorithm(AutomatedStackCoregistrationAlgorithm())
+        self.addAlgorithm(ApplyShiftAlgorithm())
         self.addAlgorithm(AutomatedLocalCoregistrationAlgorithm())
 
     def id(self):
@@ -24,6 +24,9 @@ from osgeo import gdal
 from qgis.core import (
     Qgis,
     QgsProcessingAlgorithm,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFileDestination,
     QgsProcessingParameterNumber,
     QgsProcessingParameterRasterDestination,
     QgsProcessingParameterRasterLayer,
@@ -32,6 +35,13 @@ from qgis.core import (
 from qgis.PyQt.QtCore import QCoreApplication
 from qgis.PyQt.QtGui import QIcon
 
+from Coregistration.utils.instrumentation import StageProfiler
+from Coregistration.utils.raster_utils import (
+    OUTPUT_MODE_VRT,
+    get_creation_options,
+    get_performance_settings,
+    pan_raster,
+)
 from Coregistration.utils.system_utils import get_raster_driver_name_by_extension
 
 
@@ -48,8 +58,17 @@ class PanningPixelAdjustmentAlgorithm(QgsProcessingAlgorithm):
     INPUT = "INPUT"
     SHIFT_IN_X = "SHIFT_IN_X"
     SHIFT_IN_Y = "SHIFT_IN_Y"
+    COG = "COG"
+    OUTPUT_MODE = "OUTPUT_MODE"
+    STATS = "STATS"
     OUTPUT = "OUTPUT"
 
+    output_modes = (
+        "Full copy (rewrite the pixel data)",
+        "Virtual raster (VRT) referencing the input file",
+        "Copy of the files (reflink when supported) with the geotransform updated",
+    )
+
     def __init__(self):
         super().__init__()
 
@@ -69,6 +88,13 @@ class PanningPixelAdjustmentAlgorithm(QgsProcessingAlgorithm):
             "directions. The shift values are expressed in pixel units and can be fractional.</p>"
             "<p>This algorithm is not automatic — the user must specify the pixel shift in X and Y. "
             "Skipping the output will overwrite and update the georeferencing of the input file in place.</p>"
+            "<p>When an output file is given, the output mode sets how it is written: a full copy rewrites all "
+            "the pixel data; a virtual raster (VRT) only references the input file with the shifted "
+            "georeferencing; a file copy duplicates the input files (instantly and without extra disk space "
+            "on file systems supporting reflinks, such as Btrfs, XFS or APFS) and only updates the "
+            "georeferencing of the copy. The last two take milliseconds whatever the size of the image.</p>"
+            "<p>With the COG option, the output file is written as a Cloud Optimized GeoTIFF: tiled, compressed "
+            "and with internal overviews built in the same pass.</p>"
         )
         return html_help
 
@@ -143,6 +169,34 @@ class PanningPixelAdjustmentAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.COG,
+                self.tr("Write the output as Cloud Optimized GeoTIFF (COG) with overviews (.tif output file only)"),
+                defaultValue=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterEnum(
+            self.OUTPUT_MODE,
+            self.tr("How to write the output file (if any)"),
+            options=[self.tr(mode) for mode in self.output_modes],
+            defaultValue=0,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterFileDestination(
+            self.STATS,
+            self.tr("Processing statistics (JSON)"),
+            fileFilter="JSON files (*.json)",
+            optional=True,
+            createByDefault=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
         self.addParameter(
             QgsProcessingParameterRasterDestination(
                 self.OUTPUT,
@@ -161,11 +215,16 @@ class PanningPixelAdjustmentAlgorithm(QgsProcessingAlgorithm):
         def get_inputfilepath(layer):
             return os.path.realpath(layer.source().split("|layername")[0])
 
+        profiler = StageProfiler(self.name())
+        profiler.start("open input")
+
         file_in = self.parameterAsRasterLayer(parameters, self.INPUT, context)
         file_in_path = get_inputfilepath(file_in)
 
         shift_in_x = self.parameterAsDouble(parameters, self.SHIFT_IN_X, context)
         shift_in_y = self.parameterAsDouble(parameters, self.SHIFT_IN_Y, context)
+        cog = self.parameterAsBoolean(parameters, self.COG, context)
+        output_mode = self.parameterAsEnum(parameters, self.OUTPUT_MODE, context)
 
         output_file = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
 
@@ -176,33 +235,14 @@ class PanningPixelAdjustmentAlgorithm(QgsProcessingAlgorithm):
         if os.path.isfile(file_in_path + ".aux.xml"):
             os.remove(file_in_path + ".aux.xml")
 
+        profiler.start("write")
         skip_output = output_file == ""
 
         if skip_output:
-            # Overwrite in place: only update the geotransform tag in the
-            # existing file. We avoid CreateCopy here because it rewrites the
-            # whole file (write temp → delete original → rename), which fails on
-            # Windows when QGIS holds an open handle on the loaded layer
-            # ("Permission denied" on the delete step). Updating the geotransform
-            # via GA_Update touches only the header, so the existing file handle
-            # does not block it.
-            update_ds = gdal.Open(file_in_path, gdal.GA_Update)
-            gt = update_ds.GetGeoTransform()
-            pixel_size_x = abs(gt[1])
-            pixel_size_y = abs(gt[5])
-            gtl = list(gt)
-            gtl[0] = gtl[0] + pixel_size_x * shift_in_x  # Move horizontal
-            gtl[3] = gtl[3] + pixel_size_y * shift_in_y  # Move vertical
-            update_ds.SetGeoTransform(tuple(gtl))
-            update_ds.FlushCache()
-            update_ds = None
-
+            # Overwrite in place: only the geotransform in the header is updated, see pan_raster
+            pan_raster(file_in_path, None, shift_in_x, shift_in_y)
             output_file = file_in_path
 
-            # remove .aux.xml output file
-            if os.path.isfile(output_file + ".aux.xml"):
-                os.remove(output_file + ".aux.xml")
-
             # Re-bind the layer to its source so QGIS fully rebuilds its
             # internal state (data provider, extent, renderer/symbology caches).
             # Just calling reload() / reloadData() is not enough: the renderer
@@ -215,38 +255,47 @@ class PanningPixelAdjustmentAlgorithm(QgsProcessingAlgorithm):
             file_in.setDataSource(file_in.source(), file_in.name(), file_in.providerType(), False)
             file_in.triggerRepaint()
         else:
-            input_ds = gdal.Open(file_in_path, gdal.GA_ReadOnly)
-            gt = input_ds.GetGeoTransform()
-            pixel_size_x = abs(gt[1])
-            pixel_size_y = abs(gt[5])
-            gtl = list(gt)
-            gtl[0] = gtl[0] + pixel_size_x * shift_in_x  # Move horizontal
-            gtl[3] = gtl[3] + pixel_size_y * shift_in_y  # Move vertical
-            input_ds.SetGeoTransform(tuple(gtl))
-
-            output_driver_name = get_raster_driver_name_by_extension(output_file)
-
-            # fix save and load ENVI files
-            if output_driver_name == "ENVI":
-                output_file_envi = output_file.replace(".hdr", ".dat")
+            output_driver_name = get_raster_driver_name_by_extension(output_file, cog=cog)
+            if cog and output_driver_name != "COG":
+                feedback.pushWarning("\nThe COG option requires a .tif output file, it is ignored.\n")
+
+            # fix save and load ENVI files, and the virtual raster output file name
+            fixed_output_file = output_file
+            if output_mode == OUTPUT_MODE_VRT and output_driver_name not in ("VRT", "COG"):
+                fixed_output_file = os.path.splitext(output_file)[0] + ".vrt"
+            elif output_driver_name == "ENVI":
+                fixed_output_file = output_file.replace(".hdr", ".dat")
+            if fixed_output_file != output_file:
                 if context.willLoadLayerOnCompletion(output_file):
                     layer_detail = context.LayerDetails(
-                        os.path.basename(output_file_envi),
+                        os.path.basename(fixed_output_file),
                         context.project(),
-                        os.path.basename(output_file_envi),
+                        os.path.basename(fixed_output_file),
                         QgsProcessingUtils.LayerHint.Raster,
                     )
-                    context.setLayersToLoadOnCompletion({output_file_envi: layer_detail})
-                output_file = output_file_envi
-
-            gdal_driver = gdal.GetDriverByName(output_driver_name)
-            gdal_driver.CreateCopy(output_file, input_ds)
-            input_ds = None
-
-            # remove .aux.xml output file
-            if os.path.isfile(output_file + ".aux.xml"):
-                os.remove(output_file + ".aux.xml")
+                    context.setLayersToLoadOnCompletion({fixed_output_file: layer_detail})
+                output_file = fixed_output_file
+
+            creation_options = None
+            if output_driver_name == "COG":
+                input_ds = gdal.Open(file_in_path, gdal.GA_ReadOnly)
+                data_type = input_ds.GetRasterBand(1).DataType
+                input_ds = None
+                creation_options = get_creation_options("COG", get_performance_settings(0), data_type)
+
+            feedback.pushInfo(f"\nWriting the shifted file ({self.tr(self.output_modes[output_mode])})...")
+            pan_raster(
+                file_in_path,
+                output_file,
+                shift_in_x,
+                shift_in_y,
+                output_mode=output_mode,
+                output_driver_name=output_driver_name,
+                creation_options=creation_options,
+                feedback=feedback,
+            )
 
+        profiler.report(feedback, self.parameterAsFileOutput(parameters, self.STATS, context))
         feedback.pushInfo("--> done\n")
 
         return {self.OUTPUT: output_file}
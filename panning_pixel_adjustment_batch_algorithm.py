@@ -0,0 +1,324 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from qgis.core import (
+    Qgis,
+    QgsProcessingAlgorithm,
+    QgsProcessingContext,
+    QgsProcessingOutputMultipleLayers,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterFileDestination,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterNumber,
+)
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.PyQt.QtGui import QIcon
+
+from Coregistration.panning_pixel_adjustment_algorithm import PanningPixelAdjustmentAlgorithm
+from Coregistration.utils.instrumentation import StageProfiler
+from Coregistration.utils.raster_utils import OUTPUT_MODE_VRT, get_output_names, pan_raster_worker
+from Coregistration.utils.system_utils import get_default_cpus
+
+
+class PanningPixelAdjustmentBatchAlgorithm(QgsProcessingAlgorithm):
+    """
+    Applies the same manual X/Y pixel shift to several raster files at once,
+    updating the files concurrently in a thread pool.
+    """
+
+    # Constants used to refer to parameters and outputs. They will be
+    # used when calling the algorithm from another algorithm, or when
+    # calling from the QGIS console.
+
+    INPUTS = "INPUTS"
+    SHIFT_IN_X = "SHIFT_IN_X"
+    SHIFT_IN_Y = "SHIFT_IN_Y"
+    THREADS = "THREADS"
+    OUTPUT_MODE = "OUTPUT_MODE"
+    OUTPUT_FOLDER = "OUTPUT_FOLDER"
+    STATS = "STATS"
+    OUTPUTS = "OUTPUTS"
+
+    output_modes = PanningPixelAdjustmentAlgorithm.output_modes
+
+    def __init__(self):
+        super().__init__()
+        self.layers_to_refresh = []
+
+    def tr(self, string, context=""):
+        if context == "":
+            context = self.__class__.__name__
+        return QCoreApplication.translate(context, string)
+
+    def shortHelpString(self):
+        """
+        Returns a localised short helper string for the algorithm. This string
+        should provide a basic description about what the algorithm does and the
+        parameters and outputs associated with it.
+        """
+        html_help = (
+            "<p>Applies the same manual pixel shift in X and Y to several raster files in one run, for example "
+            "all the band files and quality masks of a product. The shift values are expressed in pixel units "
+            "of each file and can be fractional.</p>"
+            "<p>Skipping the output folder updates the georeferencing of the input files in place, touching only "
+            "their headers; the affected layers are refreshed once when all the files are done. With an output "
+            "folder, every shifted file is saved as <i>&lt;input name&gt;_shifted</i> in the same format as the "
+            "input (inputs with the same name in different folders get their folder name added), written with "
+            "the selected output mode (see Panning pixel adjustment).</p>"
+            "<p>Files are processed concurrently; a file that fails is reported and does not stop the rest of "
+            "the batch.</p>"
+        )
+        return html_help
+
+    def createInstance(self):
+        return PanningPixelAdjustmentBatchAlgorithm()
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        The name should be unique within each provider. Names should contain
+        lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return "panning_pixel_adjustment_batch"
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr("Panning pixel adjustment (multiple inputs)")
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return None
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to. This
+        string should be fixed for the algorithm, and must not be localised.
+        The group id should be unique within each provider. Group id should
+        contain lowercase alphanumeric characters only and no spaces or other
+        formatting characters.
+        """
+        return None
+
+    def icon(self):
+        return QIcon(":/plugins/Coregistration/icons/coregistration.svg")
+
+    def initAlgorithm(self, config=None):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.INPUTS,
+                self.tr("The input images to shift"),
+                layerType=Qgis.ProcessingSourceType.Raster,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.SHIFT_IN_X,
+                self.tr("Shift in X (pixels)"),
+                type=Qgis.ProcessingNumberParameterType.Double,
+                defaultValue=0,
+                optional=False,
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.SHIFT_IN_Y,
+                self.tr("Shift in Y (pixels)"),
+                type=Qgis.ProcessingNumberParameterType.Double,
+                defaultValue=0,
+                optional=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterNumber(
+            self.THREADS,
+            self.tr("Number of files processed at the same time"),
+            type=Qgis.ProcessingNumberParameterType.Integer,
+            defaultValue=get_default_cpus(),
+            minValue=1,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        parameter = QgsProcessingParameterEnum(
+            self.OUTPUT_MODE,
+            self.tr("How to write the output files (if any)"),
+            options=[self.tr(mode) for mode in self.output_modes],
+            defaultValue=2,
+            optional=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr("Output folder for the shifted files (skip it to update the inputs in place)"),
+                optional=True,
+                createByDefault=False,
+            )
+        )
+
+        parameter = QgsProcessingParameterFileDestination(
+            self.STATS,
+            self.tr("Processing statistics (JSON)"),
+            fileFilter="JSON files (*.json)",
+            optional=True,
+            createByDefault=False,
+        )
+        parameter.setFlags(parameter.flags() | Qgis.ProcessingParameterFlag.Advanced)
+        self.addParameter(parameter)
+
+        self.addOutput(QgsProcessingOutputMultipleLayers(self.OUTPUTS, self.tr("Shifted raster files")))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+
+        def get_inputfilepath(layer):
+            return os.path.realpath(layer.source().split("|layername")[0])
+
+        profiler = StageProfiler(self.name())
+        profiler.start("open inputs")
+
+        # several layers can point to the same file, each file is shifted only once
+        layers_by_file = {}
+        for layer in self.parameterAsLayerList(parameters, self.INPUTS, context):
+            layers_by_file.setdefault(get_inputfilepath(layer), []).append(layer)
+        if not layers_by_file:
+            feedback.reportError("\nNo input images to shift.\n", fatalError=True)
+            return {}
+
+        shift_in_x = self.parameterAsDouble(parameters, self.SHIFT_IN_X, context)
+        shift_in_y = self.parameterAsDouble(parameters, self.SHIFT_IN_Y, context)
+        output_mode = self.parameterAsEnum(parameters, self.OUTPUT_MODE, context)
+
+        output_folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        in_place = output_folder == ""
+        if not in_place:
+            os.makedirs(output_folder, exist_ok=True)
+
+        feedback.pushInfo("Image panning adjustment for multiple inputs:")
+
+        # inputs with the same file name (e.g. B01.jp2 of different granules) get unique output names
+        output_names = get_output_names(
+            list(layers_by_file), "_shifted", ".vrt" if output_mode == OUTPUT_MODE_VRT else None
+        )
+        tasks = []
+        for file_in, output_name in zip(layers_by_file, output_names, strict=True):
+            # remove .aux.xml file
+            if os.path.isfile(file_in + ".aux.xml"):
+                os.remove(file_in + ".aux.xml")
+
+            output_file = None if in_place else os.path.join(output_folder, output_name)
+            tasks.append(
+                {
+                    "file_in": file_in,
+                    "output_file": output_file,
+                    "shift_in_x": shift_in_x,
+                    "shift_in_y": shift_in_y,
+                    "output_mode": output_mode,
+                }
+            )
+
+        # the work is mostly file I/O where GDAL releases the GIL, so threads are enough
+        threads = max(1, min(self.parameterAsInt(parameters, self.THREADS, context), len(tasks)))
+        feedback.pushInfo(f"\nShifting {len(tasks)} files using {threads} thread(s)...\n")
+
+        profiler.start("write")
+        results = []
+        executor = ThreadPoolExecutor(max_workers=threads)
+        try:
+            futures = [executor.submit(pan_raster_worker, task) for task in tasks]
+            for done, future in enumerate(as_completed(futures), 1):
+                if feedback.isCanceled():
+                    break
+                result = future.result()
+                if result["error"]:
+                    feedback.reportError(f"{result['file_in']}: {result['error']}", fatalError=False)
+                else:
+                    feedback.pushInfo(f"{result['file_in']}: done in {result['seconds']:.2f} s")
+                results.append(result)
+                feedback.setProgress(100 * done / len(tasks))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        shifted = [result for result in results if not result["error"]]
+
+        if in_place:
+            # the layers are rebuilt in postProcessAlgorithm, once for the whole batch
+            self.layers_to_refresh = [layer for result in shifted for layer in layers_by_file[result["file_in"]]]
+        else:
+            for result in shifted:
+                context.addLayerToLoadOnCompletion(
+                    result["output_file"],
+                    QgsProcessingContext.LayerDetails(
+                        os.path.splitext(os.path.basename(result["output_file"]))[0], context.project(), self.OUTPUTS
+                    ),
+                )
+
+        if feedback.isCanceled():
+            return {}
+
+        feedback.pushInfo(f"\n{len(shifted)} of {len(tasks)} files shifted, {len(results) - len(shifted)} failed")
+        profiler.report(feedback, self.parameterAsFileOutput(parameters, self.STATS, context))
+        feedback.pushInfo("DONE\n")
+
+        return {
+            self.OUTPUT_FOLDER: output_folder,
+            self.OUTPUTS: [result["output_file"] for result in shifted],
+        }
+
+    def postProcessAlgorithm(self, context, feedback):
+        """
+        Refreshes the layers updated in place, in the main thread and only once
+        at the end of the batch.
+        """
+        # Re-bind every layer to its source so QGIS fully rebuilds its internal
+        # state (see PanningPixelAdjustmentAlgorithm), the canvas then repaints
+        # once for all the layers.
+        for layer in self.layers_to_refresh:
+            layer.dataProvider().reloadData()
+            layer.setDataSource(layer.source(), layer.name(), layer.providerType(), False)
+        for layer in self.layers_to_refresh:
+            layer.triggerRepaint()
+        self.layers_to_refresh = []
+
+        return {}
@@ -0,0 +1,217 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of the extlibs downloader against a local HTTP server, without QGIS.
+The plugin folder is a package that imports QGIS, so run them with unittest
+from the plugin folder:
+
+    python -m unittest discover -s tests
+"""
+
+import hashlib
+import importlib.util
+import io
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+# utils/downloader.py has no QGIS dependency, it is loaded without the plugin package
+_spec = importlib.util.spec_from_file_location(
+    "downloader", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils", "downloader.py")
+)
+downloader = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(downloader)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def make_zip(files):
+    """Return the bytes of a ZIP with the ``{name: content}`` *files*."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return buffer.getvalue()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves ``server.files`` (``{path: bytes}``), with range requests if ``server.ranges``."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        data = self.server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return
+        range_header = self.headers.get("Range")
+        if range_header and self.server.ranges:
+            start, end = range_header.split("=")[1].split("-")
+            start, end = int(start), min(int(end) if end else len(data) - 1, len(data) - 1)
+            body = data[start : end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", hashlib.md5(data).hexdigest())
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class DownloadAndExtractTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.files = {}
+        self.server.ranges = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.tmp_dir, "extlibs")
+        self.zip_path = os.path.join(self.tmp_dir, "download", "extlibs.zip")
+
+        rng = random.Random(0)
+        self.files = {
+            "arosics/__init__.py": b"version = 1\n",
+            "arosics/lib.so": rng.randbytes(5 * CHUNK_SIZE + 123),
+            "geoarray/__init__.py": b"",
+        }
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def publish(self, files, sha256=True):
+        data = make_zip(files)
+        self.server.files["/extlibs.zip"] = data
+        if sha256:
+            digest = hashlib.sha256(data).hexdigest()
+            self.server.files["/extlibs.zip.sha256"] = f"{digest}  extlibs.zip\n".encode()
+        else:
+            self.server.files.pop("/extlibs.zip.sha256", None)
+        return self.base_url + "/extlibs.zip"
+
+    def install(self, url, **kwargs):
+        sha256 = kwargs.pop("sha256", None) or downloader.fetch_sha256(url)
+        return downloader.download_and_extract(
+            url, self.zip_path, self.output_path, sha256=sha256, chunk_size=CHUNK_SIZE, **kwargs
+        )
+
+    def read_installed(self):
+        installed = {}
+        for root, _dirs, file_names in os.walk(self.output_path):
+            for file_name in file_names:
+                file_path = os.path.join(root, file_name)
+                name = os.path.relpath(file_path, self.output_path).replace(os.sep, "/")
+                if name != downloader.MANIFEST_NAME:
+                    with open(file_path, "rb") as fh:
+                        installed[name] = fh.read()
+        return installed
+
+    def test_install_with_ranges(self):
+        files = self.install(self.publish(self.files))
+        self.assertEqual(sorted(files["extracted"]), sorted(self.files))
+        self.assertEqual(self.read_installed(), self.files)
+        self.assertTrue(os.path.isfile(os.path.join(self.output_path, downloader.MANIFEST_NAME)))
+        self.assertFalse(os.path.exists(self.zip_path))
+        self.assertFalse(os.path.exists(self.output_path + ".staging"))
+
+    def test_install_without_ranges(self):
+        self.server.ranges = False
+        self.install(self.publish(self.files))
+        self.assertEqual(self.read_installed(), self.files)
+
+    def test_checksum_mismatch_keeps_the_installation(self):
+        self.install(self.publish(self.files))
+        url = self.publish(dict(self.files, **{"arosics/__init__.py": b"version = 2\n"}))
+        with self.assertRaises(ValueError):
+            self.install(url, sha256="0" * 64)
+        self.assertEqual(self.read_installed(), self.files)
+        self.assertFalse(os.path.exists(self.output_path + ".staging"))
+        self.assertFalse(os.path.exists(self.zip_path))
+
+    def test_cancel_and_resume(self):
+        url = self.publish(self.files)
+        # cancel once the first chunks are on disk
+        download = self.install(url, connections=1, is_canceled=lambda: os.path.isfile(self.zip_path + ".parts"))
+        self.assertIsNone(download)
+        self.assertFalse(os.path.exists(self.output_path))
+        self.assertTrue(os.path.isfile(self.zip_path))
+
+        self.install(url)
+        self.assertEqual(self.read_installed(), self.files)
+
+    def test_no_resume_without_checksum(self):
+        url = self.publish(self.files, sha256=False)
+        self.assertIsNone(downloader.fetch_sha256(url))
+        self.install(url, connections=1, is_canceled=lambda: True)
+        # corrupt the partial archive, it must not be trusted on the next attempt
+        with open(self.zip_path, "r+b") as fh:
+            fh.write(b"\0" * CHUNK_SIZE)
+        self.install(url)
+        self.assertEqual(self.read_installed(), self.files)
+
+    def test_upgrade_in_place(self):
+        self.install(self.publish(self.files))
+        new_files = dict(self.files, **{"arosics/__init__.py": b"version = 2\n", "arosics/new.py": b"new = True\n"})
+        del new_files["geoarray/__init__.py"]
+        files = self.install(self.publish(new_files))
+        self.assertEqual(sorted(files["extracted"]), ["arosics/__init__.py", "arosics/new.py"])
+        self.assertEqual(files["unchanged"], ["arosics/lib.so"])
+        self.assertEqual(files["removed"], ["geoarray/__init__.py"])
+        self.assertEqual(self.read_installed(), new_files)
+        self.assertFalse(os.path.exists(os.path.join(self.output_path, "geoarray")))
+        manifest = downloader.load_manifest(os.path.join(self.output_path, downloader.MANIFEST_NAME))
+        self.assertEqual(sorted(manifest), sorted(new_files))
+
+    def test_failed_upgrade_is_rolled_back(self):
+        self.install(self.publish(self.files))
+        manifest_path = os.path.join(self.output_path, downloader.MANIFEST_NAME)
+        old_manifest = downloader.load_manifest(manifest_path)
+        new_files = {name: content + b"\n" for name, content in self.files.items()}
+        url = self.publish(new_files)
+
+        replace = os.replace
+
+        def failing_replace(src, dst):
+            # the last file of the archive cannot be installed
+            if src.endswith(os.path.join(".staging", "geoarray", "__init__.py")):
+                raise OSError("disk full")
+            replace(src, dst)
+
+        with mock.patch.object(downloader.os, "replace", failing_replace), self.assertRaises(OSError):
+            self.install(url)
+        self.assertEqual(self.read_installed(), self.files)
+        self.assertEqual(downloader.load_manifest(manifest_path), old_manifest)
+        self.assertFalse(os.path.exists(self.output_path + ".staging"))
+        self.assertFalse(os.path.exists(self.output_path + ".backup"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of the output forwarding to the processing feedback, without QGIS. The
+progress bar tests need py_tools_ds (installed with AROSICS), otherwise they
+are skipped. Run them with unittest from the plugin folder:
+
+    python -m unittest discover -s tests
+"""
+
+import importlib.util
+import os
+import unittest
+
+# imported before any redirection, as AROSICS is in QGIS: the progress bars bind the original stderr
+try:
+    from py_tools_ds.processing.progress_mon import ProgressBar
+except ImportError:
+    ProgressBar = None
+
+# utils/system_utils.py has no QGIS dependency, it is loaded without the plugin package
+_PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location("system_utils", os.path.join(_PLUGIN_DIR, "utils", "system_utils.py"))
+system_utils = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(system_utils)
+
+
+class Feedback:
+    """Records the calls of a QgsProcessingFeedback."""
+
+    def __init__(self):
+        self.progress = []
+        self.messages = []
+
+    def setProgress(self, progress):
+        self.progress.append(progress)
+
+    def pushInfo(self, text):
+        self.messages.append(text)
+
+    def pushWarning(self, text):
+        self.messages.append(text)
+
+    def reportError(self, text, fatalError=False):
+        self.messages.append(text)
+
+    def isCanceled(self):
+        return False
+
+
+def print_progress_bar(report_stage=None):
+    """Print a progress bar of AROSICS up to 100%."""
+    progress_bar = ProgressBar(prefix="\tprogress:")
+    for percent in (25, 50, 100):
+        progress_bar.print_progress(percent)
+
+
+@unittest.skipIf(ProgressBar is None, "requires py_tools_ds (AROSICS)")
+class ProgressBarTest(unittest.TestCase):
+    def test_progress_bar_in_redirection(self):
+        feedback = Feedback()
+        with system_utils.redirect_output_to_feedback(feedback, progress_range=(0, 50)):
+            print_progress_bar()
+        self.assertIn(12.5, feedback.progress)
+        self.assertEqual(max(feedback.progress), 50)
+
+    @unittest.skipUnless(system_utils.get_start_method() == "fork", "the task must be importable in the child")
+    def test_progress_bar_in_subprocess(self):
+        feedback = Feedback()
+        system_utils.run_in_subprocess(print_progress_bar, {}, feedback, progress_range=(0, 50))
+        self.assertIn(12.5, feedback.progress)
+        self.assertEqual(max(feedback.progress), 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Tests of the warp with the local tie points. They need GDAL, numpy, pandas
+and the plugin installed as the ``Coregistration`` package (e.g. in the QGIS
+Python environment), otherwise they are skipped:
+
+    python -m unittest discover -s tests
+"""
+
+import math
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import numpy as np
+    import pandas as pd
+    from osgeo import gdal, osr
+
+    from Coregistration.utils import tiepoints
+except ImportError:
+    tiepoints = None
+
+SIZE = 120
+PIXEL_SIZE = 10
+GEOTRANSFORM = (500000, PIXEL_SIZE, 0, 4000000, 0, -PIXEL_SIZE)
+# amplitude in pixels and number of periods of the synthetic shift field across the image
+AMPLITUDE = 3
+PERIODS = 3
+
+
+@unittest.skipIf(tiepoints is None, "requires GDAL, numpy, pandas and the Coregistration package")
+class WarpWithTiepointsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # the value of each pixel is its column in band 1 and its row in band 2
+        self.img_tgt = os.path.join(self.tmp_dir, "target.tif")
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(32618)
+        ds = gdal.GetDriverByName("GTiff").Create(self.img_tgt, SIZE, SIZE, 2, gdal.GDT_Float32)
+        ds.SetGeoTransform(GEOTRANSFORM)
+        ds.SetProjection(srs.ExportToWkt())
+        rows, cols = np.indices((SIZE, SIZE), dtype=np.float32)
+        ds.GetRasterBand(1).WriteArray(cols)
+        ds.GetRasterBand(2).WriteArray(rows)
+        ds = None
+
+        # a shift field varying as a sine, that no low order polynomial can follow
+        points = []
+        for row in range(5, SIZE, 10):
+            for col in range(5, SIZE, 10):
+                x_shift = AMPLITUDE * math.sin(2 * math.pi * PERIODS * col / SIZE)
+                y_shift = AMPLITUDE * math.sin(2 * math.pi * PERIODS * row / SIZE)
+                points.append(
+                    {
+                        "X_IM": col + 0.5,
+                        "Y_IM": row + 0.5,
+                        "X_MAP": GEOTRANSFORM[0] + (col + 0.5) * PIXEL_SIZE,
+                        "Y_MAP": GEOTRANSFORM[3] - (row + 0.5) * PIXEL_SIZE,
+                        "X_SHIFT_M": x_shift * PIXEL_SIZE,
+                        "Y_SHIFT_M": -y_shift * PIXEL_SIZE,
+                        "ABS_SHIFT": math.hypot(x_shift, y_shift) * PIXEL_SIZE,
+                    }
+                )
+        self.table = pd.DataFrame(points)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def get_errors(self, output_file):
+        """Return the largest column and row error, in pixels, of the output at the corrected tie points."""
+        ds = gdal.Open(output_file, gdal.GA_ReadOnly)
+        gt = ds.GetGeoTransform()
+        cols, rows = ds.GetRasterBand(1).ReadAsArray(), ds.GetRasterBand(2).ReadAsArray()
+        ds = None
+        errors = []
+        for point in self.table.itertuples(index=False):
+            out_col = int((point.X_MAP + point.X_SHIFT_M - gt[0]) / gt[1])
+            out_row = int((point.Y_MAP + point.Y_SHIFT_M - gt[3]) / gt[5])
+            errors.append(abs(cols[out_row, out_col] - (point.X_IM - 0.5)))
+            errors.append(abs(rows[out_row, out_col] - (point.Y_IM - 0.5)))
+        return max(errors)
+
+    def test_spatially_varying_correction(self):
+        output_file = os.path.join(self.tmp_dir, "corrected.tif")
+        tiepoints.warp_with_tiepoints(
+            self.img_tgt, self.img_tgt, output_file, self.table, self.tmp_dir, "GTiff", False, False, "nearest"
+        )
+        self.assertLessEqual(self.get_errors(output_file), 1)
+
+        # the same tie points warped with a polynomial miss the local shifts
+        polynomial_file = os.path.join(self.tmp_dir, "polynomial.tif")
+        gdal.Warp(
+            polynomial_file,
+            os.path.join(self.tmp_dir, "target_gcps.vrt"),
+            format="GTiff",
+            xRes=PIXEL_SIZE,
+            yRes=PIXEL_SIZE,
+            polynomialOrder=3,
+            resampleAlg="near",
+        )
+        self.assertGreater(self.get_errors(polynomial_file), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,580 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import math
+import os
+import statistics
+import time
+
+from osgeo import gdal, osr
+
+from Coregistration.utils.raster_utils import (
+    OUTPUT_MODE_GEOTRANSFORM_COPY,
+    create_shifted_vrt,
+    get_aligned_bounds,
+    is_grid_aligned,
+    pan_raster,
+    shift_geotransform,
+)
+
+# AROSICS resampling names that differ from the GDAL ones
+GDAL_RESAMPLING_NAMES = {"nearest": "near", "cubic_spline": "cubicspline"}
+
+# Resampling methods of gdal.Warp that the RasterIO/VRT resampling of gdal.Translate does not have
+WARP_ONLY_RESAMPLING = ("max", "min", "med", "q1", "q3", "sum")
+
+# Maximum shift (pixels) searched on each level of the coarse-to-fine matching
+PYRAMID_MAX_SHIFT = 5
+
+# Shift attributes of an AROSICS COREG instance reported after matching,
+# as (key, attribute name).
+SHIFT_ATTRIBUTES = (
+    ("x_shift_px", "x_shift_px"),
+    ("y_shift_px", "y_shift_px"),
+    ("x_shift_map", "x_shift_map"),
+    ("y_shift_map", "y_shift_map"),
+    ("reliability", "shift_reliability"),
+    ("ssim_before", "ssim_orig"),
+    ("ssim_after", "ssim_deshifted"),
+)
+
+# Reference image data shared by the batch workers, set once per process by
+# init_reference_worker().
+_worker_reference = {}
+
+
+def get_shift_summary(coreg):
+    """Return the detected shift of an AROSICS COREG instance as a plain dict."""
+    summary = {"success": bool(getattr(coreg, "success", False))}
+    for key, attribute in SHIFT_ATTRIBUTES:
+        value = getattr(coreg, attribute, None)
+        summary[key] = None if value is None else float(value)
+    return summary
+
+
+def get_raster_extent(img_path, dst_srs=None):
+    """Return ``(min_x, min_y, max_x, max_y)`` of a raster, optionally transformed into *dst_srs*."""
+    ds = gdal.Open(img_path, gdal.GA_ReadOnly)
+    gt = ds.GetGeoTransform()
+    corners = [
+        (gt[0] + col * gt[1] + row * gt[2], gt[3] + col * gt[4] + row * gt[5])
+        for col, row in ((0, 0), (ds.RasterXSize, 0), (0, ds.RasterYSize), (ds.RasterXSize, ds.RasterYSize))
+    ]
+    src_wkt = ds.GetProjection()
+    ds = None
+
+    if dst_srs is not None and src_wkt:
+        src_srs = osr.SpatialReference(wkt=src_wkt)
+        src_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        if not src_srs.IsSame(dst_srs):
+            transform = osr.CoordinateTransformation(src_srs, dst_srs)
+            corners = [transform.TransformPoint(x, y)[:2] for x, y in corners]
+
+    xs, ys = zip(*corners, strict=True)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def load_reference_window(img_ref, img_tgts, margin=0, band=1):
+    """Read the part of the reference band that overlaps any of the target images.
+
+    The window is the union of the target extents (in the reference CRS),
+    enlarged by *margin* reference pixels and clipped to the reference image.
+
+    :return: dict with the ``arr``, ``gt``, ``prj`` and ``nodata`` of the window.
+    """
+    ds = gdal.Open(img_ref, gdal.GA_ReadOnly)
+    gt = ds.GetGeoTransform()
+    prj = ds.GetProjection()
+    ref_srs = osr.SpatialReference(wkt=prj)
+    ref_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    extents = [get_raster_extent(img_tgt, ref_srs) for img_tgt in img_tgts]
+    min_x = min(e[0] for e in extents)
+    min_y = min(e[1] for e in extents)
+    max_x = max(e[2] for e in extents)
+    max_y = max(e[3] for e in extents)
+
+    cols = sorted(((min_x - gt[0]) / gt[1], (max_x - gt[0]) / gt[1]))
+    rows = sorted(((max_y - gt[3]) / gt[5], (min_y - gt[3]) / gt[5]))
+    col_off = max(0, math.floor(cols[0]) - margin)
+    row_off = max(0, math.floor(rows[0]) - margin)
+    col_end = min(ds.RasterXSize, math.ceil(cols[1]) + margin)
+    row_end = min(ds.RasterYSize, math.ceil(rows[1]) + margin)
+    if col_end <= col_off or row_end <= row_off:
+        raise ValueError("None of the target images overlaps the reference image")
+
+    raster_band = ds.GetRasterBand(band)
+    arr = raster_band.ReadAsArray(col_off, row_off, col_end - col_off, row_end - row_off)
+    window_gt = (
+        gt[0] + col_off * gt[1] + row_off * gt[2],
+        gt[1],
+        gt[2],
+        gt[3] + col_off * gt[4] + row_off * gt[5],
+        gt[4],
+        gt[5],
+    )
+    nodata = raster_band.GetNoDataValue()
+    ds = None
+
+    return {"arr": arr, "gt": window_gt, "prj": prj, "nodata": nodata}
+
+
+def shift_requires_resampling(img_ref, img_tgt, shifted_gt, align_grids, match_gsd):
+    """Return ``True`` if correcting *img_tgt* needs resampling, not only a geotransform update.
+
+    A pure translation can be applied by replacing the geotransform, unless the
+    target has to be reprojected, its pixel size has to match the reference
+    (*match_gsd*), or its shifted grid has to be aligned to the reference grid
+    (*align_grids*) and it is not already.
+    """
+    ref_ds = gdal.Open(img_ref, gdal.GA_ReadOnly)
+    tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+    ref_gt, ref_prj = ref_ds.GetGeoTransform(), ref_ds.GetProjection()
+    tgt_prj = tgt_ds.GetProjection()
+    ref_ds = tgt_ds = None
+
+    if ref_prj and tgt_prj:
+        ref_srs, tgt_srs = osr.SpatialReference(wkt=ref_prj), osr.SpatialReference(wkt=tgt_prj)
+        if not ref_srs.IsSame(tgt_srs):
+            return True
+    if shifted_gt[2] or shifted_gt[4]:
+        return True
+    same_gsd = math.isclose(abs(shifted_gt[1]), abs(ref_gt[1]), rel_tol=1e-6) and math.isclose(
+        abs(shifted_gt[5]), abs(ref_gt[5]), rel_tol=1e-6
+    )
+    if match_gsd and not same_gsd:
+        return True
+    return align_grids and not is_grid_aligned(shifted_gt, ref_gt)
+
+
+def write_shifted_vrt(img_ref, img_tgt, output_file, shifted_gt, align_grids, match_gsd, resampling_method):
+    """Write the shift correction of *img_tgt* as a virtual raster (VRT), without writing pixel data.
+
+    If the correction is a pure translation, *output_file* is a VRT carrying the
+    shifted geotransform. Otherwise that VRT is saved next to the output as
+    ``<output name>_shifted.vrt`` and *output_file* is a warped VRT that
+    resamples it lazily onto the reference grid.
+    """
+    if not shift_requires_resampling(img_ref, img_tgt, shifted_gt, align_grids, match_gsd):
+        create_shifted_vrt(img_tgt, output_file, shifted_gt)
+        return
+
+    shifted_vrt = os.path.splitext(output_file)[0] + "_shifted.vrt"
+    create_shifted_vrt(img_tgt, shifted_vrt, shifted_gt)
+
+    ref_ds = gdal.Open(img_ref, gdal.GA_ReadOnly)
+    ref_gt, ref_prj = ref_ds.GetGeoTransform(), ref_ds.GetProjection()
+    ref_ds = None
+    tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+    x_size, y_size = tgt_ds.RasterXSize, tgt_ds.RasterYSize
+    tgt_ds = None
+
+    x_res, y_res = (abs(ref_gt[1]), abs(ref_gt[5])) if match_gsd else (abs(shifted_gt[1]), abs(shifted_gt[5]))
+    output_bounds = None
+    if align_grids:
+        output_bounds = get_aligned_bounds(shifted_gt, x_size, y_size, ref_gt, x_res, y_res)
+
+    gdal.Warp(
+        output_file,
+        shifted_vrt,
+        format="VRT",
+        dstSRS=ref_prj,
+        xRes=x_res,
+        yRes=y_res,
+        outputBounds=output_bounds,
+        resampleAlg=GDAL_RESAMPLING_NAMES.get(resampling_method, resampling_method),
+    )
+
+
+def get_pyramid_factor(max_shift, level_max_shift=PYRAMID_MAX_SHIFT):
+    """Return the decimation factor (a power of two) that brings *max_shift* within *level_max_shift* pixels."""
+    if max_shift <= level_max_shift:
+        return 1
+    return 2 ** math.ceil(math.log2(max_shift / level_max_shift))
+
+
+def create_decimated_vrt(src_file, dst_file, factor, resampling_method="average"):
+    """Write a VRT of *src_file* with its pixel size multiplied by *factor*.
+
+    The VRT covers the same extent as the source. When the source has GDAL
+    overviews, GDAL reads the closest one instead of the full resolution data.
+    The statistical methods (e.g. ``max``, to keep a coarse pixel bad if any
+    of its pixels is bad) only exist in the warper, they give a warped VRT.
+    """
+    src_ds = gdal.Open(src_file, gdal.GA_ReadOnly)
+    width = max(1, round(src_ds.RasterXSize / factor))
+    height = max(1, round(src_ds.RasterYSize / factor))
+    src_ds = None
+    if resampling_method in WARP_ONLY_RESAMPLING:
+        gdal.Warp(dst_file, src_file, format="VRT", width=width, height=height, resampleAlg=resampling_method)
+    else:
+        gdal.Translate(dst_file, src_file, format="VRT", width=width, height=height, resampleAlg=resampling_method)
+
+
+def estimate_coarse_shift(img_ref, img_tgt, max_shift, factor, tmp_dir, mask_ref=None, mask_tgt=None, **options):
+    """Estimate the global shift of *img_tgt* on copies of both images decimated by *factor*.
+
+    The bad data masks are decimated as well, marking a coarse pixel as bad if
+    any of its pixels is bad. *options* are passed to AROSICS COREG.
+
+    :return: the shift ``(x_shift_map, y_shift_map)`` in map units.
+    """
+    from arosics import COREG
+
+    coarse = {}
+    for name, src_file, resampling_method in (
+        ("ref", img_ref, "average"),
+        ("tgt", img_tgt, "average"),
+        ("mask_ref", mask_ref, "max"),
+        ("mask_tgt", mask_tgt, "max"),
+    ):
+        if src_file is None:
+            coarse[name] = None
+            continue
+        coarse[name] = os.path.join(tmp_dir, f"coarse_{name}.vrt")
+        create_decimated_vrt(src_file, coarse[name], factor, resampling_method)
+
+    CR = COREG(
+        coarse["ref"],
+        coarse["tgt"],
+        max_shift=math.ceil(max_shift / factor) + 1,
+        mask_baddata_ref=coarse["mask_ref"],
+        mask_baddata_tgt=coarse["mask_tgt"],
+        **options,
+    )
+    CR.calculate_spatial_shifts()
+    if not CR.success:
+        raise RuntimeError("The shift could not be estimated on the decimated images")
+    return float(CR.x_shift_map), float(CR.y_shift_map)
+
+
+def coarse_shift_task(
+    img_ref, img_tgt, max_shift, factor, tmp_dir, mask_ref=None, mask_tgt=None, options=None, report_stage=None
+):
+    """Run :func:`estimate_coarse_shift` in a child process (see :func:`run_in_subprocess`).
+
+    The whole task is a single stage, *report_stage* is not used.
+    """
+    return estimate_coarse_shift(
+        img_ref, img_tgt, max_shift, factor, tmp_dir, mask_ref=mask_ref, mask_tgt=mask_tgt, **(options or {})
+    )
+
+
+def get_fine_max_shift(max_shift, factor):
+    """Return the maximum shift left for the full resolution matching after a coarse estimate.
+
+    The coarse estimate is accurate to about one decimated pixel, i.e.
+    *factor* full resolution pixels.
+    """
+    return min(max_shift, max(PYRAMID_MAX_SHIFT, factor + 1))
+
+
+def create_preshifted_vrts(img_tgt, mask_tgt, x_shift_map, y_shift_map, tmp_dir):
+    """Write VRTs of the target image (and its mask) shifted by the coarse estimate.
+
+    :return: ``(img_tgt, mask_tgt)`` paths of the shifted VRTs, ``mask_tgt`` is
+        ``None`` if there is no mask.
+    """
+    shifted = []
+    for name, src_file in (("tgt", img_tgt), ("mask_tgt", mask_tgt)):
+        if src_file is None:
+            shifted.append(None)
+            continue
+        src_ds = gdal.Open(src_file, gdal.GA_ReadOnly)
+        shifted_gt = shift_geotransform(src_ds.GetGeoTransform(), x_shift_map, y_shift_map)
+        src_ds = None
+        dst_file = os.path.join(tmp_dir, f"preshifted_{name}.vrt")
+        create_shifted_vrt(src_file, dst_file, shifted_gt)
+        shifted.append(dst_file)
+    return tuple(shifted)
+
+
+def write_resampled_raster(
+    img_ref,
+    img_tgt,
+    output_file,
+    shifted_gt,
+    align_grids,
+    match_gsd,
+    resampling_method,
+    output_driver_name,
+    tmp_dir,
+    creation_options=None,
+):
+    """Write the shift correction of *img_tgt* into *output_file*, resampling the pixel data if required.
+
+    The correction is first built as a VRT (see :func:`write_shifted_vrt`) in
+    *tmp_dir* and then written in the output format in a single pass (for a
+    COG, the overviews are built along with it).
+    """
+    vrt_file = os.path.join(tmp_dir, os.path.splitext(os.path.basename(output_file))[0] + ".vrt")
+    write_shifted_vrt(img_ref, img_tgt, vrt_file, shifted_gt, align_grids, match_gsd, resampling_method)
+    gdal.Translate(output_file, vrt_file, format=output_driver_name, creationOptions=creation_options)
+
+
+def write_geoarray(geo_arr, output_file, driver_name, creation_options=None):
+    """Write an in-memory AROSICS result (GeoArray) with the GDAL *driver_name*.
+
+    The array is wrapped into a GDAL in-memory dataset and copied, which also
+    works for drivers that only create copies, such as COG.
+    """
+    from osgeo import gdal_array
+
+    arr = geo_arr.arr if geo_arr.arr.ndim == 3 else geo_arr.arr[:, :, None]
+    rows, cols, bands = arr.shape
+    mem_ds = gdal.GetDriverByName("MEM").Create(
+        "", cols, rows, bands, gdal_array.NumericTypeCodeToGDALTypeCode(arr.dtype)
+    )
+    mem_ds.SetGeoTransform(tuple(geo_arr.gt))
+    mem_ds.SetProjection(geo_arr.prj)
+    for band_idx in range(bands):
+        band = mem_ds.GetRasterBand(band_idx + 1)
+        band.WriteArray(arr[:, :, band_idx])
+        if geo_arr.nodata is not None:
+            band.SetNoDataValue(float(geo_arr.nodata))
+    gdal.Translate(output_file, mem_ds, format=driver_name, creationOptions=creation_options)
+    mem_ds = None
+
+
+def get_window_centers(img_ref, img_tgt, num_windows, window_size):
+    """Return *num_windows* matching window centers spread over the overlap of both images.
+
+    The centers are placed on a regular grid over the overlap, shrunk by half
+    a window so that every window fits into it.
+
+    :param window_size: matching window size in reference pixel units.
+    :return: list of ``(x, y)`` map coordinates in the reference projection.
+    """
+    ref_ds = gdal.Open(img_ref, gdal.GA_ReadOnly)
+    ref_gt = ref_ds.GetGeoTransform()
+    ref_srs = osr.SpatialReference(wkt=ref_ds.GetProjection())
+    ref_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    ref_ds = None
+
+    ref_extent = get_raster_extent(img_ref)
+    tgt_extent = get_raster_extent(img_tgt, ref_srs)
+    min_x, min_y = max(ref_extent[0], tgt_extent[0]), max(ref_extent[1], tgt_extent[1])
+    max_x, max_y = min(ref_extent[2], tgt_extent[2]), min(ref_extent[3], tgt_extent[3])
+    if max_x <= min_x or max_y <= min_y:
+        raise ValueError("The reference and target images do not overlap")
+
+    half_x, half_y = window_size / 2 * abs(ref_gt[1]), window_size / 2 * abs(ref_gt[5])
+    if max_x - min_x > 2 * half_x:
+        min_x, max_x = min_x + half_x, max_x - half_x
+    if max_y - min_y > 2 * half_y:
+        min_y, max_y = min_y + half_y, max_y - half_y
+
+    width, height = max_x - min_x, max_y - min_y
+    cols = max(1, round(math.sqrt(num_windows * width / height))) if height else num_windows
+    rows = math.ceil(num_windows / cols)
+    centers = [
+        (min_x + (col + 0.5) * width / cols, max_y - (row + 0.5) * height / rows)
+        for row in range(rows)
+        for col in range(cols)
+    ]
+    # keep num_windows centers evenly distributed over the grid
+    return [centers[i * len(centers) // num_windows] for i in range(num_windows)]
+
+
+def match_window_worker(task):
+    """Detect the global shift with AROSICS COREG in one matching window.
+
+    *task* is a dict with the image paths, the window center ``wp`` and the
+    ``options`` passed to COREG. Errors are returned, not raised.
+    """
+    result = {"wp": task["wp"], "error": None}
+    try:
+        from arosics import COREG
+
+        CR = COREG(task["img_ref"], task["img_tgt"], wp=task["wp"], q=True, CPUs=1, **task["options"])
+        CR.calculate_spatial_shifts()
+        result.update(get_shift_summary(CR))
+    except Exception as err:
+        result["success"] = False
+        result["error"] = str(err) or err.__class__.__name__
+    return result
+
+
+def match_pair_worker(task):
+    """Detect the global shift of one target image against a reference image with AROSICS COREG.
+
+    *task* is a dict with the ``index`` and ``ref_index`` identifying the pair,
+    the ``img_ref`` and ``img_tgt`` paths and the ``options`` passed to COREG.
+    Errors are returned, not raised.
+    """
+    result = {"index": task["index"], "ref_index": task["ref_index"], "error": None}
+    try:
+        from arosics import COREG
+
+        CR = COREG(task["img_ref"], task["img_tgt"], q=True, CPUs=1, **task["options"])
+        CR.calculate_spatial_shifts()
+        result.update(get_shift_summary(CR))
+    except Exception as err:
+        result["success"] = False
+        result["error"] = str(err) or err.__class__.__name__
+    return result
+
+
+def coregister_global_task(img_ref, img_tgt, options, output_file=None, report_stage=None):
+    """Detect the global shift with AROSICS COREG and, with an *output_file*, correct it.
+
+    Runs in a child process (see :func:`run_in_subprocess`); *options* are
+    passed to COREG and the stages are sent to *report_stage*.
+
+    :return: the detected shift, as in :func:`get_shift_summary`.
+    """
+    from arosics import COREG
+
+    report_stage("open inputs (AROSICS)")
+    CR = COREG(img_ref, img_tgt, path_out=output_file, **options)
+    report_stage("window read and FFT matching")
+    CR.calculate_spatial_shifts()
+    if output_file is not None:
+        report_stage("warp and write")
+        CR.correct_shifts()
+    return get_shift_summary(CR)
+
+
+def combine_shifts(shifts, min_tolerance=0.0, max_deviations=3.0):
+    """Combine the shifts of several matching windows with a robust estimator.
+
+    Shifts farther than *max_deviations* times the normalized median absolute
+    deviation (MAD) from the median shift, and never closer than
+    *min_tolerance*, are rejected as outliers; the result is the median of the
+    remaining shifts.
+
+    :param shifts: list of ``(x_shift, y_shift)``.
+    :return: ``(x_shift, y_shift, inliers)``, *inliers* is a list of booleans.
+    """
+    median_x = statistics.median(x for x, _ in shifts)
+    median_y = statistics.median(y for _, y in shifts)
+    distances = [math.hypot(x - median_x, y - median_y) for x, y in shifts]
+    # 1.4826 makes the MAD consistent with the standard deviation of a normal distribution
+    tolerance = max(min_tolerance, max_deviations * 1.4826 * statistics.median(distances))
+    inliers = [distance <= tolerance for distance in distances]
+    x_shift = statistics.median(x for (x, _), inlier in zip(shifts, inliers, strict=True) if inlier)
+    y_shift = statistics.median(y for (_, y), inlier in zip(shifts, inliers, strict=True) if inlier)
+    return x_shift, y_shift, inliers
+
+
+def init_reference_worker(reference):
+    """Process pool initializer: keep the reference window once per worker process."""
+    _worker_reference.clear()
+    _worker_reference.update(reference)
+
+
+def coregister_global_worker(task):
+    """Match and correct one target image against the shared reference window.
+
+    *task* is a dict with the ``img_tgt`` and ``output_file`` paths and the
+    ``options`` passed to AROSICS COREG. Errors are returned, not raised, so a
+    failing target does not stop the whole batch.
+    """
+    result = {"img_tgt": task["img_tgt"], "output_file": task["output_file"], "error": None}
+    try:
+        from arosics import COREG
+        from geoarray import GeoArray
+
+        im_ref = GeoArray(
+            _worker_reference["arr"],
+            geotransform=_worker_reference["gt"],
+            projection=_worker_reference["prj"],
+            nodata=_worker_reference["nodata"],
+        )
+        CR = COREG(
+            im_ref,
+            task["img_tgt"],
+            path_out=task["output_file"],
+            footprint_poly_ref=_worker_reference.get("footprint_poly"),
+            q=True,
+            CPUs=1,
+            **task["options"],
+        )
+        CR.correct_shifts()
+        result.update(get_shift_summary(CR))
+    except Exception as err:
+        result["success"] = False
+        result["error"] = str(err) or err.__class__.__name__
+    return result
+
+
+def apply_shift_worker(task):
+    """Apply a shift already detected in map units to one raster, such as a band or a mask of the matched image.
+
+    *task* is a dict with the ``file_in`` and ``output_file`` paths (``None``
+    to update *file_in* in place), the ``x_shift_map`` and ``y_shift_map``
+    shift, the optional ``img_ref`` with ``align_grids`` and ``match_gsd``, the
+    ``resampling_method`` and a ``tmp_dir``. The shift is a geotransform update
+    unless the file has to be resampled onto the reference, then it is written
+    in the format of the input (a VRT input gives a warped VRT). Errors are
+    returned, not raised.
+    """
+    result = {"file_in": task["file_in"], "output_file": task["output_file"] or task["file_in"], "error": None}
+    start = time.perf_counter()
+    try:
+        ds = gdal.Open(task["file_in"], gdal.GA_ReadOnly)
+        gt = ds.GetGeoTransform()
+        input_driver_name = ds.GetDriver().ShortName
+        ds = None
+        shifted_gt = shift_geotransform(gt, task["x_shift_map"], task["y_shift_map"])
+        img_ref = task.get("img_ref")
+
+        if img_ref is None or not shift_requires_resampling(
+            img_ref, task["file_in"], shifted_gt, task["align_grids"], task["match_gsd"]
+        ):
+            result["method"] = "geotransform update"
+            # pan_raster shifts by pixels with the sign of the map shift
+            pan_raster(
+                task["file_in"],
+                task["output_file"],
+                task["x_shift_map"] / abs(gt[1]),
+                task["y_shift_map"] / abs(gt[5]),
+                output_mode=OUTPUT_MODE_GEOTRANSFORM_COPY,
+            )
+        elif task["output_file"] is None:
+            raise ValueError("the shift requires resampling, it cannot be applied in place")
+        elif input_driver_name == "VRT":
+            result["method"] = "resampled (virtual raster)"
+            write_shifted_vrt(
+                img_ref,
+                task["file_in"],
+                task["output_file"],
+                shifted_gt,
+                task["align_grids"],
+                task["match_gsd"],
+                task["resampling_method"],
+            )
+        else:
+            result["method"] = "resampled"
+            write_resampled_raster(
+                img_ref,
+                task["file_in"],
+                task["output_file"],
+                shifted_gt,
+                task["align_grids"],
+                task["match_gsd"],
+                task["resampling_method"],
+                input_driver_name,
+                task["tmp_dir"],
+            )
+    except Exception as err:
+        result["error"] = str(err) or err.__class__.__name__
+    result["seconds"] = time.perf_counter() - start
+    return result
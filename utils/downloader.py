@@ -0,0 +1,633 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Resumable, segmented HTTP download of the extlibs ZIP, extracted into a
+staging folder while it is downloaded and installed once verified, replacing
+only the files that changed since the previous installation. Plain Python
+(no QGIS/Qt), so it can be run against a local HTTP server that supports range
+requests.
+"""
+
+import hashlib
+import http.client
+import io
+import json
+import os
+import re
+import shutil
+import ssl
+import threading
+import time
+import urllib.error
+import urllib.request
+import zipfile
+import zlib
+
+CHUNK_SIZE = 8 * 1024 * 1024
+CONNECTIONS = 4
+TIMEOUT = 60
+RETRIES = 3
+USER_AGENT = "Coregistration-Plugin"
+# ``{member name: [crc32, size]}`` of the installed files, in the installation folder
+MANIFEST_NAME = ".extlibs_manifest.json"
+
+_CONTENT_RANGE = re.compile(r"bytes\s+\d+-\d+/(\d+)")
+_SHA256 = re.compile(r"\b([0-9a-fA-F]{64})\b")
+
+
+class DownloadCanceled(Exception):
+    """The download was canceled by the user."""
+
+
+def _open(url, start=None, end=None, timeout=TIMEOUT):
+    headers = {"User-Agent": USER_AGENT}
+    if start is not None:
+        headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+    request = urllib.request.Request(url, headers=headers)
+    context = ssl.create_default_context() if url.lower().startswith("https") else None
+    return urllib.request.urlopen(request, timeout=timeout, context=context)  # nosec B310
+
+
+def fetch_sha256(url, timeout=TIMEOUT):
+    """Return the SHA-256 published next to *url* (``<url>.sha256``), ``None`` if there is none.
+
+    The checksum file has the ``sha256sum`` format: ``<hex digest>  <file name>``.
+    """
+    try:
+        with _open(url + ".sha256", timeout=timeout) as response:
+            match = _SHA256.search(response.read(4096).decode("ascii", "replace"))
+    except urllib.error.HTTPError as err:
+        if err.code == 404:
+            return None
+        raise
+    return match.group(1).lower() if match else None
+
+
+def file_sha256(file_path, block_size=1024 * 1024):
+    """Return the SHA-256 hex digest of *file_path*."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SegmentedDownload:
+    """Download *url* into *file_path* in chunks of *chunk_size* bytes over *connections* parallel requests.
+
+    The completed chunks are recorded in ``<file_path>.parts``, so a broken or
+    canceled download resumes where it stopped, as long as the remote file is
+    the same (size, ETag and Last-Modified). A chunk that fails is retried
+    *retries* times from its last received byte. The chunks are fetched in
+    order, except the ones a reader waits for (see :meth:`wait_available`),
+    which go first. Servers without range requests get a single sequential
+    stream, which cannot be resumed.
+    """
+
+    def __init__(
+        self, url, file_path, connections=CONNECTIONS, chunk_size=CHUNK_SIZE, timeout=TIMEOUT, retries=RETRIES
+    ):
+        self.url = url
+        self.file_path = file_path
+        self.state_path = file_path + ".parts"
+        self.connections = max(1, connections)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retries = retries
+
+        self.size = None
+        self.ranges = False
+        self.error = None
+        self._validator = None
+        self._done = set()
+        self._pending = []
+        self._wanted = []
+        self._received = 0
+        self._threads = []
+        self._canceled = False
+        self._condition = threading.Condition()
+
+    # -- probing and state ----------------------------------------------------
+
+    def _probe(self):
+        """Read the size, range support and validator of the remote file."""
+        with _open(self.url, 0, 0, timeout=self.timeout) as response:
+            validator = [response.getheader("ETag"), response.getheader("Last-Modified")]
+            content_range = _CONTENT_RANGE.match(response.getheader("Content-Range") or "")
+            if response.status == 206 and content_range:
+                self.size, self.ranges = int(content_range.group(1)), True
+            else:
+                length = response.getheader("Content-Length")
+                self.size, self.ranges = (int(length) if length else None), False
+        self._validator = validator
+
+    def _load_state(self):
+        """Return the chunks completed by a previous download of the same remote file."""
+        try:
+            with open(self.state_path, encoding="utf-8") as fh:
+                state = json.load(fh)
+        except (OSError, ValueError):
+            return set()
+        same = (
+            state.get("url") == self.url
+            and state.get("size") == self.size
+            and state.get("chunk_size") == self.chunk_size
+            and state.get("validator") == self._validator
+            and os.path.isfile(self.file_path)
+            and os.path.getsize(self.file_path) == self.size
+        )
+        return set(state.get("done", [])) if same else set()
+
+    def _save_state(self):
+        state = {
+            "url": self.url,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "validator": self._validator,
+            "done": sorted(self._done),
+        }
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fh:
+            json.dump(state, fh)
+        os.replace(tmp_path, self.state_path)
+
+    def remove_state(self):
+        """Remove the resume state, e.g. once the file is complete and verified."""
+        for file_path in (self.state_path, self.state_path + ".tmp"):
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+
+    # -- download ---------------------------------------------------------------
+
+    @property
+    def num_chunks(self):
+        return -(-self.size // self.chunk_size) if self.size else 0
+
+    @property
+    def received(self):
+        """Bytes of the file available on disk, including the resumed chunks."""
+        return self._received
+
+    def start(self):
+        """Probe the remote file and start the download threads."""
+        self._probe()
+        if self.ranges and self.size:
+            self._done = self._load_state()
+            if not self._done:
+                with open(self.file_path, "wb") as fh:
+                    fh.truncate(self.size)
+            self._pending = [index for index in range(self.num_chunks) if index not in self._done]
+            self._received = sum(self._chunk_range(index)[1] - self._chunk_range(index)[0] for index in self._done)
+            self._save_state()
+            targets = [self._chunk_worker] * min(self.connections, max(1, len(self._pending)))
+        else:
+            self.remove_state()
+            targets = [self._stream_worker]
+        self._threads = [threading.Thread(target=target, daemon=True) for target in targets]
+        for thread in self._threads:
+            thread.start()
+
+    def _chunk_range(self, index):
+        start = index * self.chunk_size
+        return start, min(start + self.chunk_size, self.size)
+
+    def _next_chunk(self):
+        with self._condition:
+            for index in self._wanted:
+                if index in self._pending:
+                    self._pending.remove(index)
+                    return index
+            return self._pending.pop(0) if self._pending else None
+
+    def _chunk_worker(self):
+        while not self._canceled and self.error is None:
+            index = self._next_chunk()
+            if index is None:
+                return
+            try:
+                self._download_chunk(index)
+            except DownloadCanceled:
+                return
+            except Exception as err:
+                with self._condition:
+                    self.error = err
+                    self._condition.notify_all()
+                return
+            with self._condition:
+                self._done.add(index)
+                self._save_state()
+                self._condition.notify_all()
+
+    def _download_chunk(self, index):
+        start, end = self._chunk_range(index)
+        offset = start
+        attempt = 0
+        with open(self.file_path, "r+b") as fh:
+            while offset < end:
+                try:
+                    with _open(self.url, offset, end - 1, timeout=self.timeout) as response:
+                        if response.status != 206:
+                            raise OSError(f"The server ignored the range request (HTTP {response.status})")
+                        fh.seek(offset)
+                        while offset < end:
+                            if self._canceled:
+                                raise DownloadCanceled()
+                            data = response.read(min(64 * 1024, end - offset))
+                            if not data:
+                                raise OSError("Connection closed before the end of the chunk")
+                            fh.write(data)
+                            offset += len(data)
+                            with self._condition:
+                                self._received += len(data)
+                except (OSError, http.client.HTTPException):
+                    # resume the chunk from its last received byte
+                    attempt += 1
+                    if attempt > self.retries:
+                        raise
+                    time.sleep(min(2**attempt, 10))
+
+    def _stream_worker(self):
+        try:
+            with _open(self.url, timeout=self.timeout) as response, open(self.file_path, "wb") as fh:
+                while not self._canceled:
+                    data = response.read(64 * 1024)
+                    if not data:
+                        break
+                    fh.write(data)
+                    # the bytes counted as received must be readable from the file
+                    fh.flush()
+                    with self._condition:
+                        self._received += len(data)
+                        self._condition.notify_all()
+            if self.size is None:
+                self.size = self._received
+            elif self._received != self.size:
+                raise OSError(f"Incomplete download: {self._received} of {self.size} bytes")
+        except Exception as err:
+            self.error = err
+        with self._condition:
+            self._condition.notify_all()
+
+    def is_finished(self):
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def cancel(self):
+        """Stop the download, the completed chunks are kept for a later resume."""
+        with self._condition:
+            self._canceled = True
+            self._condition.notify_all()
+
+    @property
+    def canceled(self):
+        return self._canceled
+
+    def join(self):
+        """Wait for the download threads, raising the download error if any."""
+        for thread in self._threads:
+            thread.join()
+        if self.error is not None:
+            raise self.error
+        if self._canceled:
+            raise DownloadCanceled()
+
+    # -- reading while downloading --------------------------------------------
+
+    def _is_available(self, start, end):
+        if not self.ranges:
+            return self._received >= end or (self.is_finished() and self.error is None)
+        first, last = start // self.chunk_size, (max(end, start + 1) - 1) // self.chunk_size
+        return all(index in self._done for index in range(first, last + 1))
+
+    def wait_available(self, start, end):
+        """Block until the bytes ``[start, end)`` of the file are downloaded.
+
+        :raises DownloadCanceled: if the download is canceled or failed meanwhile.
+        """
+        end = min(end, self.size) if self.size is not None else end
+        with self._condition:
+            if self.ranges:
+                # fetch the wanted chunks next
+                first, last = start // self.chunk_size, (max(end, start + 1) - 1) // self.chunk_size
+                self._wanted = list(range(first, last + 1))
+            while not self._is_available(start, end):
+                if self._canceled or self.error is not None:
+                    raise DownloadCanceled()
+                self._condition.wait(0.5)
+            self._wanted = []
+
+
+class _DownloadReader(io.RawIOBase):
+    """Seekable read-only file object over a file being downloaded, reads wait for the missing bytes."""
+
+    def __init__(self, download):
+        super().__init__()
+        self._download = download
+        self._fh = open(download.file_path, "rb")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = self._download.size + offset
+        return self._position
+
+    def readinto(self, buffer):
+        end = min(self._position + len(buffer), self._download.size)
+        if end <= self._position:
+            return 0
+        self._download.wait_available(self._position, end)
+        self._fh.seek(self._position)
+        size = self._fh.readinto(memoryview(buffer)[: end - self._position])
+        self._position += size
+        return size
+
+    def close(self):
+        self._fh.close()
+        super().close()
+
+
+def _file_crc32(file_path, block_size=1024 * 1024):
+    crc = 0
+    with open(file_path, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b""):
+            crc = zlib.crc32(block, crc)
+    return crc
+
+
+def _is_unchanged(member, file_path, manifest):
+    """Return ``True`` if *file_path* already has the content of the ZIP *member*."""
+    if not os.path.isfile(file_path) or os.path.getsize(file_path) != member.file_size:
+        return False
+    if manifest is not None and member.filename in manifest:
+        return manifest[member.filename] == [member.CRC, member.file_size]
+    # installed without a manifest: compare the content
+    return _file_crc32(file_path) == member.CRC
+
+
+def extract_zip(zip_file, output_path, manifest=None, installed_path=None):
+    """Extract *zip_file* (a path or a file object) to *output_path*, skipping the unchanged files.
+
+    All member paths are validated against *output_path* before any file is
+    written (zip-slip attack prevention). The members are extracted in the
+    order they are stored, and their CRC is checked by :mod:`zipfile`. A file
+    already in *installed_path* (default *output_path*) is not extracted if
+    its ``[crc32, size]`` in the *manifest* of the previous installation (or
+    its content, when not in the manifest) matches the member.
+
+    :return: a dict with the ``extracted`` and ``unchanged`` member names,
+        and the ``manifest`` of the files of the archive.
+    """
+    real_output = os.path.realpath(output_path)
+    real_installed = os.path.realpath(installed_path or output_path)
+    result = {"extracted": [], "unchanged": [], "manifest": {}}
+    with zipfile.ZipFile(zip_file, "r") as zf:
+        members = sorted(zf.infolist(), key=lambda member: member.header_offset)
+        for member in members:
+            member_dest = os.path.realpath(os.path.join(real_output, member.filename))
+            if not (member_dest == real_output or member_dest.startswith(real_output + os.sep)):
+                raise ValueError(f"Zip-slip rejected for entry: {member.filename!r}")
+        for member in members:
+            if member.is_dir():
+                continue
+            if _is_unchanged(member, os.path.join(real_installed, member.filename), manifest):
+                result["unchanged"].append(member.filename)
+            else:
+                zf.extract(member, real_output)
+                result["extracted"].append(member.filename)
+            result["manifest"][member.filename] = [member.CRC, member.file_size]
+    return result
+
+
+def install_staged_files(staging_path, output_path, names):
+    """Move the files *names* (relative paths) from *staging_path* into *output_path*, replacing the installed ones.
+
+    Each installed file is first moved aside to ``<output_path>.backup``; if
+    a file cannot be installed, all the files already moved are put back and
+    the error is raised, leaving *output_path* as it was. On Windows, DLLs
+    that are currently loaded by QGIS cannot be replaced; those files are
+    skipped so the rest of the installation still completes.
+
+    :return: the names of the files that could not be replaced (in use).
+    """
+    backup_path = os.path.normpath(output_path) + ".backup"
+    shutil.rmtree(backup_path, ignore_errors=True)
+    skipped = []
+    installed = []
+    try:
+        for name in names:
+            file_path = os.path.join(output_path, name)
+            backup_file = os.path.join(backup_path, name)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            replaced = os.path.lexists(file_path)
+            try:
+                if replaced:
+                    os.makedirs(os.path.dirname(backup_file), exist_ok=True)
+                    os.replace(file_path, backup_file)
+                try:
+                    os.replace(os.path.join(staging_path, name), file_path)
+                except Exception:
+                    if replaced:
+                        os.replace(backup_file, file_path)
+                    raise
+            except PermissionError:
+                skipped.append(name)
+                continue
+            installed.append((name, replaced))
+    except Exception:
+        # roll back to the previous installation
+        for name, replaced in reversed(installed):
+            file_path = os.path.join(output_path, name)
+            os.remove(file_path)
+            if replaced:
+                os.replace(os.path.join(backup_path, name), file_path)
+        remove_files(output_path, [name for name, replaced in installed if not replaced])
+        raise
+    finally:
+        shutil.rmtree(backup_path, ignore_errors=True)
+    return skipped
+
+
+def load_manifest(manifest_path):
+    """Load the ``{member name: [crc32, size]}`` manifest of an installation, ``None`` if there is none."""
+    try:
+        with open(manifest_path, encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=0, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def remove_files(output_path, names):
+    """Remove the files *names* (relative to *output_path*) and the folders left empty.
+
+    :return: the names of the files that could not be removed (in use).
+    """
+    real_output = os.path.realpath(output_path)
+    locked = []
+    folders = set()
+    for name in names:
+        file_path = os.path.join(real_output, name)
+        try:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+        except PermissionError:
+            locked.append(name)
+        folders.add(os.path.dirname(file_path))
+    # the deepest folders first, only the ones left empty
+    for folder in sorted(folders, key=len, reverse=True):
+        while folder.startswith(real_output + os.sep):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            folder = os.path.dirname(folder)
+    return locked
+
+
+def get_stale_files(output_path, manifest, old_manifest=None):
+    """Return the installed files that are not in the new *manifest* (removed from the archive).
+
+    With the *old_manifest* only its files are considered, otherwise all the
+    files in *output_path*, except the Python bytecode caches.
+    """
+    if old_manifest is not None:
+        return sorted(name for name in old_manifest if name not in manifest)
+    real_output = os.path.realpath(output_path)
+    stale = []
+    for root, dirs, files in os.walk(real_output):
+        dirs[:] = [folder for folder in dirs if folder != "__pycache__"]
+        for file_name in files:
+            name = os.path.relpath(os.path.join(root, file_name), real_output).replace(os.sep, "/")
+            if name not in manifest and not name.startswith(MANIFEST_NAME):
+                stale.append(name)
+    return stale
+
+
+def download_and_extract(url, zip_path, output_path, sha256=None, on_progress=None, is_canceled=None, **options):
+    """Download the ZIP at *url* to *zip_path* and extract it while it downloads, then install it in *output_path*.
+
+    The archive is extracted into a staging folder next to *output_path*
+    (``<output_path>.staging``), only the files that changed since the
+    previous installation (see :func:`extract_zip`). Once complete, the
+    archive is checked against *sha256* and only then the staged files are
+    moved into *output_path* (see :func:`install_staged_files`), the files
+    removed from the archive are deleted and the manifest of the installation
+    is saved (:data:`MANIFEST_NAME`). On a checksum mismatch, an error or a
+    cancel, the previous installation in *output_path* is left untouched.
+
+    The download is resumed from a previous partial *zip_path*, only when
+    there is a *sha256* to verify it against. *on_progress* is called with
+    ``(received, total)`` bytes and *is_canceled* polled, both from the
+    calling thread, about ten times per second. The other *options* are
+    passed to :class:`SegmentedDownload`.
+
+    :return: the dict of :func:`extract_zip` plus the ``skipped`` (in use,
+        not replaced), ``removed`` and ``locked`` (in use, not removed) files,
+        or ``None`` if canceled (the partial archive is kept for a later
+        resume).
+    :raises Exception: on download, checksum or extraction errors.
+    """
+    staging_path = os.path.normpath(output_path) + ".staging"
+    manifest_path = os.path.join(output_path, MANIFEST_NAME)
+    old_manifest = load_manifest(manifest_path)
+    os.makedirs(os.path.dirname(os.path.abspath(zip_path)), exist_ok=True)
+    shutil.rmtree(staging_path, ignore_errors=True)
+
+    download = SegmentedDownload(url, zip_path, **options)
+    if not sha256:
+        # a partial archive that cannot be verified is not trusted, the download starts over
+        download.remove_state()
+    download.start()
+
+    result = {}
+
+    def _extract():
+        try:
+            if download.ranges:
+                with _DownloadReader(download) as reader:
+                    reader = io.BufferedReader(reader, CHUNK_SIZE // 8)
+                    result["files"] = extract_zip(reader, staging_path, old_manifest, installed_path=output_path)
+            else:
+                # the central directory is at the end of the ZIP, wait for the whole stream
+                download.wait_available(0, float("inf"))
+                result["files"] = extract_zip(zip_path, staging_path, old_manifest, installed_path=output_path)
+        except DownloadCanceled:
+            pass
+        except Exception as err:
+            result["error"] = err
+            download.cancel()
+
+    try:
+        extractor = threading.Thread(target=_extract, daemon=True)
+        extractor.start()
+        while extractor.is_alive():
+            if is_canceled is not None and is_canceled():
+                download.cancel()
+            if on_progress is not None:
+                on_progress(download.received, download.size)
+            extractor.join(0.1)
+
+        if "error" in result:
+            raise result["error"]
+        if download.canceled:
+            return None
+        download.join()
+
+        files = result["files"]
+        if sha256 and file_sha256(zip_path) != sha256.lower():
+            download.remove_state()
+            os.remove(zip_path)
+            raise ValueError(f"Checksum mismatch for {url}, the installation was not modified")
+
+        # the new manifest is saved only once the files are installed, the old one is kept on failure
+        os.makedirs(output_path, exist_ok=True)
+        files["skipped"] = install_staged_files(staging_path, output_path, files["extracted"])
+        for name in files["skipped"]:
+            # keep the entry of the old file, so the next upgrade replaces it
+            files["manifest"][name] = (old_manifest or {}).get(name, [0, 0])
+        stale = get_stale_files(output_path, files["manifest"], old_manifest)
+        files["locked"] = remove_files(output_path, stale)
+        files["removed"] = [name for name in stale if name not in files["locked"]]
+        # the locked stale files stay in the manifest, to be removed by the next upgrade
+        manifest = dict(files["manifest"], **{name: (old_manifest or {}).get(name, [0, 0]) for name in files["locked"]})
+        save_manifest(manifest_path, manifest)
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+    download.remove_state()
+    os.remove(zip_path)
+    return files
@@ -21,11 +21,6 @@
 import configparser
 import os
 import platform
-import shutil
-import ssl
-import tempfile
-import urllib.request
-import zipfile
 
 from qgis.core import Qgis, QgsApplication, QgsMessageLog
 from qgis.PyQt.QtCore import Qt
@@ -40,6 +35,8 @@ from qgis.PyQt.QtWidgets import (
     QVBoxLayout,
 )
 
+from Coregistration.utils import downloader
+
 # ---------------------------------------------------------------------------
 # Extra-libs download configuration
 # ---------------------------------------------------------------------------
@@ -80,8 +77,13 @@ def _get_extlibs_url() -> str:
 
     If the running Python's version is not in ``SUPPORTED_PY_VERSIONS``, the
     URL falls back to the highest published version. A warning is logged so
-    the user knows the bundled libs might not be a perfect match.
+    the user knows the bundled libs might not be a perfect match. The
+    ``COREGISTRATION_EXTLIBS_URL`` environment variable overrides the URL.
     """
+    # e.g. a local HTTP server with a copy of the release assets, for offline tests
+    if os.environ.get("COREGISTRATION_EXTLIBS_URL"):
+        return os.environ["COREGISTRATION_EXTLIBS_URL"]
+
     major, minor = platform.python_version_tuple()[:2]
     py = f"{major}.{minor}"
     if py not in SUPPORTED_PY_VERSIONS:
@@ -105,7 +107,15 @@ def _get_extlibs_url() -> str:
 
 
 class DownloadAndUnzip(QDialog):
-    """Modal dialog that downloads a ZIP from *url* and extracts it to *output_path*."""
+    """Modal dialog that downloads a ZIP from *url* and extracts it to *output_path*.
+
+    The archive is downloaded over parallel range requests and extracted
+    while it downloads into a staging folder (see
+    :mod:`Coregistration.utils.downloader`), then installed into
+    *output_path* once it is checked against the SHA-256 published next to it
+    (``<zip>.sha256``), when there is one. A broken or canceled download is
+    kept in the plugin folder and resumed by the next attempt.
+    """
 
     def __init__(self, url: str, output_path: str, parent=None):
         super().__init__(parent)
@@ -117,9 +127,11 @@ class DownloadAndUnzip(QDialog):
 
         self.url = url
         self.output_path = output_path
-        self._zip_fd: int | None = None
-        self._zip_path: str | None = None
+        # fixed path in the plugin folder of the QGIS profile (not the shared temporary folder), so an
+        # interrupted download is resumed by the next attempt
+        self._zip_path = os.path.join(os.path.dirname(output_path), "extlibs_download", os.path.basename(url))
         self._cancelled = False
+        self.restart_required = False
 
         self.progress_label = QLabel("Downloading additional libraries...", self)
         self.progress_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -148,12 +160,9 @@ class DownloadAndUnzip(QDialog):
         self.show()
         QApplication.processEvents()
 
-        self._zip_fd, self._zip_path = tempfile.mkstemp(suffix=".zip")
-
-        downloaded_ok = self.download_file()
-        extracted_ok = (not self._cancelled) and downloaded_ok and self.extract_zip()
+        installed_ok = self.download_and_extract()
 
-        if extracted_ok:
+        if installed_ok:
             self.progress_label.setText("Done!")
             self.progress_bar.setValue(100)
         elif not self._cancelled:
@@ -174,100 +183,63 @@ class DownloadAndUnzip(QDialog):
 
     def _on_cancel(self) -> None:
         self._cancelled = True
-        self._cleanup()
 
     def _cleanup(self) -> None:
-        """Release the temporary ZIP file and close the dialog."""
-        if self._zip_fd is not None:
-            try:
-                os.close(self._zip_fd)
-            except OSError:
-                pass
-            self._zip_fd = None
-
-        if self._zip_path and os.path.exists(self._zip_path):
-            try:
-                os.remove(self._zip_path)
-            except OSError:
-                pass
-            self._zip_path = None
-
+        """Close the dialog."""
         try:
             self.deleteLater()
             self.accept()
         except RuntimeError:
             pass
 
-    def download_file(self) -> bool:
-        """Download ``self.url`` into the temporary ZIP file.
+    def _on_progress(self, received: int, total: int | None) -> None:
+        # Use indeterminate mode when the size is unknown
+        self.progress_bar.setRange(0, 100 if total else 0)
+        if total:
+            self.progress_bar.setValue(int(received * 100 / total))
+            self.progress_label.setText(
+                f"Downloading and extracting additional libraries... {received / 1e6:.0f} of {total / 1e6:.0f} MB"
+            )
+        QApplication.processEvents()
+
+    def download_and_extract(self) -> bool:
+        """Download ``self.url`` and extract it to ``self.output_path`` at the same time.
 
         Returns ``True`` on success, ``False`` on error or cancellation.
         """
-        if self._zip_path is None:
-            return False
         try:
-            req = urllib.request.Request(self.url, headers={"User-Agent": "Coregistration-Plugin"})
-            with urllib.request.urlopen(req, timeout=60, context=ssl.create_default_context()) as response:  # nosec B310
-                raw_length = response.getheader("Content-Length")
-                total_length: int | None = int(raw_length) if raw_length else None
-                # Use indeterminate mode when Content-Length is not provided
-                self.progress_bar.setRange(0, 100 if total_length else 0)
-
-                with open(self._zip_path, "wb") as fh:
-                    downloaded = 0
-                    while not self._cancelled:
-                        chunk = response.read(8192)
-                        if not chunk:
-                            break
-                        fh.write(chunk)
-                        downloaded += len(chunk)
-                        if total_length:
-                            self.progress_bar.setValue(int(downloaded * 100 / total_length))
-                        QApplication.processEvents()
-
-            self.progress_bar.setRange(0, 100)
-            return not self._cancelled
+            sha256 = downloader.fetch_sha256(self.url)
+            if sha256 is None:
+                _log("No published checksum for the extra libraries, the download is not verified.", level="Warning")
+            files = downloader.download_and_extract(
+                self.url,
+                self._zip_path,
+                self.output_path,
+                sha256=sha256,
+                on_progress=self._on_progress,
+                is_canceled=lambda: self._cancelled,
+            )
         except Exception as exc:
-            _log(f"Download error: {exc}", level="Critical")
-            return False
-
-    def extract_zip(self) -> bool:
-        """Extract the downloaded ZIP to ``self.output_path``.
-
-        All member paths are validated against *output_path* before any file
-        is written (zip-slip attack prevention).  On Windows, DLLs that are
-        currently loaded by QGIS cannot be overwritten; those files are skipped
-        with a warning so the rest of the extraction still completes.
-        """
-        if self._zip_path is None:
+            _log(f"Download/extraction error: {exc}", level="Critical")
             return False
-        self.progress_label.setText("Extracting libraries...")
-        QApplication.processEvents()
-        try:
-            real_output = os.path.realpath(self.output_path)
-            skipped = 0
-            with zipfile.ZipFile(self._zip_path, "r") as zf:
-                for member in zf.infolist():
-                    member_dest = os.path.realpath(os.path.join(real_output, member.filename))
-                    if not (member_dest == real_output or member_dest.startswith(real_output + os.sep)):
-                        raise ValueError(f"Zip-slip rejected for entry: {member.filename!r}")
-                    try:
-                        zf.extract(member, real_output)
-                    except PermissionError:
-                        # On Windows, in-use DLLs cannot be overwritten; keep the
-                        # existing file and continue extracting the remaining members.
-                        _log(f"Skipping locked file (in use): {member.filename}", level="Warning")
-                        skipped += 1
-            if skipped:
-                _log(
-                    f"{skipped} file(s) could not be replaced because they are in use. "
-                    "Restart QGIS to complete the installation.",
-                    level="Warning",
-                )
-            return True
-        except Exception as exc:
-            _log(f"Extraction error: {exc}", level="Critical")
+        if files is None:
+            _log("Download canceled, it will be resumed by the next installation attempt.")
             return False
+        _log(
+            f"Extra libs installed: {len(files['extracted'])} file(s) updated, {len(files['unchanged'])} unchanged, "
+            f"{len(files['removed'])} removed."
+        )
+        for name in files["skipped"] + files["locked"]:
+            # On Windows, in-use DLLs cannot be replaced or removed; the existing file is kept
+            _log(f"Skipping locked file (in use): {name}", level="Warning")
+        self.restart_required = bool(files["skipped"] or files["locked"])
+        if self.restart_required:
+            _log(
+                f"{len(files['skipped']) + len(files['locked'])} file(s) could not be replaced because they are "
+                "in use. Restart QGIS to complete the installation.",
+                level="Warning",
+            )
+        return True
 
 
 def get_extlibs_install_path() -> str:
@@ -282,28 +254,25 @@ def get_extlibs_install_path() -> str:
 
 
 def install() -> None:
-    """Download and install the extra Python libraries required by this plugin."""
+    """Download and install the extra Python libraries required by this plugin.
+
+    An existing installation is upgraded in place: only the files that
+    changed, were added or were removed in the new archive are touched, so the
+    unchanged libraries loaded by QGIS (e.g. DLLs locked on Windows) do not
+    block the upgrade.
+    """
     extlibs_dir = get_extlibs_install_path()
-    if os.path.isdir(extlibs_dir):
-        _log(f"Removing existing extlibs at: {extlibs_dir}")
-        shutil.rmtree(extlibs_dir, ignore_errors=True)
-        if os.path.isdir(extlibs_dir):
-            # On Windows, DLLs currently loaded by QGIS cannot be deleted.
-            _log(
-                "Some extlibs files could not be removed (in use). Restart QGIS to complete installation.",
-                level="Warning",
-            )
-            QMessageBox.information(
-                None,
-                "Co-Registration Plugin: Restart required",
-                "Some library files are currently in use and could not be replaced.\n\n"
-                "Please restart QGIS to complete the installation of Co-Registration plugin.",
-                QMessageBox.StandardButton.Ok,
-            )
-            return
     os.makedirs(extlibs_dir, exist_ok=True)
 
     url = _get_extlibs_url()
     _log(f"Installing extra libs to: {extlibs_dir}")
     _log(f"Download URL: {url}")
-    DownloadAndUnzip(url, extlibs_dir)
+    dialog = DownloadAndUnzip(url, extlibs_dir)
+    if dialog.restart_required:
+        QMessageBox.information(
+            None,
+            "Co-Registration Plugin: Restart required",
+            "Some library files are currently in use and could not be replaced.\n\n"
+            "Please restart QGIS to complete the installation of Co-Registration plugin.",
+            QMessageBox.StandardButton.Ok,
+        )
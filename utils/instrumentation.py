@@ -0,0 +1,219 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import json
+import os
+import platform
+import time
+from contextlib import contextmanager
+
+from Coregistration.utils.system_utils import get_io_counters, get_worker_io_counters
+
+_MB = 1024 * 1024
+
+# elapsed seconds of the plugin startup steps, in the order they ran
+startup_times = {}
+
+
+def _get_io_counters():
+    """Return the bytes read and written so far by this process and its worker processes, ``(None, None)`` if unknown.
+
+    The worker processes count once their task is done (see
+    :func:`get_worker_io_counters`).
+    """
+    bytes_read, bytes_written = get_io_counters()
+    if bytes_read is None:
+        return None, None
+    workers_read, workers_written = get_worker_io_counters()
+    return bytes_read + workers_read, bytes_written + workers_written
+
+
+def _get_memory():
+    """Return the resident and peak resident memory of this process in bytes, ``None`` where unknown.
+
+    The peak is since the process started. It is never reset, as it is shared
+    by all the algorithms running in the QGIS process.
+    """
+    system = platform.system()
+    try:
+        if system == "Linux":
+            memory = {}
+            with open("/proc/self/status", encoding="ascii") as fh:
+                for line in fh:
+                    if line.startswith(("VmRSS:", "VmHWM:")):
+                        memory[line[:5]] = int(line.split()[1]) * 1024
+            return memory.get("VmRSS"), memory.get("VmHWM")
+        if system == "Windows":
+            import ctypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [
+                    ("cb", ctypes.c_ulong),
+                    ("PageFaultCount", ctypes.c_ulong),
+                    ("PeakWorkingSetSize", ctypes.c_size_t),
+                    ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t),
+                    ("PeakPagefileUsage", ctypes.c_size_t),
+                ]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(PROCESS_MEMORY_COUNTERS)
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+                return int(counters.WorkingSetSize), int(counters.PeakWorkingSetSize)
+        else:
+            return None, _get_max_rss("RUSAGE_SELF")
+    except (OSError, ValueError, AttributeError, ImportError):
+        pass
+    return None, None
+
+
+def _get_max_rss(who):
+    """Return ``ru_maxrss`` of ``resource.getrusage`` for *who* in bytes, ``None`` where unknown (Windows).
+
+    For ``RUSAGE_CHILDREN`` it is the peak resident memory of the largest
+    child process that ended (e.g. the AROSICS worker processes).
+    """
+    try:
+        import resource
+
+        peak = resource.getrusage(getattr(resource, who)).ru_maxrss
+    except (ImportError, AttributeError, OSError, ValueError):
+        return None
+    # bytes on macOS, kilobytes on the other Unix
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+class StageProfiler:
+    """Records the elapsed time, bytes read and written and memory of the stages of an algorithm.
+
+    Stages run one after the other: :meth:`start` closes the current stage, if
+    any, and opens the next one; :meth:`stop` closes the last one. The bytes
+    read and written are those of the QGIS process (all its threads) plus
+    those of the tasks run in worker processes, reported back by the workers.
+    The memory measures are for the QGIS process, without resetting anything, so
+    algorithms running in parallel do not disturb each other: the change of
+    resident memory during the stage and the peak of the process. The peak
+    memory of the worker processes that ended during the stage (e.g. AROSICS
+    run in a child process) is reported apart, where the platform tells it.
+    """
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        self.stages = []
+        self._current = None
+        self._start_time = time.perf_counter()
+
+    def start(self, name):
+        """Close the current stage and start the stage *name*."""
+        self.stop()
+        bytes_read, bytes_written = _get_io_counters()
+        self._current = {
+            "name": name,
+            "start": time.perf_counter(),
+            "bytes_read": bytes_read,
+            "bytes_written": bytes_written,
+            "resident_memory": _get_memory()[0],
+            "workers_peak_memory": _get_max_rss("RUSAGE_CHILDREN"),
+        }
+
+    def stop(self):
+        """Close the current stage, if any."""
+        if self._current is None:
+            return
+        current, self._current = self._current, None
+        bytes_read, bytes_written = _get_io_counters()
+        resident_memory, peak_memory = _get_memory()
+        workers_peak_memory = _get_max_rss("RUSAGE_CHILDREN")
+        if resident_memory is None or current["resident_memory"] is None:
+            memory_change = None
+        else:
+            memory_change = resident_memory - current["resident_memory"]
+        # the peak of the children only grows, a worker of this stage shows up if it raised it
+        if workers_peak_memory is None or workers_peak_memory == current["workers_peak_memory"]:
+            workers_peak_memory = None
+        self.stages.append(
+            {
+                "name": current["name"],
+                "seconds": time.perf_counter() - current["start"],
+                "bytes_read": None if bytes_read is None else bytes_read - current["bytes_read"],
+                "bytes_written": None if bytes_written is None else bytes_written - current["bytes_written"],
+                "memory_change": memory_change,
+                "peak_memory": peak_memory,
+                "workers_peak_memory": workers_peak_memory,
+            }
+        )
+
+    def summary(self):
+        """Return the stages and totals as a dict, ready to be saved as JSON."""
+        self.stop()
+        return {
+            "algorithm": self.algorithm,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "host": platform.node(),
+            "pid": os.getpid(),
+            "total_seconds": time.perf_counter() - self._start_time,
+            "stages": self.stages,
+        }
+
+    def report(self, feedback, stats_file=None):
+        """Write the summary of the stages to the processing log and, if given, to the JSON *stats_file*."""
+        summary = self.summary()
+
+        def format_bytes(value):
+            return "-" if value is None else f"{value / _MB:.1f} MB"
+
+        feedback.pushInfo("\nProcessing statistics:")
+        for stage in summary["stages"]:
+            workers = stage["workers_peak_memory"]
+            feedback.pushInfo(
+                f"  {stage['name']}: {stage['seconds']:.2f} s, read {format_bytes(stage['bytes_read'])}, "
+                f"written {format_bytes(stage['bytes_written'])}, "
+                f"memory change {format_bytes(stage['memory_change'])}, "
+                f"process peak {format_bytes(stage['peak_memory'])}"
+                + ("" if workers is None else f", worker process peak {format_bytes(workers)}")
+            )
+        feedback.pushInfo(f"  total: {summary['total_seconds']:.2f} s")
+
+        if stats_file:
+            with open(stats_file, "w", encoding="utf-8") as fh:
+                json.dump(summary, fh, indent=2)
+            feedback.pushInfo(f"Statistics saved in: {stats_file}")
+
+
+@contextmanager
+def startup_timer(name):
+    """Record the elapsed time of the plugin startup step *name* in :data:`startup_times`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_times[name] = startup_times.get(name, 0.0) + time.perf_counter() - start
+
+
+def format_startup_times():
+    """Return a one-line summary of the plugin startup steps, e.g. for the QGIS message log."""
+    total = sum(startup_times.values())
+    steps = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in startup_times.items())
+    return f"Plugin startup: {total * 1000:.0f} ms ({steps})"
@@ -0,0 +1,648 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import math
+import os
+import platform
+import shutil
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from osgeo import gdal
+
+# Performance profiles of the GDAL warp, as (display name, settings):
+#   threads: warp and compression threads, warp_memory_mb: warp working buffer,
+#   cache_mb: GDAL block cache, block_size: tile size of the output,
+#   compress: compression of the output, predictor: use a predictor with it
+PERFORMANCE_PROFILES = (
+    (
+        "Balanced",
+        {"threads": "ALL_CPUS", "warp_memory_mb": 512, "cache_mb": 512, "block_size": 256, "compress": "LZW"},
+    ),
+    (
+        "Fast",
+        {"threads": "ALL_CPUS", "warp_memory_mb": 2048, "cache_mb": 1024, "block_size": 512, "compress": None},
+    ),
+    (
+        "Small output",
+        {
+            "threads": "ALL_CPUS",
+            "warp_memory_mb": 512,
+            "cache_mb": 512,
+            "block_size": 256,
+            "compress": "ZSTD",
+            "predictor": True,
+        },
+    ),
+)
+
+# Output modes of pan_raster, in the order of the output mode options of the panning algorithms
+OUTPUT_MODE_FULL_COPY = 0
+OUTPUT_MODE_VRT = 1
+OUTPUT_MODE_GEOTRANSFORM_COPY = 2
+
+
+def shift_geotransform(gt, x_shift_map, y_shift_map):
+    """Return *gt* with its origin moved by the given shift in map units."""
+    gtl = list(gt)
+    gtl[0] = gtl[0] + x_shift_map  # Move horizontal
+    gtl[3] = gtl[3] + y_shift_map  # Move vertical
+    return tuple(gtl)
+
+
+def is_grid_aligned(gt, ref_gt, tolerance=1e-6):
+    """Return ``True`` if the pixel grid of *gt* matches the pixel grid of *ref_gt*.
+
+    Both grids must have the same pixel size, no rotation, and origins that
+    differ by a whole number of pixels (within *tolerance* pixels).
+    """
+    if gt[2] or gt[4] or ref_gt[2] or ref_gt[4]:
+        return False
+    if abs(gt[1] - ref_gt[1]) > tolerance * abs(ref_gt[1]) or abs(gt[5] - ref_gt[5]) > tolerance * abs(ref_gt[5]):
+        return False
+    col_offset = (gt[0] - ref_gt[0]) / ref_gt[1]
+    row_offset = (gt[3] - ref_gt[3]) / ref_gt[5]
+    return abs(col_offset - round(col_offset)) <= tolerance and abs(row_offset - round(row_offset)) <= tolerance
+
+
+def get_aligned_bounds(gt, x_size, y_size, ref_gt, x_res, y_res):
+    """Return the bounds ``(min_x, min_y, max_x, max_y)`` covering a raster, snapped to a reference grid.
+
+    :param gt: geotransform of the raster (without rotation).
+    :param x_size: number of columns of the raster.
+    :param y_size: number of rows of the raster.
+    :param ref_gt: geotransform of the reference grid, only its origin is used.
+    :param x_res: pixel width of the output grid.
+    :param y_res: pixel height of the output grid (positive).
+    """
+    min_x, max_y = gt[0], gt[3]
+    max_x = min_x + x_size * gt[1]
+    min_y = max_y + y_size * gt[5]
+    min_x = ref_gt[0] + math.floor((min_x - ref_gt[0]) / x_res) * x_res
+    max_x = ref_gt[0] + math.ceil((max_x - ref_gt[0]) / x_res) * x_res
+    min_y = ref_gt[3] - math.ceil((ref_gt[3] - min_y) / y_res) * y_res
+    max_y = ref_gt[3] - math.floor((ref_gt[3] - max_y) / y_res) * y_res
+    return min_x, min_y, max_x, max_y
+
+
+def create_shifted_vrt(src_file, dst_file, gt):
+    """Write a VRT referencing *src_file* with the geotransform replaced by *gt*.
+
+    No pixel data is copied, so this takes milliseconds whatever the size of
+    the source.
+    """
+    vrt_ds = gdal.Translate(dst_file, src_file, format="VRT")
+    vrt_ds.SetGeoTransform(tuple(gt))
+    vrt_ds.FlushCache()
+    vrt_ds = None
+
+
+def set_geotransform(file_path, gt):
+    """Write a new geotransform into *file_path*, touching only its header.
+
+    Any ``.aux.xml`` sidecar is removed so it cannot override the new value.
+    """
+    update_ds = gdal.Open(file_path, gdal.GA_Update)
+    update_ds.SetGeoTransform(tuple(gt))
+    update_ds.FlushCache()
+    update_ds = None
+
+    if os.path.isfile(file_path + ".aux.xml"):
+        os.remove(file_path + ".aux.xml")
+
+
+def _reflink(src_file, dst_file):
+    """Clone *src_file* into *dst_file* sharing the data blocks (copy-on-write).
+
+    Supported on Linux (Btrfs, XFS, ...) through the FICLONE ioctl and on
+    macOS (APFS) through clonefile(). Returns ``False`` when not possible.
+    """
+    system = platform.system()
+    try:
+        if system == "Linux":
+            import fcntl
+
+            ficlone = 0x40049409
+            with open(src_file, "rb") as src, open(dst_file, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), ficlone, src.fileno())
+            return True
+        if system == "Darwin":
+            import ctypes
+
+            libc = ctypes.CDLL("libc.dylib", use_errno=True)
+            if os.path.exists(dst_file):
+                os.remove(dst_file)
+            return libc.clonefile(os.fsencode(src_file), os.fsencode(dst_file), 0) == 0
+    except (OSError, AttributeError):
+        pass
+    if os.path.isfile(dst_file) and os.path.getsize(dst_file) == 0:
+        os.remove(dst_file)
+    return False
+
+
+def copy_raster_files(src_file, dst_file):
+    """Copy all the files of the raster *src_file* (e.g. ENVI header) to *dst_file*.
+
+    Files are cloned (reflink) when the file system supports it, which is
+    instantaneous and uses no extra disk space, otherwise they are copied.
+    The ``.aux.xml`` sidecar is not copied.
+    """
+    src_ds = gdal.Open(src_file, gdal.GA_ReadOnly)
+    src_files = src_ds.GetFileList() or [src_file]
+    src_ds = None
+
+    src_stem = os.path.splitext(src_file)[0]
+    dst_stem = os.path.splitext(dst_file)[0]
+    for file_path in src_files:
+        if file_path.endswith(".aux.xml"):
+            continue
+        if file_path == src_file:
+            dst_path = dst_file
+        elif file_path.startswith(src_stem):
+            dst_path = dst_stem + file_path[len(src_stem) :]
+        else:
+            continue
+        if not _reflink(file_path, dst_path):
+            shutil.copyfile(file_path, dst_path)
+
+
+def get_output_names(files_in, suffix, extension=None):
+    """Return the output file name of each of *files_in*, ``<input name><suffix><extension>``.
+
+    Inputs with the same name in different folders (e.g. ``dem.tif`` in one
+    folder per tile) get the name of their folder added,
+    ``<input name>_<folder><suffix><extension>``, and a counter if that is
+    still not unique, so the outputs of a batch never overwrite each other.
+    The names do not depend on the other inputs being processed or skipped.
+    *extension* defaults to the extension of each input.
+    """
+
+    def get_name(file_in, tag=""):
+        stem, input_extension = os.path.splitext(os.path.basename(file_in))
+        return stem + tag + suffix + (input_extension if extension is None else extension)
+
+    # case-insensitive, as the file names on Windows and macOS
+    counts = Counter(get_name(file_in).lower() for file_in in files_in)
+    names = []
+    used = set()
+    for file_in in files_in:
+        output_name = get_name(file_in)
+        if counts[output_name.lower()] > 1:
+            folder = os.path.basename(os.path.dirname(os.path.abspath(file_in)))
+            output_name = get_name(file_in, f"_{folder}")
+            index = 2
+            while output_name.lower() in used or output_name.lower() in counts:
+                output_name = get_name(file_in, f"_{folder}_{index}")
+                index += 1
+        used.add(output_name.lower())
+        names.append(output_name)
+    return names
+
+
+def get_performance_settings(profile, threads=0, warp_memory_mb=0, creation_options=None):
+    """Return the settings of a performance profile with the given overrides applied.
+
+    :param profile: index in :data:`PERFORMANCE_PROFILES`.
+    :param threads: number of threads, 0 to keep the profile value.
+    :param warp_memory_mb: warp working buffer in MB, 0 to keep the profile value.
+    :param creation_options: list of ``KEY=VALUE`` creation options that
+        override the ones of the profile.
+    """
+    settings = dict(PERFORMANCE_PROFILES[profile][1])
+    if threads:
+        settings["threads"] = str(threads)
+    if warp_memory_mb:
+        settings["warp_memory_mb"] = warp_memory_mb
+    settings["creation_options"] = list(creation_options or [])
+    return settings
+
+
+def _get_compression(driver, compress):
+    """Return *compress* if supported by the GTiff or COG *driver*, falling back to DEFLATE."""
+    available = driver.GetMetadataItem("DMD_CREATIONOPTIONLIST") or ""
+    return compress if compress in available else "DEFLATE"
+
+
+def get_creation_options(driver_name, settings, data_type=gdal.GDT_Byte):
+    """Return the creation options of *driver_name* for the given performance *settings*.
+
+    GTiff outputs are tiled and compressed as set in the profile; COG outputs
+    also get internal overviews, computed while the image is written; HFA
+    (Erdas Imagine) outputs use the block size and compression; other formats
+    (e.g. ENVI, VRT) only get the user creation options. The user creation
+    options of the *settings* override the ones of the profile.
+    """
+    options = {}
+    if driver_name == "GTiff":
+        options.update(
+            {
+                "TILED": "YES",
+                "BLOCKXSIZE": str(settings["block_size"]),
+                "BLOCKYSIZE": str(settings["block_size"]),
+                "BIGTIFF": "IF_SAFER",
+                "NUM_THREADS": settings["threads"],
+            }
+        )
+        if settings.get("compress"):
+            options["COMPRESS"] = _get_compression(gdal.GetDriverByName("GTiff"), settings["compress"])
+            if settings.get("predictor"):
+                is_float = data_type in (gdal.GDT_Float32, gdal.GDT_Float64)
+                options["PREDICTOR"] = "3" if is_float else "2"
+    elif driver_name == "COG":
+        options.update(
+            {
+                "BLOCKSIZE": str(settings["block_size"]),
+                "BIGTIFF": "IF_SAFER",
+                "NUM_THREADS": settings["threads"],
+                "OVERVIEWS": "IGNORE_EXISTING",
+                "OVERVIEW_RESAMPLING": settings.get("overview_resampling", "AVERAGE"),
+                "COMPRESS": "NONE",
+            }
+        )
+        if settings.get("compress"):
+            options["COMPRESS"] = _get_compression(gdal.GetDriverByName("COG"), settings["compress"])
+            if settings.get("predictor"):
+                options["PREDICTOR"] = "YES"
+    elif driver_name == "HFA":
+        options["BLOCKSIZE"] = str(settings["block_size"])
+        options["USE_SPILL"] = "YES"
+        if settings.get("compress"):
+            options["COMPRESSED"] = "YES"
+
+    for option in settings.get("creation_options", []):
+        key, _, value = option.partition("=")
+        options[key.strip().upper()] = value.strip()
+    return [f"{key}={value}" for key, value in options.items()]
+
+
+def get_overview_resampling(resampling_method):
+    """Return the overview resampling for an image resampled with *resampling_method* (GDAL or AROSICS name).
+
+    Categorical data (nearest neighbour or mode resampling) keeps NEAREST,
+    otherwise the overviews are averaged.
+    """
+    categorical = ("nearest", "near", "mode", gdal.GRA_NearestNeighbour, gdal.GRA_Mode)
+    return "NEAREST" if resampling_method in categorical else "AVERAGE"
+
+
+def get_warp_options(settings):
+    """Return the ``gdal.Warp`` keyword arguments for the threading and memory of the performance *settings*."""
+    return {
+        "multithread": True,
+        "warpMemoryLimit": settings["warp_memory_mb"],
+        "warpOptions": [f"NUM_THREADS={settings['threads']}"],
+    }
+
+
+# Sizes (bytes) requested by the active gdal_cache_size() contexts, and the size to restore after them
+_cache_lock = threading.Lock()
+_cache_requests = []
+_cache_original = None
+
+
+@contextmanager
+def gdal_cache_size(cache_mb):
+    """Set the GDAL block cache to at least *cache_mb* MB while the context is active.
+
+    The block cache is process-wide, shared by all the algorithms running in
+    parallel: it is set to the largest size requested by the active contexts,
+    and restored to its original size when the last one exits.
+    """
+    global _cache_original
+    size = cache_mb * 1024 * 1024
+    with _cache_lock:
+        if not _cache_requests:
+            _cache_original = gdal.GetCacheMax()
+        _cache_requests.append(size)
+        gdal.SetCacheMax(max(_cache_requests))
+    try:
+        yield
+    finally:
+        with _cache_lock:
+            _cache_requests.remove(size)
+            gdal.SetCacheMax(max(_cache_requests) if _cache_requests else _cache_original)
+
+
+def get_reference_grid(img_ref):
+    """Return the grid of the reference image as a dict: ``prj``, ``bounds`` and ``x_res``/``y_res``."""
+    ref_ds = gdal.Open(img_ref, gdal.GA_ReadOnly)
+    min_x, x_res, _x_skew, max_y, _y_skew, y_res = ref_ds.GetGeoTransform()
+    max_x = min_x + (ref_ds.RasterXSize * x_res)
+    min_y = max_y + (ref_ds.RasterYSize * y_res)
+    prj = ref_ds.GetProjection()
+    ref_ds = None
+    return {"prj": prj, "bounds": (min_x, min_y, max_x, max_y), "x_res": abs(float(x_res)), "y_res": abs(float(y_res))}
+
+
+def warp_to_grid(file_in, output_file, grid, resampling_method, output_driver_name, settings, nodata=None):
+    """Warp *file_in* onto the reference *grid* (see :func:`get_reference_grid`).
+
+    :param settings: performance settings (see :func:`get_performance_settings`).
+    :param nodata: nodata value of the input and output bands, ``None`` to keep the input one.
+    """
+    input_ds = gdal.Open(file_in, gdal.GA_ReadOnly)
+    src_crs = input_ds.GetProjection()
+    data_type = input_ds.GetRasterBand(1).DataType
+    input_ds = None
+
+    warp_kwargs = {
+        "srcSRS": src_crs,
+        "dstSRS": grid["prj"],
+        "xRes": grid["x_res"],
+        "yRes": grid["y_res"],
+        "resampleAlg": resampling_method,
+        "srcNodata": nodata,
+        "dstNodata": nodata,
+        "outputBounds": grid["bounds"],
+        "targetAlignedPixels": False,
+        **get_warp_options(settings),
+    }
+    creation_options = get_creation_options(output_driver_name, settings, data_type)
+
+    with gdal_cache_size(settings["cache_mb"]):
+        if output_driver_name == "COG":
+            # the COG driver only creates copies: warp lazily through an in-memory VRT, so the image
+            # and its overviews are written in one pass without an intermediate file
+            warped_vrt = f"/vsimem/coregistration_{uuid.uuid4().hex}.vrt"
+            try:
+                gdal.Warp(warped_vrt, file_in, format="VRT", **warp_kwargs)
+                gdal.Translate(output_file, warped_vrt, format="COG", creationOptions=creation_options)
+            finally:
+                gdal.Unlink(warped_vrt)
+        else:
+            gdal.Warp(output_file, file_in, format=output_driver_name, creationOptions=creation_options, **warp_kwargs)
+
+
+def warp_to_grid_blockwise(
+    file_in, output_file, grid, resampling_method, output_driver_name, settings, nodata=None, feedback=None
+):
+    """Warp *file_in* onto the reference *grid* block by block, streaming from the source to *output_file*.
+
+    Every block of the output is warped directly from the source by a bounded
+    pool of threads, each one with its own source handle, while the blocks
+    already warped are written in order. Only a few blocks per thread are held
+    in memory whatever the size of the images, in a single pass without any
+    intermediate file. Requires rasterio; COG and VRT outputs are not supported.
+
+    :param settings: performance settings (see :func:`get_performance_settings`).
+    :param nodata: nodata value of the input and output bands, ``None`` to keep the input one.
+    :param feedback: optional processing feedback, for the progress and cancellation.
+    :return: ``True`` if the output was written, ``False`` if canceled (the
+        partial output is removed).
+    """
+    import rasterio
+    from rasterio.crs import CRS
+    from rasterio.enums import Resampling
+    from rasterio.transform import from_origin
+    from rasterio.vrt import WarpedVRT
+
+    input_ds = gdal.Open(file_in, gdal.GA_ReadOnly)
+    data_type = input_ds.GetRasterBand(1).DataType
+    input_ds = None
+
+    min_x, min_y, max_x, max_y = grid["bounds"]
+    crs = CRS.from_wkt(grid["prj"])
+    transform = from_origin(min_x, max_y, grid["x_res"], grid["y_res"])
+    width = round((max_x - min_x) / grid["x_res"])
+    height = round((max_y - min_y) / grid["y_res"])
+    # GDAL and rasterio share the same resampling codes
+    vrt_options = {
+        "crs": crs,
+        "transform": transform,
+        "width": width,
+        "height": height,
+        "resampling": Resampling(resampling_method),
+        "warp_mem_limit": settings["warp_memory_mb"],
+    }
+    if nodata is not None:
+        vrt_options.update({"src_nodata": nodata, "nodata": nodata})
+
+    with rasterio.open(file_in) as src:
+        profile = {
+            "driver": output_driver_name,
+            "width": width,
+            "height": height,
+            "count": src.count,
+            "dtype": src.dtypes[0],
+            "crs": crs,
+            "transform": transform,
+            "nodata": nodata if nodata is not None else src.nodata,
+        }
+    for option in get_creation_options(output_driver_name, settings, data_type):
+        key, _, value = option.partition("=")
+        profile[key] = value
+
+    threads = (os.cpu_count() or 1) if settings["threads"] == "ALL_CPUS" else int(settings["threads"])
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def read_window(window):
+        # rasterio datasets are not thread safe, every thread warps through its own handle
+        if not hasattr(local, "vrt"):
+            src = rasterio.open(file_in)
+            local.vrt = WarpedVRT(src, **vrt_options)
+            with handles_lock:
+                handles.append((local.vrt, src))
+        return window, local.vrt.read(window=window)
+
+    with gdal_cache_size(settings["cache_mb"]), rasterio.open(output_file, "w", **profile) as dst:
+        windows = [window for _ij, window in dst.block_windows(1)]
+        pending_windows = iter(windows)
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=threads)
+        try:
+            # keep two windows per thread in flight: the one being warped and the next one (read-ahead)
+            for window in pending_windows:
+                pending.append(executor.submit(read_window, window))
+                if len(pending) >= 2 * threads:
+                    break
+            written = 0
+            while pending:
+                window, data = pending.popleft().result()
+                next_window = next(pending_windows, None)
+                if next_window is not None:
+                    pending.append(executor.submit(read_window, next_window))
+                dst.write(data, window=window)
+                written += 1
+                if feedback is not None:
+                    if feedback.isCanceled():
+                        break
+                    feedback.setProgress(100 * written / len(windows))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            for vrt, src in handles:
+                vrt.close()
+                src.close()
+
+    if written < len(windows):
+        for file_path in (output_file, output_file + ".aux.xml"):
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+        return False
+    return True
+
+
+def get_partial_file(output_file):
+    """Return the temporary path where *output_file* is written until it is complete."""
+    stem, extension = os.path.splitext(output_file)
+    return stem + ".partial" + extension
+
+
+def align_raster_worker(task):
+    """Warp one input of a batch onto the reference grid, retrying up to ``max_retries`` times.
+
+    *task* is a dict with the ``file_in`` and ``output_file`` paths and the
+    :func:`warp_to_grid` arguments. The output is written to a temporary file
+    (see :func:`get_partial_file`) renamed to ``output_file`` once complete,
+    so an existing ``output_file`` is never a partial one, even if the worker
+    is killed. A failed output is removed so the input is processed again in
+    a later run. Errors are returned, not raised.
+    """
+    result = {"file_in": task["file_in"], "output_file": task["output_file"], "error": None, "attempts": 0}
+    partial_file = get_partial_file(task["output_file"])
+    start = time.perf_counter()
+    for _attempt in range(1 + task.get("max_retries", 0)):
+        result["attempts"] += 1
+        try:
+            warp_to_grid(
+                task["file_in"],
+                partial_file,
+                task["grid"],
+                task["resampling_method"],
+                task["output_driver_name"],
+                task["settings"],
+                nodata=task.get("nodata"),
+            )
+            if os.path.isfile(partial_file + ".aux.xml"):
+                os.replace(partial_file + ".aux.xml", task["output_file"] + ".aux.xml")
+            os.replace(partial_file, task["output_file"])
+            result["error"] = None
+            break
+        except Exception as err:
+            result["error"] = str(err) or err.__class__.__name__
+            for file_path in (partial_file, partial_file + ".aux.xml"):
+                if os.path.isfile(file_path):
+                    os.remove(file_path)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def pan_raster(
+    file_in,
+    output_file,
+    shift_in_x,
+    shift_in_y,
+    output_mode=OUTPUT_MODE_GEOTRANSFORM_COPY,
+    output_driver_name=None,
+    creation_options=None,
+    feedback=None,
+):
+    """Shift *file_in* by a number of pixels in X and Y.
+
+    With *output_file* ``None`` the geotransform of *file_in* is updated in
+    place. Otherwise *output_mode* is :data:`OUTPUT_MODE_FULL_COPY`,
+    :data:`OUTPUT_MODE_VRT` (a VRT referencing *file_in*) or
+    :data:`OUTPUT_MODE_GEOTRANSFORM_COPY` (a file copy with only the
+    geotransform updated). The output is written with *output_driver_name*, the format of
+    *file_in* by default: a VRT driver always gives a VRT, and a COG or a
+    format different from the input falls back to a full copy, as does a
+    copy whose geotransform cannot be updated. The fallbacks are reported as
+    warnings to the optional *feedback*.
+
+    :return: the output mode used, ``None`` in place.
+    """
+    input_ds = gdal.Open(file_in, gdal.GA_ReadOnly)
+    gt = input_ds.GetGeoTransform()
+    input_driver_name = input_ds.GetDriver().ShortName
+    input_ds = None
+    shifted_gt = shift_geotransform(gt, abs(gt[1]) * shift_in_x, abs(gt[5]) * shift_in_y)
+
+    if output_file is None:
+        # only the header is updated: rewriting the file fails on Windows while QGIS holds it open
+        set_geotransform(file_in, shifted_gt)
+        return None
+
+    def warn(message):
+        if feedback is not None:
+            feedback.pushWarning(f"\n{message}\n")
+
+    output_driver_name = output_driver_name or input_driver_name
+    if output_driver_name == "VRT":
+        output_mode = OUTPUT_MODE_VRT
+    elif output_mode != OUTPUT_MODE_FULL_COPY and output_driver_name == "COG":
+        warn("A COG output requires rewriting the pixel data, making a full copy.")
+        output_mode = OUTPUT_MODE_FULL_COPY
+    elif output_mode == OUTPUT_MODE_GEOTRANSFORM_COPY and output_driver_name != input_driver_name:
+        warn(
+            "The output format is different from the input format, the geotransform-only copy is not "
+            "possible, making a full copy."
+        )
+        output_mode = OUTPUT_MODE_FULL_COPY
+
+    if output_mode == OUTPUT_MODE_VRT:
+        create_shifted_vrt(file_in, output_file, shifted_gt)
+        return output_mode
+    if output_mode == OUTPUT_MODE_GEOTRANSFORM_COPY:
+        try:
+            copy_raster_files(file_in, output_file)
+            set_geotransform(output_file, shifted_gt)
+            return output_mode
+        except Exception as err:
+            warn(f"The geotransform of the copy could not be updated ({err}), making a full copy.")
+            output_mode = OUTPUT_MODE_FULL_COPY
+
+    # copy from a shifted VRT in memory, so the input file itself is never modified
+    shifted_vrt = f"/vsimem/coregistration_{uuid.uuid4().hex}.vrt"
+    create_shifted_vrt(file_in, shifted_vrt, shifted_gt)
+    shifted_ds = gdal.Open(shifted_vrt, gdal.GA_ReadOnly)
+    gdal.GetDriverByName(output_driver_name).CreateCopy(output_file, shifted_ds, options=creation_options or [])
+    shifted_ds = None
+    gdal.Unlink(shifted_vrt)
+
+    if os.path.isfile(output_file + ".aux.xml"):
+        os.remove(output_file + ".aux.xml")
+    return output_mode
+
+
+def pan_raster_worker(task):
+    """Run :func:`pan_raster` for one input of a batch.
+
+    *task* is a dict with the ``file_in`` and ``output_file`` paths and the
+    :func:`pan_raster` arguments. Errors are returned, not raised.
+    """
+    result = {"file_in": task["file_in"], "output_file": task["output_file"] or task["file_in"], "error": None}
+    start = time.perf_counter()
+    try:
+        pan_raster(
+            task["file_in"],
+            task["output_file"],
+            task["shift_in_x"],
+            task["shift_in_y"],
+            output_mode=task.get("output_mode", OUTPUT_MODE_GEOTRANSFORM_COPY),
+        )
+    except Exception as err:
+        result["error"] = str(err) or err.__class__.__name__
+    result["seconds"] = time.perf_counter() - start
+    return result
@@ -18,60 +18,223 @@
  ***************************************************************************/
 """
 
+import multiprocessing
 import os
+import platform
+import queue
+import re
+import signal
 import sys
+import threading
+import time
+import traceback
 import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from contextlib import contextmanager
 
+# line breaks of the output, progress bars rewrite their line with a carriage return
+_LINE_BREAK = re.compile(r"\r\n|\r|\n")
+# progress bar of AROSICS, e.g. "progress: |=====-----| 45.2% Complete  => 0:00:12"
+_PROGRESS = re.compile(r"(\d+(?:\.\d+)?)%\s*Complete")
+
 
 class _FeedbackStream:
-    """File-like object that forwards writes to a QgsProcessingFeedback, line by line."""
+    """File-like object that forwards writes to a QgsProcessingFeedback.
+
+    Lines are buffered and sent together at most every *flush_interval*
+    seconds, as a single log message. The buffered lines are also sent by a
+    timer, so the last lines before a long silent step are not held back.
+    Progress bar lines (AROSICS tie points and iterations) are not logged but
+    parsed into ``feedback.setProgress``, scaled into *progress_range*.
+    """
 
-    def __init__(self, feedback, is_error=False):
+    def __init__(self, feedback, is_error=False, flush_interval=0.25, progress_range=(0, 100)):
         self._feedback = feedback
         self._is_error = is_error
-        self._buffer = ""
+        self._flush_interval = flush_interval
+        self._progress_range = progress_range
+        self._partial = []
+        self._lines = []
+        self._last_flush = time.monotonic()
+        # the timer thread and the writing thread share the buffer
+        self._lock = threading.RLock()
+        self._timer = None
 
     def write(self, text):
         if not text:
-            return
-        self._buffer += text
-        while "\n" in self._buffer:
-            line, self._buffer = self._buffer.split("\n", 1)
-            self._emit(line)
+            return 0
+        parts = _LINE_BREAK.split(text)
+        with self._lock:
+            if len(parts) == 1:
+                self._partial.append(text)
+                return len(text)
+            lines = ["".join(self._partial) + parts[0], *parts[1:-1]]
+            self._partial = [parts[-1]] if parts[-1] else []
+            for line in lines:
+                self._add_line(line)
+            if self._lines:
+                elapsed = time.monotonic() - self._last_flush
+                if elapsed >= self._flush_interval:
+                    self._emit()
+                elif self._timer is None:
+                    self._timer = threading.Timer(self._flush_interval - elapsed, self._timed_flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        return len(text)
 
     def flush(self):
-        if self._buffer:
-            self._emit(self._buffer)
-            self._buffer = ""
+        with self._lock:
+            if self._partial:
+                line, self._partial = "".join(self._partial), []
+                self._add_line(line)
+            self._emit()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+            self._emit()
 
-    def _emit(self, line):
+    def _add_line(self, line):
         if not line.strip():
             return
+        match = _PROGRESS.search(line)
+        if match:
+            start, end = self._progress_range
+            percent = min(float(match.group(1)), 100.0)
+            self._feedback.setProgress(start + (end - start) * percent / 100)
+            return
+        self._lines.append(line)
+
+    def _emit(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._last_flush = time.monotonic()
+        if not self._lines:
+            return
+        text, self._lines = "\n".join(self._lines), []
         if self._is_error:
-            self._feedback.reportError(line, fatalError=False)
+            self._feedback.reportError(text, fatalError=False)
         else:
-            self._feedback.pushInfo(line)
+            self._feedback.pushInfo(text)
 
     def isatty(self):
         return False
 
 
+class _ThreadDispatcher:
+    """Process-wide replacement of stdout or stderr that routes writes by thread.
+
+    Writes of a thread with an active :func:`redirect_output_to_feedback` go
+    to the stream of its innermost redirection, the writes of the other
+    threads go to the original stream.
+    """
+
+    def __init__(self, original, name):
+        self.original = original
+        self._name = name
+
+    def _target(self):
+        streams = getattr(_redirections, self._name, None)
+        return streams[-1] if streams else self.original
+
+    def write(self, text):
+        target = self._target()
+        return target.write(text) if target is not None else len(text)
+
+    def flush(self):
+        target = self._target()
+        if target is not None:
+            target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target() or self.original, name)
+
+
+# per thread stacks of the active redirections ("stdout", "stderr", "warnings")
+_redirections = threading.local()
+_redirection_lock = threading.Lock()
+_redirection_count = 0
+_original_showwarning = None
+
+
+def _dispatch_showwarning(message, category, filename, lineno, file=None, line=None):
+    handlers = getattr(_redirections, "warnings", None)
+    if handlers:
+        handlers[-1](message, category, filename, lineno, file, line)
+    else:
+        _original_showwarning(message, category, filename, lineno, file, line)
+
+
+def _install_dispatchers():
+    global _redirection_count, _original_showwarning
+    with _redirection_lock:
+        if _redirection_count == 0:
+            sys.stdout = _ThreadDispatcher(sys.stdout, "stdout")
+            sys.stderr = _ThreadDispatcher(sys.stderr, "stderr")
+            _original_showwarning = warnings.showwarning
+            warnings.showwarning = _dispatch_showwarning
+        _redirection_count += 1
+
+
+def _uninstall_dispatchers():
+    global _redirection_count
+    with _redirection_lock:
+        _redirection_count -= 1
+        if _redirection_count > 0:
+            return
+        # leave the streams set by someone else in the meantime (e.g. the QGIS Python console)
+        if isinstance(sys.stdout, _ThreadDispatcher):
+            sys.stdout = sys.stdout.original
+        if isinstance(sys.stderr, _ThreadDispatcher):
+            sys.stderr = sys.stderr.original
+        if warnings.showwarning is _dispatch_showwarning:
+            warnings.showwarning = _original_showwarning
+
+
+# module of the progress bars of AROSICS
+_PROGRESS_BAR_MODULE = "py_tools_ds.processing.progress_mon"
+
+
+def _hook_progress_bars():
+    """Point the default output of the AROSICS progress bars to the current ``sys.stderr``.
+
+    ``ProgressBar`` of py_tools_ds binds ``sys.stderr`` as a default argument
+    when it is imported, usually before the output is redirected (and, in a
+    forked child, to the stream of the parent), so its lines would bypass the
+    redirection. A module imported later binds the current stream itself.
+    """
+    module = sys.modules.get(_PROGRESS_BAR_MODULE)
+    progress_bar = getattr(module, "ProgressBar", None)
+    init = getattr(progress_bar, "__init__", None)
+    if getattr(init, "__defaults__", None):
+        init.__defaults__ = tuple(sys.stderr if hasattr(value, "write") else value for value in init.__defaults__)
+
+
 @contextmanager
-def redirect_output_to_feedback(feedback):
-    """Redirect stdout, stderr and Python warnings to a QgsProcessingFeedback."""
+def redirect_output_to_feedback(feedback, progress_range=(0, 100)):
+    """Redirect stdout, stderr and Python warnings of the current thread to a QgsProcessingFeedback.
 
-    stdout_stream = _FeedbackStream(feedback)
-    stderr_stream = _FeedbackStream(feedback, is_error=True)
-    old_stdout, old_stderr = sys.stdout, sys.stderr
-    old_showwarning = warnings.showwarning
+    The redirection only applies to the calling thread, so algorithms running
+    concurrently in other threads keep their own output. The progress bars
+    printed while the context is active move the progress of the feedback
+    within *progress_range*.
+    """
+
+    stdout_stream = _FeedbackStream(feedback, progress_range=progress_range)
+    stderr_stream = _FeedbackStream(feedback, is_error=True, progress_range=progress_range)
 
     def _showwarning(message, category, filename, lineno, file=None, line=None):
         feedback.reportError(f"{category.__name__}: {message}", fatalError=False)
 
-    sys.stdout = stdout_stream
-    sys.stderr = stderr_stream
-    warnings.showwarning = _showwarning
+    redirections = (("stdout", stdout_stream), ("stderr", stderr_stream), ("warnings", _showwarning))
+    for name, target in redirections:
+        if not hasattr(_redirections, name):
+            setattr(_redirections, name, [])
+        getattr(_redirections, name).append(target)
+    _install_dispatchers()
+    _hook_progress_bars()
     try:
         yield
     finally:
@@ -79,12 +242,12 @@ def redirect_output_to_feedback(feedback):
             stdout_stream.flush()
             stderr_stream.flush()
         finally:
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
-            warnings.showwarning = old_showwarning
+            for name, target in redirections:
+                getattr(_redirections, name).remove(target)
+            _uninstall_dispatchers()
 
 
-def get_raster_driver_name_by_extension(file_path):
+def get_raster_driver_name_by_extension(file_path, cog=False):
     file_extension = os.path.splitext(file_path)[1]
     ext = file_extension.lower().lstrip(".")
 
@@ -110,7 +273,430 @@ def get_raster_driver_name_by_extension(file_path):
         "grd": "surfer",
         "ecw": "ECW",
         "sid": "MrSID",
+        "vrt": "VRT",
     }
 
     # Return the driver name or None if not found
-    return driver_map.get(ext)
+    driver_name = driver_map.get(ext)
+    # Cloud Optimized GeoTIFF has its own driver, writing the overviews along with the image
+    if cog and driver_name == "GTiff":
+        return "COG"
+    return driver_name
+
+
+def get_default_cpus():
+    """Return the default number of worker processes: all CPU cores minus one."""
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def get_io_counters():
+    """Return the bytes read and written by this process so far, ``(None, None)`` if unknown.
+
+    Counts all the reads and writes of the process threads (GDAL included),
+    served from disk or from the page cache, but not those of its child
+    processes.
+    """
+    system = platform.system()
+    try:
+        if system == "Linux":
+            counters = {}
+            with open("/proc/self/io", encoding="ascii") as fh:
+                for line in fh:
+                    key, _, value = line.partition(":")
+                    counters[key] = int(value)
+            return counters["rchar"], counters["wchar"]
+        if system == "Windows":
+            import ctypes
+
+            class IO_COUNTERS(ctypes.Structure):
+                _fields_ = [
+                    ("ReadOperationCount", ctypes.c_ulonglong),
+                    ("WriteOperationCount", ctypes.c_ulonglong),
+                    ("OtherOperationCount", ctypes.c_ulonglong),
+                    ("ReadTransferCount", ctypes.c_ulonglong),
+                    ("WriteTransferCount", ctypes.c_ulonglong),
+                    ("OtherTransferCount", ctypes.c_ulonglong),
+                ]
+
+            counters = IO_COUNTERS()
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.kernel32.GetProcessIoCounters(process, ctypes.byref(counters)):
+                return int(counters.ReadTransferCount), int(counters.WriteTransferCount)
+    except (OSError, ValueError, KeyError, AttributeError):
+        pass
+    return None, None
+
+
+# bytes read and written by the tasks of the worker processes, reported back by the workers
+_worker_io = [0, 0]
+_worker_io_lock = threading.Lock()
+
+
+def _add_worker_io(counters):
+    if counters is None:
+        return
+    with _worker_io_lock:
+        _worker_io[0] += counters[0]
+        _worker_io[1] += counters[1]
+
+
+def get_worker_io_counters():
+    """Return the bytes read and written so far by the tasks run in worker processes.
+
+    The workers of :func:`run_in_process_pool` and :func:`run_in_subprocess`
+    measure their own I/O (see :func:`get_io_counters`) and report it back
+    with each task result or stage, as the I/O of a child process is not
+    counted in its parent.
+    """
+    with _worker_io_lock:
+        return tuple(_worker_io)
+
+
+def _get_io_delta(start):
+    """Return the I/O counters since the counters *start*, ``None`` if unknown."""
+    end = get_io_counters()
+    if start[0] is None or end[0] is None:
+        return None
+    return end[0] - start[0], end[1] - start[1]
+
+
+def get_available_memory():
+    """Return the physical memory currently available to new processes, in bytes.
+
+    Returns ``None`` when it cannot be determined on this platform.
+    """
+    system = platform.system()
+    try:
+        if system == "Linux":
+            with open("/proc/meminfo", encoding="ascii") as fh:
+                for line in fh:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) * 1024
+        elif system == "Windows":
+            import ctypes
+
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [
+                    ("dwLength", ctypes.c_ulong),
+                    ("dwMemoryLoad", ctypes.c_ulong),
+                    ("ullTotalPhys", ctypes.c_ulonglong),
+                    ("ullAvailPhys", ctypes.c_ulonglong),
+                    ("ullTotalPageFile", ctypes.c_ulonglong),
+                    ("ullAvailPageFile", ctypes.c_ulonglong),
+                    ("ullTotalVirtual", ctypes.c_ulonglong),
+                    ("ullAvailVirtual", ctypes.c_ulonglong),
+                    ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+                ]
+
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return int(status.ullAvailPhys)
+        else:
+            # macOS and other Unix: no portable "available" figure, use half of
+            # the physical memory as a conservative estimate.
+            return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2
+    except (OSError, ValueError, AttributeError):
+        pass
+    return None
+
+
+def limit_workers_by_memory(cpus, memory_per_worker, shared_memory=0, memory_fraction=0.8):
+    """Reduce *cpus* so that the workers fit into the available memory.
+
+    :param cpus: requested number of workers.
+    :param memory_per_worker: estimated peak memory of one worker, in bytes.
+    :param shared_memory: memory used once regardless of the number of workers, in bytes.
+    :param memory_fraction: fraction of the available memory the workers may use.
+    :return: the number of workers to use, always at least 1.
+    """
+    cpus = max(1, int(cpus))
+    available = get_available_memory()
+    if available is None or memory_per_worker <= 0:
+        return cpus
+    budget = available * memory_fraction - shared_memory
+    return max(1, min(cpus, int(budget // memory_per_worker)))
+
+
+def get_python_executable():
+    """Return the path of the Python interpreter running inside QGIS.
+
+    Inside QGIS ``sys.executable`` usually points to the QGIS binary, not to
+    Python, so child processes started with the *spawn* method would launch a
+    new QGIS instance. Returns ``None`` if the interpreter cannot be found.
+    """
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    names = ("python.exe", "pythonw.exe") if platform.system() == "Windows" else ("python3", "python")
+    for folder in (sys.exec_prefix, os.path.join(sys.exec_prefix, "bin")):
+        for name in names:
+            candidate = os.path.join(folder, name)
+            if os.path.isfile(candidate):
+                return candidate
+    return None
+
+
+def get_start_method():
+    """Return the ``multiprocessing`` start method in use, without fixing it."""
+    start_method = multiprocessing.get_start_method(allow_none=True)
+    if start_method is None:
+        # the first start method listed is the platform default
+        start_method = multiprocessing.get_all_start_methods()[0]
+    return start_method
+
+
+def configure_multiprocessing():
+    """Prepare the ``multiprocessing`` module to start child processes from QGIS.
+
+    Returns ``True`` when child processes can be started safely, ``False`` if
+    the caller should fall back to serial processing.
+    """
+    if get_start_method() == "fork":
+        return True
+    python_executable = get_python_executable()
+    if python_executable is None:
+        return False
+    multiprocessing.set_executable(python_executable)
+    return True
+
+
+def _pool_initializer(initializer, initargs):
+    # The worker inherits the parent's (possibly redirected) streams, do not
+    # forward its output to the QGIS feedback of the parent process.
+    sys.stdout = sys.stderr = open(os.devnull, "w")
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def _run_pool_task(function, task):
+    """Run *function* on *task* in a pool worker, return its result and the I/O of the task."""
+    start = get_io_counters()
+    result = function(task)
+    return result, _get_io_delta(start)
+
+
+def _terminate_executor(executor):
+    """Terminate the worker processes of a ``ProcessPoolExecutor``, without waiting for their tasks."""
+    if hasattr(executor, "terminate_workers"):
+        # Python >= 3.14
+        executor.terminate_workers()
+        return
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        if process.is_alive():
+            process.terminate()
+    executor.shutdown(wait=True, cancel_futures=True)
+
+
+def run_in_process_pool(function, tasks, cpus, feedback, initializer=None, initargs=()):
+    """Run *function* for every item in *tasks* using a pool of *cpus* processes.
+
+    Yields ``(task, result)`` pairs as soon as each task finishes, in completion
+    order. *function* and *initializer* must be module-level functions. With one
+    CPU (or a single task) everything runs serially in the current process. The
+    pool is terminated as soon as the user cancels the processing.
+
+    :raises RuntimeError: if a worker process dies (e.g. a GDAL crash or the
+        out-of-memory killer), instead of waiting for its task forever.
+    """
+    tasks = list(tasks)
+    if cpus <= 1 or len(tasks) <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            if feedback.isCanceled():
+                return
+            yield task, function(task)
+        return
+
+    executor = ProcessPoolExecutor(
+        min(cpus, len(tasks)),
+        mp_context=multiprocessing.get_context(get_start_method()),
+        initializer=_pool_initializer,
+        initargs=(initializer, initargs),
+    )
+    pending = {}
+    try:
+        pending = {executor.submit(_run_pool_task, function, task): task for task in tasks}
+        while pending:
+            if feedback.isCanceled():
+                return
+            finished, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task = pending.pop(future)
+                try:
+                    result, io_counters = future.result()
+                except BrokenProcessPool:
+                    raise RuntimeError(
+                        "A worker process died unexpectedly (crash or out of memory), the processing was stopped. "
+                        "Try again with fewer CPUs."
+                    )
+                _add_worker_io(io_counters)
+                yield task, result
+    finally:
+        if pending:
+            # canceled, failed or the caller stopped early: do not wait for the running tasks
+            _terminate_executor(executor)
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _QueueStream:
+    """File-like object of a child process that sends its writes to the parent through a queue."""
+
+    def __init__(self, queue, kind):
+        self._queue = queue
+        self._kind = kind
+
+    def write(self, text):
+        if text:
+            self._queue.put((self._kind, text))
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def _subprocess_target(queue, function, kwargs):
+    """Run *function* in the child process, sending its output, stages and result to the parent."""
+    if hasattr(os, "setsid"):
+        # own process group, so the workers started by AROSICS are terminated with it
+        os.setsid()
+    sys.stdout = _QueueStream(queue, "stdout")
+    sys.stderr = _QueueStream(queue, "stderr")
+    _hook_progress_bars()
+
+    def _showwarning(message, category, filename, lineno, file=None, line=None):
+        queue.put(("stderr", f"{category.__name__}: {message}\n"))
+
+    warnings.showwarning = _showwarning
+
+    io_start = [get_io_counters()]
+
+    def send_io():
+        # the I/O of the child since the last stage, added to the parent's by the profiler
+        queue.put(("io", _get_io_delta(io_start[0])))
+        io_start[0] = get_io_counters()
+
+    def report_stage(name):
+        send_io()
+        queue.put(("stage", name))
+
+    try:
+        result = function(**kwargs, report_stage=report_stage)
+    except BaseException:
+        send_io()
+        queue.put(("error", traceback.format_exc()))
+    else:
+        send_io()
+        queue.put(("result", result))
+
+
+# Sidecar files written next to the output by some GDAL drivers, with the extension of the output replaced
+_DRIVER_SIDECARS = {"ENVI": (".hdr",), "EHdr": (".hdr", ".prj", ".stx", ".clr")}
+
+
+def _remove_outputs(files, driver_name=None):
+    """Remove the (partial) output *files*, their ``.aux.xml`` and the sidecar files of their *driver_name*."""
+    for file_path in files:
+        stem = os.path.splitext(file_path)[0]
+        candidates = [file_path, file_path + ".aux.xml"]
+        candidates += [stem + extension for extension in _DRIVER_SIDECARS.get(driver_name, ())]
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                try:
+                    os.remove(candidate)
+                except OSError:
+                    pass
+
+
+def _terminate_process(process):
+    """Terminate *process* and, on POSIX, the process group it leads."""
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except OSError:
+            pass
+    process.terminate()
+    process.join(5)
+    if process.is_alive():
+        process.kill()
+
+
+def run_in_subprocess(
+    function, kwargs, feedback, progress_range=(0, 100), on_stage=None, output_files=(), output_driver_name=None
+):
+    """Run ``function(**kwargs, report_stage=...)`` in a child process that is terminated on cancel.
+
+    The output of the child is forwarded to the *feedback* (see
+    :func:`redirect_output_to_feedback`) and the stage names it reports are
+    passed to *on_stage*. *function* must be a module-level function and its
+    arguments and result must be picklable. If the user cancels, or the child
+    fails, the partial *output_files* are removed, with the sidecar files
+    that their *output_driver_name* writes (e.g. the ENVI ``.hdr``). When
+    child processes cannot be started, the function runs in the current
+    process instead.
+
+    :return: the result of *function*, or ``None`` if canceled.
+    :raises RuntimeError: with the traceback of the child if it failed.
+    """
+    on_stage = on_stage or (lambda name: None)
+    if not configure_multiprocessing():
+        with redirect_output_to_feedback(feedback, progress_range=progress_range):
+            return function(**kwargs, report_stage=on_stage)
+
+    mp_context = multiprocessing.get_context(get_start_method())
+    messages = mp_context.Queue()
+    process = mp_context.Process(target=_subprocess_target, args=(messages, function, kwargs))
+    stdout_stream = _FeedbackStream(feedback, progress_range=progress_range)
+    stderr_stream = _FeedbackStream(feedback, is_error=True, progress_range=progress_range)
+
+    def handle_message(kind, value):
+        """Forward an output or stage message of the child, return the final ``(kind, value)`` or ``None``."""
+        if kind == "stdout":
+            stdout_stream.write(value)
+        elif kind == "stderr":
+            stderr_stream.write(value)
+        elif kind == "stage":
+            on_stage(value)
+        elif kind == "io":
+            _add_worker_io(value)
+        else:
+            return kind, value
+        return None
+
+    outcome = None
+    process.start()
+    try:
+        while outcome is None and not feedback.isCanceled():
+            try:
+                kind, value = messages.get(timeout=0.1)
+            except queue.Empty:
+                if not process.is_alive():
+                    # the child may have sent its result right before exiting
+                    while outcome is None:
+                        try:
+                            outcome = handle_message(*messages.get_nowait())
+                        except queue.Empty:
+                            break
+                    if outcome is None:
+                        outcome = ("error", f"The worker process ended unexpectedly (exit code {process.exitcode})")
+                continue
+            outcome = handle_message(kind, value)
+    finally:
+        stdout_stream.flush()
+        stderr_stream.flush()
+        if process.is_alive():
+            _terminate_process(process)
+        process.join()
+        messages.close()
+
+    if outcome is None or outcome[0] == "error":
+        _remove_outputs(output_files, output_driver_name)
+    if outcome is None:
+        feedback.pushInfo("\nCanceled, the worker process was stopped")
+        return None
+    if outcome[0] == "error":
+        raise RuntimeError(f"The worker process failed:\n{outcome[1]}")
+    return outcome[1]
@@ -0,0 +1,496 @@
+"""
+/***************************************************************************
+ Coregistration
+                          A QGIS plugin processing
+ Image co-registration, projection and pixel alignment based on a target image
+                              -------------------
+        copyright            : (C) 2021-2026 by Xavier Corredor Llano, SMByC
+        email                : xavier.corredor.llano@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import json
+import math
+import os
+import sys
+
+from osgeo import gdal, ogr, osr
+
+from Coregistration.utils.coregistration_utils import GDAL_RESAMPLING_NAMES, get_raster_extent, write_geoarray
+from Coregistration.utils.raster_utils import get_aligned_bounds
+
+# Value used by AROSICS for the tie points where the matching failed
+OUT_FILL_VALUE = -9999
+# AROSICS limits the number of GCPs used for warping to keep it tractable
+MAX_GCP_COUNT = 7000
+# Metadata items of the tie points cache (GeoPackage)
+CACHE_KEY_ITEM = "COREGISTRATION_CACHE_KEY"
+CACHE_COREG_INFO_ITEM = "COREGISTRATION_COREG_INFO"
+
+
+def get_overlap_window(img_ref, img_tgt):
+    """Return the overlap of both images as a pixel window ``(col_off, row_off, col_end, row_end)`` of the target."""
+    tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+    gt = tgt_ds.GetGeoTransform()
+    x_size, y_size = tgt_ds.RasterXSize, tgt_ds.RasterYSize
+    tgt_srs = osr.SpatialReference(wkt=tgt_ds.GetProjection())
+    tgt_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    tgt_ds = None
+
+    min_x, min_y, max_x, max_y = get_raster_extent(img_ref, tgt_srs)
+    cols = sorted(((min_x - gt[0]) / gt[1], (max_x - gt[0]) / gt[1]))
+    rows = sorted(((max_y - gt[3]) / gt[5], (min_y - gt[3]) / gt[5]))
+    col_off, row_off = max(0, math.floor(cols[0])), max(0, math.floor(rows[0]))
+    col_end, row_end = min(x_size, math.ceil(cols[1])), min(y_size, math.ceil(rows[1]))
+    if col_end <= col_off or row_end <= row_off:
+        raise ValueError("The reference and target images do not overlap")
+    return col_off, row_off, col_end, row_end
+
+
+def make_tiles(overlap_window, tgt_size, tile_size, grid_res, margin):
+    """Split the overlap window into tiles for tie point matching.
+
+    Each tile has a *core* window, where its tie points are kept, and a larger
+    *read* window that adds *margin* pixels on every side so that the matching
+    windows of the points close to the core border are complete. Tile size,
+    margin and tile origins are multiples of *grid_res*, so all tiles share the
+    same tie point grid.
+
+    :return: list of dicts with the ``core`` and ``read`` pixel windows as
+        ``(col_off, row_off, col_end, row_end)``.
+    """
+    tile_size = max(grid_res, math.ceil(tile_size / grid_res) * grid_res)
+    margin = math.ceil(margin / grid_res) * grid_res
+    col_off, row_off, col_end, row_end = overlap_window
+    x_size, y_size = tgt_size
+
+    tiles = []
+    for core_row in range(row_off // grid_res * grid_res, row_end, tile_size):
+        for core_col in range(col_off // grid_res * grid_res, col_end, tile_size):
+            core = (core_col, core_row, min(core_col + tile_size, col_end), min(core_row + tile_size, row_end))
+            read = (
+                max(0, core[0] - margin),
+                max(0, core[1] - margin),
+                min(x_size, core[2] + margin),
+                min(y_size, core[3] + margin),
+            )
+            tiles.append({"core": core, "read": read})
+    return tiles
+
+
+def match_tile_worker(task):
+    """Compute the tie points of one tile with AROSICS COREG_LOCAL, without outlier filtering.
+
+    *task* is a dict with the image paths, the ``core`` and ``read`` windows of
+    the tile, a ``tmp_dir`` for the tile subsets and the ``options`` passed to
+    COREG_LOCAL. Returns the tie points inside the core window in the pixel
+    coordinates of the full target image, errors are returned, not raised.
+    """
+    result = {"tile": task["tile_id"], "table": None, "error": None}
+    try:
+        from arosics import COREG_LOCAL
+
+        col_off, row_off, col_end, row_end = task["read"]
+        tile_tgt = os.path.join(task["tmp_dir"], f"tile_{task['tile_id']}_tgt.vrt")
+        tile_ref = os.path.join(task["tmp_dir"], f"tile_{task['tile_id']}_ref.vrt")
+        gdal.Translate(
+            tile_tgt, task["img_tgt"], format="VRT", srcWin=[col_off, row_off, col_end - col_off, row_end - row_off]
+        )
+        tgt_ds = gdal.Open(tile_tgt, gdal.GA_ReadOnly)
+        gt = tgt_ds.GetGeoTransform()
+        prj = tgt_ds.GetProjection()
+        tgt_ds = None
+        proj_win = [gt[0], gt[3], gt[0] + (col_end - col_off) * gt[1], gt[3] + (row_end - row_off) * gt[5]]
+        gdal.Translate(tile_ref, task["img_ref"], format="VRT", projWin=proj_win, projWinSRS=prj)
+
+        # the bad data masks must have the extent of their image, they are cut the same way
+        masks = {}
+        if task.get("mask_tgt"):
+            masks["mask_baddata_tgt"] = os.path.join(task["tmp_dir"], f"tile_{task['tile_id']}_mask_tgt.vrt")
+            gdal.Translate(
+                masks["mask_baddata_tgt"],
+                task["mask_tgt"],
+                format="VRT",
+                srcWin=[col_off, row_off, col_end - col_off, row_end - row_off],
+            )
+        if task.get("mask_ref"):
+            masks["mask_baddata_ref"] = os.path.join(task["tmp_dir"], f"tile_{task['tile_id']}_mask_ref.vrt")
+            gdal.Translate(masks["mask_baddata_ref"], task["mask_ref"], format="VRT", projWin=proj_win, projWinSRS=prj)
+
+        CRL = COREG_LOCAL(
+            tile_ref,
+            tile_tgt,
+            tieP_filter_level=0,
+            outFillVal=OUT_FILL_VALUE,
+            CPUs=1,
+            q=True,
+            **masks,
+            **task["options"],
+        )
+        table = CRL.CoRegPoints_table
+        table = table.drop(columns=[c for c in ("geometry",) if c in table.columns])
+        table["X_IM"] = table["X_IM"] + col_off
+        table["Y_IM"] = table["Y_IM"] + row_off
+
+        core_col_off, core_row_off, core_col_end, core_row_end = task["core"]
+        in_core = (
+            (table["X_IM"] >= core_col_off)
+            & (table["X_IM"] < core_col_end)
+            & (table["Y_IM"] >= core_row_off)
+            & (table["Y_IM"] < core_row_end)
+        )
+        result["table"] = table[in_core].reset_index(drop=True)
+    except Exception as err:
+        result["error"] = str(err) or err.__class__.__name__
+    return result
+
+
+def filter_tiepoints(table, min_reliability=60, rs_max_outlier=10, rs_tolerance=2.5):
+    """Run the AROSICS multistage outlier detection over the merged tie points of all tiles.
+
+    Adds the ``L1_OUTLIER``, ``L2_OUTLIER``, ``L3_OUTLIER`` and ``OUTLIER``
+    columns, exactly as COREG_LOCAL does on a single image.
+    """
+    import pandas as pd
+    from arosics.Tie_Point_Grid import Tie_Point_Refiner
+
+    table = table.reset_index(drop=True)
+    table["POINT_ID"] = range(len(table))
+    valid = table[table["ABS_SHIFT"] != OUT_FILL_VALUE]
+    if valid.empty:
+        table["OUTLIER"] = True
+        return table
+
+    TPR = Tie_Point_Refiner(
+        valid, min_reliability=min_reliability, rs_max_outlier=rs_max_outlier, rs_tolerance=rs_tolerance, q=True
+    )
+    filtered, new_columns = TPR.run_filtering(level=3)
+    table = pd.merge(table, filtered[["POINT_ID", *new_columns]], on="POINT_ID", how="outer")
+    for column in new_columns:
+        table[column] = table[column].fillna(True).astype(bool)
+    return table
+
+
+def get_gcp_list(table, max_points=MAX_GCP_COUNT):
+    """Build the GDAL GCPs mapping the target pixels to their corrected map coordinates.
+
+    Only valid tie points that are not flagged as outliers are used.
+    """
+    valid = table[table["ABS_SHIFT"] != OUT_FILL_VALUE]
+    if "OUTLIER" in valid.columns:
+        valid = valid[~valid["OUTLIER"].astype(bool)]
+    if len(valid) > max_points:
+        valid = valid.sample(max_points, random_state=0)
+    return [
+        gdal.GCP(row.X_MAP + row.X_SHIFT_M, row.Y_MAP + row.Y_SHIFT_M, 0, row.X_IM, row.Y_IM)
+        for row in valid.itertuples(index=False)
+    ]
+
+
+def warp_with_tiepoints(
+    img_ref,
+    img_tgt,
+    output_file,
+    table,
+    tmp_dir,
+    output_driver_name,
+    align_grids,
+    match_gsd,
+    resampling_method,
+    warp_memory_mb=512,
+    creation_options=None,
+):
+    """Warp the target image with the validated tie points, block by block.
+
+    The tie points are interpolated with a thin plate spline, as AROSICS
+    DESHIFTER does, so the correction varies across the image (a polynomial
+    fitted through all of them would only keep its global trend). GDAL
+    processes the output in chunks limited by *warp_memory_mb*, so the peak
+    memory does not depend on the size of the image. A COG output is warped
+    through a VRT and written in a single pass with its overviews. The
+    progress is printed as a progress bar line, that :func:`run_in_subprocess`
+    forwards to the feedback.
+    """
+    gcp_list = get_gcp_list(table)
+    if len(gcp_list) < 3:
+        raise ValueError(f"Not enough valid tie points to correct the image ({len(gcp_list)} found, 3 needed)")
+
+    tgt_ds = gdal.Open(img_tgt, gdal.GA_ReadOnly)
+    tgt_gt, tgt_prj = tgt_ds.GetGeoTransform(), tgt_ds.GetProjection()
+    x_size, y_size = tgt_ds.RasterXSize, tgt_ds.RasterYSize
+    nodata = tgt_ds.GetRasterBand(1).GetNoDataValue()
+    tgt_ds = None
+    ref_ds = gdal.Open(img_ref, gdal.GA_ReadOnly)
+    ref_gt, ref_prj = ref_ds.GetGeoTransform(), ref_ds.GetProjection()
+    ref_ds = None
+
+    gcps_vrt = os.path.join(tmp_dir, "target_gcps.vrt")
+    gdal.Translate(gcps_vrt, img_tgt, format="VRT", GCPs=gcp_list, outputSRS=tgt_prj)
+
+    x_res, y_res = (abs(ref_gt[1]), abs(ref_gt[5])) if match_gsd else (abs(tgt_gt[1]), abs(tgt_gt[5]))
+    output_bounds = None
+    same_crs = osr.SpatialReference(wkt=ref_prj).IsSame(osr.SpatialReference(wkt=tgt_prj))
+    if align_grids and same_crs:
+        valid = table[table["ABS_SHIFT"] != OUT_FILL_VALUE]
+        if "OUTLIER" in valid.columns:
+            valid = valid[~valid["OUTLIER"].astype(bool)]
+        mean_gt = list(tgt_gt)
+        mean_gt[0] += float(valid["X_SHIFT_M"].mean())
+        mean_gt[3] += float(valid["Y_SHIFT_M"].mean())
+        output_bounds = get_aligned_bounds(mean_gt, x_size, y_size, ref_gt, x_res, y_res)
+
+    if creation_options is None:
+        creation_options = ["TILED=YES", "BIGTIFF=IF_SAFER"] if output_driver_name == "GTiff" else []
+
+    last_percent = -1
+
+    def progress(complete, _message, _data):
+        nonlocal last_percent
+        percent = int(100 * complete)
+        if percent != last_percent:
+            last_percent = percent
+            sys.stderr.write(f"warp: {percent}% Complete\r")
+        return 1
+
+    warp_file, warp_driver_name = output_file, output_driver_name
+    if output_driver_name == "COG":
+        # the COG driver only creates copies
+        warp_file, warp_driver_name = os.path.join(tmp_dir, "warped.vrt"), "VRT"
+
+    gdal.Warp(
+        warp_file,
+        gcps_vrt,
+        format=warp_driver_name,
+        dstSRS=tgt_prj,
+        xRes=x_res,
+        yRes=y_res,
+        outputBounds=output_bounds,
+        tps=True,
+        resampleAlg=GDAL_RESAMPLING_NAMES.get(resampling_method, resampling_method),
+        srcNodata=nodata,
+        dstNodata=nodata,
+        warpMemoryLimit=warp_memory_mb,
+        multithread=True,
+        creationOptions=creation_options if warp_driver_name != "VRT" else None,
+        callback=progress,
+    )
+    if output_driver_name == "COG":
+        gdal.Translate(output_file, warp_file, format="COG", creationOptions=creation_options, callback=progress)
+
+
+def _write_deshift_output(deshift_results, output_file, output_driver_name, creation_options):
+    # AROSICS writes the output itself, except a COG that is written from the result in memory
+    if output_driver_name == "COG":
+        write_geoarray(deshift_results["GeoArray_shifted"], output_file, "COG", creation_options)
+
+
+def _get_output_options(output_file, output_driver_name):
+    return {
+        "path_out": None if output_driver_name == "COG" else output_file,
+        "fmt_out": output_driver_name,
+        "out_crea_options": ["WRITE_METADATA=NO"],
+    }
+
+
+def coregister_local_task(
+    img_ref, img_tgt, output_file, output_driver_name, options, creation_options=None, report_stage=None
+):
+    """Compute the tie points with AROSICS COREG_LOCAL and correct the target into *output_file*.
+
+    Runs in a child process (see :func:`run_in_subprocess`); *options* are
+    passed to COREG_LOCAL and the stages are sent to *report_stage*.
+
+    :return: a dict with the tie points ``table`` (without geometries) and the
+        ``coreg_info`` of AROSICS (without the GCP list), both picklable.
+    """
+    from arosics import COREG_LOCAL
+
+    report_stage("open inputs (AROSICS)")
+    CRL = COREG_LOCAL(img_ref, img_tgt, **_get_output_options(output_file, output_driver_name), **options)
+    report_stage("window read, FFT matching and outlier filtering")
+    CRL.calculate_spatial_shifts()
+    report_stage("warp and write")
+    deshift_results = CRL.correct_shifts()
+    _write_deshift_output(deshift_results, output_file, output_driver_name, creation_options)
+
+    table = CRL.CoRegPoints_table
+    table = table.drop(columns=[c for c in ("geometry",) if c in table.columns])
+    coreg_info = {k: v for k, v in CRL.coreg_info.items() if k != "GCPList"}
+    return {"table": table, "coreg_info": coreg_info}
+
+
+def deshift_local_task(
+    img_tgt, table, coreg_info, output_file, output_driver_name, options, creation_options=None, report_stage=None
+):
+    """Correct the target into *output_file* with AROSICS DESHIFTER and the given tie points *table*.
+
+    The counterpart of :func:`coregister_local_task` for the cached tie
+    points, *options* are passed to DESHIFTER.
+    """
+    from arosics import DESHIFTER
+
+    report_stage("warp and write")
+    coreg_info = dict(coreg_info, GCPList=get_gcp_list(table))
+    deshift_results = DESHIFTER(
+        img_tgt, coreg_info, **_get_output_options(output_file, output_driver_name), **options
+    ).correct_shifts()
+    _write_deshift_output(deshift_results, output_file, output_driver_name, creation_options)
+
+
+def warp_tiepoints_task(
+    img_ref,
+    img_tgt,
+    output_file,
+    table,
+    tmp_dir,
+    output_driver_name,
+    align_grids,
+    match_gsd,
+    resampling_method,
+    filter_outliers=False,
+    creation_options=None,
+    report_stage=None,
+):
+    """Correct the target into *output_file* with :func:`warp_with_tiepoints` and the tie points *table*.
+
+    Runs in a child process (see :func:`run_in_subprocess`). With
+    *filter_outliers*, the merged tie points of the tiles are filtered first.
+
+    :return: the tie points table used, with its ``OUTLIER`` column.
+    """
+    if filter_outliers:
+        report_stage("outlier filtering")
+        table = filter_tiepoints(table)
+        print(f"{int((~table['OUTLIER']).sum())} valid tie points of {len(table)}")
+    report_stage("warp and write")
+    warp_with_tiepoints(
+        img_ref,
+        img_tgt,
+        output_file,
+        table,
+        tmp_dir,
+        output_driver_name,
+        align_grids,
+        match_gsd,
+        resampling_method,
+        creation_options=creation_options,
+    )
+    return table
+
+
+def get_cache_path(img_tgt):
+    """Return the path of the tie points cache (sidecar GeoPackage) of a target image."""
+    return img_tgt + ".tiepoints.gpkg"
+
+
+def get_cache_key(input_files, **matching_parameters):
+    """Return the key identifying a tie points set, as a JSON string.
+
+    The key changes when any of the *input_files* (dict of name and path,
+    ``None`` paths are ignored) is modified (size or modification time) or any
+    parameter that affects the matching is changed.
+    """
+    key = {"parameters": matching_parameters}
+    for name, img in input_files.items():
+        if img is None:
+            continue
+        stat = os.stat(img)
+        key[name] = {"path": img, "size": stat.st_size, "mtime": stat.st_mtime_ns}
+    return json.dumps(key, sort_keys=True)
+
+
+def _to_json(value):
+    # numpy scalars and arrays found in the AROSICS coreg_info dict
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+def save_tiepoints(cache_path, cache_key, table, srs_wkt, coreg_info=None):
+    """Save the tie points *table* to *cache_path* (GeoPackage) with its cache key.
+
+    *coreg_info* is the AROSICS COREG_LOCAL result dict, stored without the
+    GCP list (rebuilt from the table) so the correction can be applied again
+    with DESHIFTER.
+    """
+    driver = ogr.GetDriverByName("GPKG")
+    if os.path.exists(cache_path):
+        driver.DeleteDataSource(cache_path)
+    ds = driver.CreateDataSource(cache_path)
+    if ds is None:
+        raise OSError(f"Cannot create the tie points cache file: {cache_path}")
+    srs = osr.SpatialReference(wkt=srs_wkt) if srs_wkt else None
+    layer = ds.CreateLayer("tiepoints", srs, ogr.wkbPoint)
+
+    columns = [column for column in table.columns if column != "geometry"]
+    for column in columns:
+        kind = table[column].dtype.kind
+        if kind == "b":
+            field = ogr.FieldDefn(column, ogr.OFTInteger)
+            field.SetSubType(ogr.OFSTBoolean)
+        elif kind in "iu":
+            field = ogr.FieldDefn(column, ogr.OFTInteger64)
+        elif kind == "f":
+            field = ogr.FieldDefn(column, ogr.OFTReal)
+        else:
+            field = ogr.FieldDefn(column, ogr.OFTString)
+        layer.CreateField(field)
+
+    x_index, y_index = columns.index("X_MAP"), columns.index("Y_MAP")
+    layer.StartTransaction()
+    layer_defn = layer.GetLayerDefn()
+    for row in table[columns].itertuples(index=False):
+        feature = ogr.Feature(layer_defn)
+        for column, value in zip(columns, row, strict=True):
+            if hasattr(value, "item"):  # numpy scalar
+                value = value.item()
+            feature.SetField(column, int(value) if isinstance(value, bool) else value)
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(float(row[x_index]), float(row[y_index]))
+        feature.SetGeometry(point)
+        layer.CreateFeature(feature)
+    layer.CommitTransaction()
+
+    ds.SetMetadataItem(CACHE_KEY_ITEM, cache_key)
+    if coreg_info is not None:
+        coreg_info = {k: v for k, v in coreg_info.items() if k != "GCPList"}
+        ds.SetMetadataItem(CACHE_COREG_INFO_ITEM, json.dumps(coreg_info, default=_to_json))
+    ds = None
+
+
+def load_tiepoints(cache_path, cache_key):
+    """Load the tie points cached in *cache_path* if they were computed with *cache_key*.
+
+    :return: ``(table, coreg_info)``, or ``None`` if there is no valid cache.
+        *coreg_info* is ``None`` if it was not stored.
+    """
+    import pandas as pd
+
+    if not os.path.isfile(cache_path):
+        return None
+    ds = ogr.Open(cache_path)
+    if ds is None or ds.GetMetadataItem(CACHE_KEY_ITEM) != cache_key:
+        return None
+    coreg_info = ds.GetMetadataItem(CACHE_COREG_INFO_ITEM)
+    coreg_info = json.loads(coreg_info) if coreg_info else None
+
+    layer = ds.GetLayerByName("tiepoints")
+    layer_defn = layer.GetLayerDefn()
+    fields = [layer_defn.GetFieldDefn(i) for i in range(layer_defn.GetFieldCount())]
+    rows = [[feature.GetField(field.GetName()) for field in fields] for feature in layer]
+    ds = None
+
+    table = pd.DataFrame(rows, columns=[field.GetName() for field in fields])
+    for field in fields:
+        if field.GetSubType() == ogr.OFSTBoolean:
+            table[field.GetName()] = table[field.GetName()].astype(bool)
+    return table, coreg_info